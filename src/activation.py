@@ -0,0 +1,202 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+
+# Activation files are precomputed run environments, written into the
+# install directory of every installed package so that running
+# something from a package needs neither the config parser nor the
+# package database. They come in two forms:
+#   activate.sh   a script for sh compatible shells to source
+#   activate.env  the same variables for lpm itself to read
+# Each variable in activate.env is five NUL terminated fields: the
+# name, 'o' if it replaces the old value or nothing if it extends it,
+# the separator, the values going in front of the old value and those
+# going after it.
+#
+# Reading them is what `lpm run` and `lpm env` do on every call, so this
+# module imports nothing beyond os up front; what only writing needs is
+# imported by the functions doing it.
+
+artifactDir = '.lpm'
+scriptName = 'activate.sh'
+envName = 'activate.env'
+
+# Name of the symlink in packageDir/<name> pointing at the newest
+# installed version.
+currentName = 'current'
+
+_envMagic = b'lpm-activate 1\n'
+
+# Like the imports above, logging is only imported once there is
+# something to log.
+def _log():
+    import logging
+    return logging.getLogger(__name__)
+
+class ActivationException(Exception):
+    pass
+
+# Replace the file at path with one holding data, through a temporary
+# file of its own, so that two lpm writing the same file at once do not
+# write into each other's.
+def _writeFile(path, data):
+    import tempfile
+
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path),
+                                   prefix=os.path.basename(path) + '.',
+                                   suffix='.tmp')
+    try:
+        with open(fd, 'wb') as f:
+            os.chmod(f.fileno(), 0o644)
+            f.write(data)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+def _isShellName(name):
+    return name.isidentifier() and name.isascii()
+
+# Quote s for use inside double quotes.
+def _doubleQuote(s):
+    return ''.join('\\' + c if c in '\\"$`' else c for c in s)
+
+def _shellAssignment(name, var):
+    import shlex
+
+    if var.overwrite:
+        return '%s=%s' % (name, shlex.quote(var.value()))
+
+    sep = var.separator
+    value = ''
+    if var.before:
+        value += shlex.quote(sep.join(var.before))
+        value += '"${%s:+%s$%s}"' % (name, _doubleQuote(sep), name)
+        if var.after:
+            value += shlex.quote(sep + sep.join(var.after))
+    elif var.after:
+        value += '"${%s:+$%s%s}"' % (name, name, _doubleQuote(sep))
+        value += shlex.quote(sep.join(var.after))
+    else:
+        value = '"$%s"' % name
+    return '%s=%s' % (name, value)
+
+# Write the activation files for the variables of a package, a dict
+# mapping names to environment.Composed values, into instDir. Both files
+# are replaced atomically, so a concurrent reader sees either the old
+# or the new environment.
+def writeActivation(instDir, variables):
+    outDir = os.path.join(instDir, artifactDir)
+    os.makedirs(outDir, exist_ok=True)
+
+    script = ['# Generated by lpm, do not edit.']
+    env = [_envMagic]
+    for name in sorted(variables):
+        var = variables[name]
+        if _isShellName(name):
+            script.append(_shellAssignment(name, var))
+            script.append('export %s' % name)
+        else:
+            _log().warning('%s is not a valid shell variable name, '
+                           'leaving it out of %s', name, scriptName)
+
+        if var.overwrite:
+            mode = 'o'
+        else:
+            mode = ''
+        for field in (name, mode, var.separator,
+                      var.separator.join(var.before),
+                      var.separator.join(var.after)):
+            env.append(os.fsencode(field) + b'\0')
+
+    _writeFile(os.path.join(outDir, scriptName),
+               ('\n'.join(script) + '\n').encode())
+    _writeFile(os.path.join(outDir, envName), b''.join(env))
+
+# Read activate.env from instDir as a list of
+# (name, overwrite, separator, before, after) tuples.
+def readActivation(instDir):
+    path = os.path.join(instDir, artifactDir, envName)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        raise ActivationException('No activation files in %s' % instDir)
+
+    if not data.startswith(_envMagic):
+        raise ActivationException('%s is not an activation file' % path)
+
+    fields = [os.fsdecode(field)
+              for field in data[len(_envMagic):].split(b'\0')[:-1]]
+    if len(fields) % 5 != 0:
+        raise ActivationException('%s is truncated' % path)
+
+    return [(fields[i], fields[i + 1] == 'o', fields[i + 2],
+             fields[i + 3], fields[i + 4])
+            for i in range(0, len(fields), 5)]
+
+# The environment environ, a mapping of variable names to values,
+# updated with the variables from readActivation.
+def activate(variables, environ):
+    result = dict(environ)
+    for name, overwrite, sep, before, after in variables:
+        old = None
+        if not overwrite:
+            old = environ.get(name)
+        result[name] = sep.join(part for part in (before, old, after)
+                                if part)
+    return result
+
+# Point packageDir/<name>/current at the install directory called
+# safeStr, or remove it if safeStr is None.
+def setCurrent(nameDir, safeStr):
+    link = os.path.join(nameDir, currentName)
+    if safeStr is None:
+        try:
+            os.unlink(link)
+        except FileNotFoundError:
+            pass
+        return
+
+    # A name of our own, as another lpm may be doing the same.
+    while True:
+        tmpLink = '%s.%d.%s.tmp' % (link, os.getpid(), os.urandom(4).hex())
+        try:
+            os.symlink(safeStr, tmpLink)
+            break
+        except FileExistsError:
+            pass
+    os.replace(tmpLink, link)
+
+# The install directory of version safeStr of the package installed in
+# nameDir, or that of the current version if safeStr is None, as a
+# string.
+def findInstDir(nameDir, safeStr=None):
+    if safeStr is None:
+        safeStr = currentName
+    instDir = os.path.join(nameDir, safeStr)
+    if not os.path.isdir(instDir):
+        raise ActivationException('%s is not installed' % instDir)
+    return instDir
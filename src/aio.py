@@ -0,0 +1,274 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import threading
+import weakref
+
+import core
+
+# An asyncio front end to Manager and the package database, for programs
+# that cannot have their event loop wait on sqlite or the file system.
+# Every operation runs on a thread pool of the AsyncManager's own; each
+# thread reads through a connection of its own, see
+# db.Sqlite3Connections.
+#
+#     async with aio.AsyncManager(conf) as manager:
+#         package = await manager.getPackage('tool', version)
+#         async for package in manager.iterPackages('installed'):
+#             ...
+#         async with manager.transaction() as transaction:
+#             await transaction.db.addPackageDep(a, b)
+#             await transaction.run(package.scan)
+#
+# An operation that is cancelled while it runs still finishes in its
+# thread, only the caller stops waiting for it; a cancelled transaction
+# is rolled back once whatever it was running is done.
+
+# How many items async iterators fetch per trip to their thread.
+defaultChunkSize = 256
+
+# Start func on executor right away, returning an asyncio future for it.
+def _start(executor, func, *args, **kwargs):
+    return asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(func, *args, **kwargs))
+
+async def _run(executor, func, *args, **kwargs):
+    return await _start(executor, func, *args, **kwargs)
+
+# Awaitable versions of the methods of the package database, run on
+# executor:
+#     await manager.db.getPackageStatus(spackage)
+class AsyncDb:
+    def __init__(self, asyncManager, executor):
+        self._asyncManager = asyncManager
+        self._executor = executor
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            return await self._asyncManager._submit(
+                self._executor,
+                lambda: getattr(self._asyncManager.manager.db, name)(
+                    *args, **kwargs))
+        call.__name__ = name
+        return call
+
+    def transaction(self):
+        return self._asyncManager.transaction()
+
+# A database transaction, see Sqlite3V2.transaction, as an async context
+# manager. The writer belongs to the thread that took it, so the
+# transaction gets a thread of its own and everything in it has to run
+# there, through run or db; writing through the AsyncManager instead
+# would wait for the transaction to end.
+class AsyncTransaction:
+    def __init__(self, asyncManager):
+        self._asyncManager = asyncManager
+        self._executor = None
+        self._context = None
+        self.db = None
+
+    async def run(self, func, *args, **kwargs):
+        return await self._asyncManager._submit(self._executor, func,
+                                                *args, **kwargs)
+
+    def _enter(self):
+        context = self._asyncManager.manager.db.transaction()
+        context.__enter__()
+        self._context = context
+
+    def _exit(self, excType, exc, tb):
+        context, self._context = self._context, None
+        if context is None:
+            return False
+        return context.__exit__(excType, exc, tb)
+
+    async def __aenter__(self):
+        self._executor = self._asyncManager._thread('lpm-transaction')
+        self.db = AsyncDb(self._asyncManager, self._executor)
+        future = _start(self._executor, self._asyncManager._call,
+                        self._enter, (), {})
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The transaction may still begin; roll it back right after.
+            self._executor.submit(self._exit, asyncio.CancelledError,
+                                  None, None)
+            self._executor.shutdown(wait=False)
+            raise
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+        return self
+
+    # Shielded, so that the commit or rollback happens even if the task
+    # is cancelled again while waiting for it.
+    async def __aexit__(self, excType, exc, tb):
+        future = _start(self._executor, self._exit, excType, exc, tb)
+        self._executor.shutdown(wait=False)
+        return await asyncio.shield(future)
+
+class AsyncManager:
+    # jobs is the number of threads, the ThreadPoolExecutor default if
+    # None.
+    def __init__(self, conf, jobs=None):
+        self.config = conf
+        self.manager = core.Manager(conf)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            jobs, thread_name_prefix='lpm')
+        self.db = AsyncDb(self, self.executor)
+        self._openLock = threading.Lock()
+        # The executors from _thread and the threads running them. An
+        # executor dropped after shutdown(wait=False) can be gone while
+        # its thread is still finishing; the thread stays in the set
+        # for as long as it runs.
+        self._executors = weakref.WeakSet()
+        self._threads = weakref.WeakSet()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, excType, exc, tb):
+        await self.close()
+
+    # Run func in a thread of executor, opening the database first if
+    # nobody has yet. Manager opens it on first use, which is not safe
+    # to do from several threads at once.
+    def _call(self, func, args, kwargs):
+        with self._openLock:
+            self.manager.db
+        return func(*args, **kwargs)
+
+    async def _submit(self, executor, func, *args, **kwargs):
+        return await _run(executor, self._call, func, args, kwargs)
+
+    # Run func, any blocking function, on the manager's threads; for
+    # Package methods, say.
+    async def run(self, func, *args, **kwargs):
+        return await self._submit(self.executor, func, *args, **kwargs)
+
+    # A thread of its own for a transaction or an iterator, which close
+    # waits for as well.
+    def _thread(self, name):
+        executor = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix=name, initializer=self._started)
+        self._executors.add(executor)
+        return executor
+
+    def _started(self):
+        self._threads.add(threading.current_thread())
+
+    async def open(self):
+        await self.run(lambda: None)
+
+    # Wait for the operations in progress and close the database.
+    async def close(self):
+        await _run(None, self.executor.shutdown, wait=True)
+        for executor in list(self._executors):
+            await _run(None, executor.shutdown, wait=True)
+        for thread in list(self._threads):
+            await _run(None, thread.join)
+        if self.manager._db is not None:
+            await _run(None, self.manager.db.close)
+
+    def transaction(self):
+        return AsyncTransaction(self)
+
+    # Yield the items of the iterator makeIterator() returns, fetching
+    # chunkSize at a time. The iterator is made and advanced by a
+    # thread of its own, so that one iterating over a cursor always uses
+    # it from the same thread.
+    async def _iterate(self, makeIterator, chunkSize=defaultChunkSize):
+        executor = self._thread('lpm-iterator')
+        iterator = None
+        try:
+            iterator = iter(await self._submit(executor, makeIterator))
+            while True:
+                items = await _run(executor, list,
+                                   itertools.islice(iterator, chunkSize))
+                if not items:
+                    break
+                for item in items:
+                    yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                await asyncio.shield(_start(executor, iterator.close))
+            executor.shutdown(wait=False)
+
+    async def createPackage(self, name, vers):
+        return await self.run(self.manager.createPackage, name, vers)
+
+    async def getPackage(self, name, vers):
+        return await self.run(self.manager.getPackage, name, vers)
+
+    async def listPackages(self, status=None):
+        return await self.run(self.manager.listPackages, status)
+
+    # Packages as listPackages lists them, loaded a chunk at a time.
+    def iterPackages(self, status=None, chunkSize=defaultChunkSize):
+        return self._iterate(
+            lambda: self.manager.iterPackages(status, chunkSize), chunkSize)
+
+    # Every registered path, as (path, kind, spackage).
+    def iterPaths(self, chunkSize=defaultChunkSize):
+        return self._iterate(lambda: self.manager.db.getAllPaths(),
+                             chunkSize)
+
+    async def installPackages(self, packages, installer, jobs=None,
+                              progress=None, executor=None):
+        return await self.run(self.manager.installPackages, packages,
+                              installer, jobs, progress, executor)
+
+    async def finishInstall(self, package, updateIndex=True):
+        return await self.run(self.manager.finishInstall, package,
+                              updateIndex)
+
+    async def abortInstall(self, package):
+        return await self.run(self.manager.abortInstall, package)
+
+    async def removePackage(self, package):
+        return await self.run(self.manager.removePackage, package)
+
+    async def rescanPackages(self, packages=None, hash=False, jobs=None):
+        return await self.run(self.manager.rescanPackages, packages, hash,
+                              jobs)
+
+    # Results as they come, see Manager.verifyPackages.
+    def verifyPackages(self, packages=None, jobs=None,
+                       chunkSize=defaultChunkSize):
+        return self._iterate(
+            lambda: self.manager.verifyPackages(packages, jobs), chunkSize)
+
+    async def updateBinaryIndex(self):
+        return await self.run(self.manager.updateBinaryIndex)
+
+    async def rebuildPathIndex(self):
+        return await self.run(self.manager.rebuildPathIndex)
+
+    async def collectStore(self):
+        return await self.run(self.manager.collectStore)
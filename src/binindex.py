@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import mmap
+import os
+
+# The binary index maps the names of binaries to the binary and the
+# install directory of the package providing it. It is read by the
+# dispatcher on every launch, so looking a name up only touches the
+# pages of the file on the search path and needs neither the config
+# nor the package database.
+#
+# Layout, integers being 32 bit little endian:
+#   magic          8 bytes
+#   count          number of entries
+#   offsets        count offsets of the entries, in order of name
+#   entries        name, binary and install directory of every entry,
+#                  each NUL terminated
+
+indexName = '.index'
+
+_magic = b'lpmbin1\n'
+
+class IndexException(Exception):
+    pass
+
+def _int(data, offset):
+    return int.from_bytes(data[offset:offset + 4], 'little')
+
+# Write entries, an iterable of (name, binary, instDir), to path.
+# Names must be unique. The file is replaced atomically, so a dispatcher
+# running at the same time sees either the old or the new index.
+def writeIndex(path, entries):
+    records = sorted((os.fsencode(name), os.fsencode(binary),
+                      os.fsencode(instDir))
+                     for name, binary, instDir in entries)
+
+    offset = len(_magic) + 4 + 4 * len(records)
+    offsets = []
+    body = []
+    for record in records:
+        offsets.append(offset.to_bytes(4, 'little'))
+        data = b'\0'.join(record) + b'\0'
+        body.append(data)
+        offset += len(data)
+
+    tmpPath = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.write(_magic)
+        f.write(len(records).to_bytes(4, 'little'))
+        f.writelines(offsets)
+        f.writelines(body)
+    os.replace(tmpPath, path)
+
+class BinaryIndex:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise IndexException('No binary index at %s' % path)
+        except ValueError:
+            # mmap refuses empty files.
+            raise IndexException('%s is not a binary index' % path)
+
+        if self.data[:len(_magic)] != _magic:
+            raise IndexException('%s is not a binary index' % path)
+        self.count = _int(self.data, len(_magic))
+
+    def close(self):
+        self.data.close()
+
+    def __len__(self):
+        return self.count
+
+    def _field(self, offset):
+        end = self.data.find(b'\0', offset)
+        return self.data[offset:end], end + 1
+
+    def _entryOffset(self, i):
+        return _int(self.data, len(_magic) + 4 + 4 * i)
+
+    # The (binary, instDir) registered for name, or None.
+    def lookup(self, name):
+        key = os.fsencode(name)
+        low = 0
+        high = self.count
+        while low < high:
+            mid = (low + high) // 2
+            entryName, offset = self._field(self._entryOffset(mid))
+            if entryName < key:
+                low = mid + 1
+            elif entryName > key:
+                high = mid
+            else:
+                binary, offset = self._field(offset)
+                instDir, offset = self._field(offset)
+                return os.fsdecode(binary), os.fsdecode(instDir)
+        return None
+
+    # Every name in the index, in order.
+    def names(self):
+        for i in range(self.count):
+            yield os.fsdecode(self._field(self._entryOffset(i))[0])
@@ -22,62 +22,160 @@
 # SOFTWARE.
 
 import os
-import logging
-import ply.lex as lex
-import ply.yacc as yacc
-
-# A special form of dictionary which allows using the form
-# <dict>.<key> to access its values.
-class Dict:
-    def __init__(self, d={}):
-        for key in d:
-            self.set(key, d[key])
-
-    def __iter__(self):
-        return self.__dict__.iter()
-
-    # Set a key to a specific value. If the key currently has
-    # a Dict for its value, and the new value is a dict or Dict,
-    # then the old and new values are merged, with the new value's
-    # contents having precedence.
-    def set(self, key, value):
-        if key in self.__dict__ and type(self.__dict__[key]) == Dict and \
-           (type(key) == dict or type(key) == Dict):
-            self.__dict__[key].setFromDict(value)
-        elif type(key) == dict:
-            # if the key type is dict and we got here than the current value for
-            # the key (if any) is not a Dict
-            self.__dict__[key] = Dict(value)
-        else:
-            self.__dict__[key] = value
+import marshal
+
+# lpm gets run on every shell prompt, so importing logging is put off
+# until there is something to log.
+def _log():
+    import logging
+    return logging.getLogger(__name__)
+
+# A configuration is built from layers, each a source name and a dict
+# of the keys it sets, where a value that is a dict is a section of
+# further keys. Later layers take precedence. Sections are merged key
+# by key, anything else replaces what was there before. load uses, in
+# order:
+#   defaultConfig                 the built in defaults
+#   systemConfFile                the system wide config file
+#   <confDir>/lpm.conf            the user's config file
+#   LPM_<SECTION>_<KEY> variables environment overrides
+# resolve turns the layers into a tree of frozen Section objects.
+
+class FrozenException(AttributeError):
+    pass
 
-    # Merge the contents of d with the contents of self. The contents of d
-    # have priority. d can be of type supporting dictionary-like access to
-    # to its contents and iteration over its keys with its default iterator.
-    def setFromDict(self, d):
-        for key in d:
-            self.set(key, d[key])
+# A resolved section of a configuration. Keys are read as attributes
+# or with [], and the section cannot be changed. Every distinct set of
+# keys gets its own subclass with those keys as __slots__, so reading a
+# key is as cheap as reading any attribute. Keys that cannot be slots,
+# because they are not identifiers or start with an underscore, can
+# only be read with [].
+class Section:
+    __slots__ = ('_keys', '_sources', '_extra')
 
     def __setattr__(self, key, value):
-        return self.set(key, value)
+        raise FrozenException('Configuration is read only')
 
-    def get(self, key):
-        return self.__dict__[key]
+    def __delattr__(self, key):
+        raise FrozenException('Configuration is read only')
 
-_home = os.getenv("HOME")
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        if key not in self._sources:
+            raise KeyError(key)
+        return getattr(self, key)
 
-defaultConfig = Dict()
-defaultConfig.locations = Dict()
-defaultConfig.locations.confDir = os.getenv("XDG_CONFIG_HOME", _home + "/.config") + "/lpm"
-defaultConfig.locations.dataDir = os.getenv("XDG_DATA_HOME", _home + "/.local/share") + "/lpm"
+    def __contains__(self, key):
+        return key in self._sources
 
-defaultConfig.install = Dict()
-defaultConfig.install.permissions = 0o755
-defaultConfig.install.dir = defaultConfig.locations.dataDir + "/packages"
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return 'Section(%s)' % ', '.join('%s=%r' % (key, self[key])
+                                         for key in self._keys)
+
+_sectionClasses = {}
+
+def _isSlotName(key):
+    return key.isidentifier() and not key.startswith('_')
+
+def _section(values, sources):
+    slots = tuple(key for key in values if _isSlotName(key))
+    cls = _sectionClasses.get(slots)
+    if cls is None:
+        cls = type('Section', (Section,), {'__slots__': slots})
+        _sectionClasses[slots] = cls
+
+    section = object.__new__(cls)
+    setValue = object.__setattr__
+    for key in slots:
+        setValue(section, key, values[key])
+    setValue(section, '_keys', tuple(values))
+    setValue(section, '_sources', sources)
+    setValue(section, '_extra', {key: value for key, value in values.items()
+                                 if not _isSlotName(key)})
+    return section
+
+# Merge layers, a list of (source, dict) pairs from lowest to highest
+# precedence, into a Section. Values are shared with the layers, not
+# copied. Each key records the source of the layer that set it last,
+# see source.
+def resolve(layers):
+    # key -> (source, value, parts), where parts is a list of the layers
+    # of a section still to be merged, or None for other values.
+    entries = {}
+    for layerSource, layer in layers:
+        for key, value in layer.items():
+            if isinstance(value, dict):
+                entry = entries.get(key)
+                if entry is None or entry[2] is None:
+                    parts = []
+                else:
+                    parts = entry[2]
+                parts.append((layerSource, value))
+                entries[key] = (layerSource, None, parts)
+            else:
+                entries[key] = (layerSource, value, None)
+
+    values = {}
+    sources = {}
+    for key, (keySource, value, parts) in entries.items():
+        if parts is not None:
+            value = resolve(parts)
+        values[key] = value
+        sources[key] = keySource
+    return _section(values, sources)
+
+# The source of the layer that set path, a dotted key such as
+# 'packageDb.dbFile', in the resolved configuration conf.
+def source(conf, path):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        conf = conf[key]
+    if keys[-1] not in conf:
+        raise KeyError(path)
+    return conf._sources[keys[-1]]
+
+# conf as plain nested dicts.
+def asDict(conf):
+    return {key: asDict(conf[key]) if isinstance(conf[key], Section)
+            else conf[key] for key in conf}
 
-defaultConfig.packageDb = Dict()
-defaultConfig.packageDb.type = 'sqlite3'
-defaultConfig.packageDb.dbFile = defaultConfig.locations.dataDir + '/packages.db'
+_home = os.getenv("HOME")
+_dataDir = os.getenv("XDG_DATA_HOME", _home + "/.local/share") + "/lpm"
+
+defaultConfig = {
+    'locations': {
+        'confDir': os.getenv("XDG_CONFIG_HOME", _home + "/.config") + "/lpm",
+        'dataDir': _dataDir,
+        'packageDir': _dataDir + "/packages",
+        'binDir': _dataDir + "/bin",
+    },
+    'install': {
+        'permissions': 0o755,
+        'dir': _dataDir + "/packages",
+        'jobs': 0,
+        'dedupe': 0,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': _dataDir + '/packages.db',
+        'timeout': 30,
+        'cacheSize': 4096,
+    },
+    'verify': {
+        'jobs': 0,
+    },
+}
+
+systemConfFile = '/etc/lpm/lpm.conf'
+
+envPrefix = 'LPM_'
 
 class ParseException(Exception):
     pass
@@ -201,14 +299,30 @@ class ConfigFileParser:
         raise ParseException("Config file parse error in line " + str(t.lineno) +  \
                              " with token '" + t.type + "' (" + str(t.value) + ")")
 
-    def __init__(self):
+    # If cacheDir is given, the parser tables are kept in it and only
+    # rebuilt when the grammar changes.
+    def __init__(self, cacheDir=None):
+        # Only needed when a config file actually gets parsed, which the
+        # config cache makes rare. See load.
+        import logging
+        import ply.lex as lex
+        import ply.yacc as yacc
+
         lexErrLog = logging.getLogger(__name__ + ".lexer")
         lexDebugLog = logging.getLogger(__name__ + ".lexer.debug")
-        parseErrLog = logging.getLogger(__name__ + ".lexer")
-        parseDebugLog = logging.getLogger(__name__ + ".lexer.debug")
-        
-        self.lexer = lex.lex(module=self, errorlog=lexErrLog, debug=lexDebugLog)
-        self.parser = yacc.yacc(module=self, errorlog=parseErrLog, debug=parseDebugLog)
+        parseErrLog = logging.getLogger(__name__ + ".parser")
+        parseDebugLog = logging.getLogger(__name__ + ".parser.debug")
+
+        tablesFile = None
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+            tablesFile = os.path.join(cacheDir, 'parsetab.pickle')
+
+        self.lexer = lex.lex(module=self, errorlog=lexErrLog,
+                             debug=True, debuglog=lexDebugLog)
+        self.parser = yacc.yacc(module=self, errorlog=parseErrLog,
+                                debug=True, debuglog=parseDebugLog,
+                                write_tables=False, picklefile=tablesFile)
 
     def parseFile(self, f):
         file = open(f)
@@ -216,6 +330,139 @@ class ConfigFileParser:
             return self.parser.parse(file.read(), lexer=self.lexer)
         finally:
             file.close()
-        
-    
 
+# Where load keeps its caches. This has to come from the defaults, since
+# the config files themselves can move dataDir.
+cacheDir = _dataDir + '/cache'
+
+# Bump whenever the cache layout changes, to make load ignore caches
+# written before.
+_cacheFormat = 2
+
+def _readCache(cacheFile, key):
+    try:
+        with open(cacheFile, 'rb') as f:
+            cachedKey, layers = marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        _log().debug('Ignoring unreadable config cache %s: %s', cacheFile, e)
+        return None
+
+    if cachedKey != key:
+        return None
+    return layers
+
+def _writeCache(cacheFile, key, layers):
+    tmpFile = cacheFile + '.%d.tmp' % os.getpid()
+    try:
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        with open(tmpFile, 'wb') as f:
+            marshal.dump((key, layers), f)
+        os.replace(tmpFile, cacheFile)
+    except OSError as e:
+        _log().debug('Could not write config cache %s: %s', cacheFile, e)
+        try:
+            os.unlink(tmpFile)
+        except OSError:
+            pass
+
+# The contents of the config files in paths, as a list of dicts, with
+# None for files that do not exist. The result is cached in cacheDir,
+# keyed by the path, mtime and size of every file, so that files are
+# only parsed again once they change. The cache holds plain dicts in
+# marshal format, which unlike pickle costs nothing to import.
+def _readFiles(paths, cacheDir):
+    key = [_cacheFormat]
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            key.append((path, None, None))
+        else:
+            key.append((path, st.st_mtime_ns, st.st_size))
+    key = tuple(key)
+
+    if all(mtime is None for path, mtime, size in key[1:]):
+        return [None] * len(paths)
+
+    cacheFile = os.path.join(cacheDir, 'config.marshal')
+    layers = _readCache(cacheFile, key)
+    if layers is not None:
+        return layers
+
+    parser = ConfigFileParser(cacheDir)
+    layers = []
+    for path, mtime, size in key[1:]:
+        if mtime is None:
+            layers.append(None)
+        else:
+            _log().debug('Parsing %s', path)
+            layers.append(parser.parseFile(path))
+    _writeCache(cacheFile, key, layers)
+    return layers
+
+# One layer for every LPM_<SECTION>_<KEY> variable in environ that names
+# a key of base, the configuration it overrides. Names are matched
+# without regard to case. Values are converted to int where base has an
+# int.
+def _envLayers(environ, base):
+    layers = []
+    for name in sorted(environ):
+        if not name.startswith(envPrefix):
+            continue
+
+        conf = base
+        keys = []
+        for part in name[len(envPrefix):].lower().split('_'):
+            if not isinstance(conf, Section):
+                conf = None
+                break
+            matches = [key for key in conf if key.lower() == part]
+            if not matches:
+                conf = None
+                break
+            keys.append(matches[0])
+            conf = conf[matches[0]]
+
+        if conf is None or isinstance(conf, Section):
+            _log().debug('%s does not name a config key, ignoring it', name)
+            continue
+
+        value = environ[name]
+        if isinstance(conf, int):
+            try:
+                value = int(value, 0)
+            except ValueError:
+                _log().warning('Ignoring %s, %r is not an integer',
+                               name, value)
+                continue
+
+        layer = {keys[-1]: value}
+        for key in reversed(keys[:-1]):
+            layer = {key: layer}
+        layers.append((name, layer))
+    return layers
+
+# The resolved configuration: defaultConfig, overridden by the system
+# config file systemFile, the user config file confFile
+# (confDir/lpm.conf if not given) and LPM_* variables from environ, in
+# that order. Either file may be None to leave it out.
+def load(confFile=None, cacheDir=cacheDir, systemFile=systemConfFile,
+         environ=os.environ):
+    if confFile is None:
+        confFile = os.path.join(defaultConfig['locations']['confDir'],
+                                'lpm.conf')
+    confFile = os.path.abspath(confFile)
+
+    paths = [path for path in (systemFile, confFile) if path is not None]
+    layers = [('defaults', defaultConfig)]
+    for path, layer in zip(paths, _readFiles(paths, cacheDir)):
+        if layer is not None:
+            layers.append((path, layer))
+
+    conf = resolve(layers)
+    envLayers = _envLayers(environ, conf)
+    if envLayers:
+        conf = resolve(layers + envLayers)
+    return conf
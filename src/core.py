@@ -21,3 +21,254 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+
+import logging
+import os
+from pathlib import Path
+
+import activation
+import binindex
+import db
+import install
+import package as pkg
+import pathindex
+import scan
+import store
+import verify
+
+log = logging.getLogger(__name__)
+
+# The launcher linked under every binary name in locations.binDir.
+dispatcher = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'lpm-dispatch')
+
+# The kind of path each path table holds, as in getPathOwners.
+_pathKinds = {'binaries': 'binary', 'bindirs': 'bindir', 'libdirs': 'libdir'}
+
+class Manager:
+    def __init__(self, conf):
+        self.config = conf
+        self._db = None
+        # While above 0, changes to binaries do not rebuild the binary
+        # index; whoever raised it rebuilds it once when done.
+        self.indexUpdatesHeld = 0
+
+    # The package database, opened on first use so that commands which
+    # do not need it do not pay for it.
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = db.getDb(self.config)
+
+            # Keep the activation files and the binary index in step
+            # with the database.
+            self._db.envListeners.append(self._envChanged)
+            self._db.pathListeners.append(self._pathsChanged)
+        return self._db
+
+    def _nameDir(self, name):
+        return Path(self.config.locations.packageDir) / name
+
+    def _instDir(self, spackage):
+        return self._nameDir(spackage.name) / spackage.version.safeStr()
+
+    def createPackage(self, name, vers):
+        self.db.createPackage(db.SPackage(name, vers))
+        return pkg.Package(self.config, self.db, name, vers)
+
+    # The package name at version vers, or None if it is not registered.
+    def getPackage(self, name, vers):
+        if not self.db.packageExists(db.SPackage(name, vers)):
+            return None
+        return pkg.Package(self.config, self.db, name, vers)
+
+    # Every registered package, by name and then oldest first, or only
+    # those in status. Their data is loaded in bulk, see pkg.hydrate.
+    def listPackages(self, status=None):
+        packages = [pkg.Package(self.config, self.db, spackage.name,
+                                spackage.version)
+                    for spackage, packageStatus in self.db.getPackages(status)]
+        pkg.hydrate(packages)
+        return packages
+
+    # Like listPackages, but loading the data of chunkSize packages at a
+    # time as the listing is iterated over.
+    def iterPackages(self, status=None, chunkSize=400):
+        spackages = [spackage for spackage, packageStatus
+                     in self.db.getPackages(status)]
+        for i in range(0, len(spackages), chunkSize):
+            packages = [pkg.Package(self.config, self.db, spackage.name,
+                                    spackage.version)
+                        for spackage in spackages[i:i + chunkSize]]
+            pkg.hydrate(packages)
+            yield from packages
+
+    # Mark a package whose files are in place as installed, writing its
+    # activation files and making it current if it is the newest
+    # installed version. Installing many packages, the binary index can
+    # be brought up to date once at the end instead.
+    def finishInstall(self, package, updateIndex=True):
+        if self.dedupeEnabled():
+            # Deduplicating changes inodes and modes.
+            if store.dedupe(package.instDir, self.storeDir())['files']:
+                scan.recordManifest(self.db, package.spackage,
+                                    package.instDir)
+        self.db.setPackageStatus(package.spackage, 'installed')
+        self.writeActivation(package.spackage)
+        self.updateCurrent(package.name)
+        if updateIndex:
+            self.updateBinaryIndex()
+
+    # Undo Package.initialize for a package whose install did not
+    # finish, so that it can be tried again.
+    def abortInstall(self, package):
+        store.removeTree(package.instDir, self.storeDir())
+        self.db.setPackageStatus(package.spackage, 'uninitialized')
+
+    # Install packages, a list of SPackages, along with everything they
+    # depend on that is not installed yet. installer(name, version,
+    # instDir) fills in the install dir of one package; it runs in a
+    # worker process, up to jobs (install.jobs, default one per CPU) at a
+    # time, each package once all of its dependancies are in. progress
+    # is called as packages start and finish, see install.logProgress.
+    # A package that fails is set back to uninitialized and whatever
+    # depends on it is skipped, the rest goes on. Returns a dict mapping
+    # each package installed to install.INSTALLED, or raises
+    # install.InstallException if anything failed.
+    def installPackages(self, packages, installer, jobs=None,
+                        progress=None, executor=None):
+        return install.installPackages(self, packages, installer, jobs,
+                                       progress, executor)
+
+    # Check the install dirs of packages, every installed one if None,
+    # for changes since they were registered and register them, see
+    # scan.rescanTree. With hash, files are hashed as well, with up to
+    # jobs (verify.jobs, default one per CPU) threads, which records the
+    # digests verify checks against. Returns a dict mapping each package
+    # to its changes.
+    def rescanPackages(self, packages=None, hash=False, jobs=None):
+        if packages is None:
+            packages = self.listPackages('installed')
+        if jobs is None:
+            jobs = verify.defaultJobs(self.config)
+        return {package: package.rescan(hash=hash, jobs=jobs)
+                for package in packages}
+
+    # Check the files of packages, every installed one if None, against
+    # the digests in their manifests with up to jobs (verify.jobs, default
+    # one per CPU) threads. A generator, see verify.verifyPackages.
+    def verifyPackages(self, packages=None, jobs=None):
+        if packages is None:
+            packages = self.listPackages('installed')
+        if jobs is None:
+            jobs = verify.defaultJobs(self.config)
+        return verify.verifyPackages(packages, jobs)
+
+    def removePackage(self, package):
+        self.db.deletePackage(package.spackage)
+        store.removeTree(package.instDir, self.storeDir())
+        self.updateCurrent(package.name)
+
+    # The content addressed store under the data dir. Installs are only
+    # deduplicated against it with install.dedupe set, but trees that
+    # were are released from it whatever the setting is now.
+    def storeDir(self):
+        return os.path.join(self.config.locations.dataDir, 'store')
+
+    def dedupeEnabled(self):
+        return bool('dedupe' in self.config.install and
+                    self.config.install.dedupe)
+
+    # Remove the blobs no installed package uses any more. Returns how
+    # many were removed.
+    def collectStore(self):
+        return store.collect(self.storeDir())
+
+    def writeActivation(self, spackage):
+        activation.writeActivation(self._instDir(spackage),
+                                   self.db.getCompositeVariables(spackage))
+
+    def updateCurrent(self, name):
+        newest = self.db.getNewestVersion(name, 'installed')
+        if newest is None:
+            safeStr = None
+        else:
+            safeStr = newest.version.safeStr()
+
+        nameDir = self._nameDir(name)
+        if nameDir.is_dir():
+            activation.setCurrent(nameDir, safeStr)
+
+    # Database listener for packages whose composite run environment
+    # changed, which includes everything depending on a changed package.
+    def _envChanged(self, packages):
+        for spackage in packages:
+            if self.db.getPackageStatus(spackage) == 'installed':
+                log.debug('Regenerating activation files for %s', spackage)
+                self.writeActivation(spackage)
+
+    # Regenerate the binary index in locations.binDir from the binaries
+    # of installed packages, and link every name in it to the
+    # dispatcher. Where several versions of a package provide a name the
+    # newest wins, where several packages do the first by name does.
+    def updateBinaryIndex(self):
+        binDir = self.config.locations.binDir
+        os.makedirs(binDir, exist_ok=True)
+
+        entries = {}
+        for binary, spackage in self.db.getInstalledBinaries():
+            binName = binary.name
+            entry = entries.get(binName)
+            if entry is None:
+                entries[binName] = (str(binary),
+                                    str(self._instDir(spackage)),
+                                    spackage.name)
+            elif entry[2] != spackage.name:
+                log.info('%s is provided by both %s and %s, using %s',
+                         binName, entry[2], spackage.name, entry[2])
+
+        binindex.writeIndex(os.path.join(binDir, binindex.indexName),
+                            ((binName, binary, instDir) for binName,
+                             (binary, instDir, name) in entries.items()))
+
+        # Links to anything but the dispatcher are left alone.
+        for dirEntry in os.scandir(binDir):
+            if dirEntry.name in entries or not dirEntry.is_symlink():
+                continue
+            if os.readlink(dirEntry.path) == dispatcher:
+                os.unlink(dirEntry.path)
+        for binName in entries:
+            link = os.path.join(binDir, binName)
+            if not os.path.lexists(link):
+                os.symlink(dispatcher, link)
+
+    # Database listener for changes to the path tables. Binaries of
+    # packages that are still being installed are not in the index yet,
+    # so they can be ignored; finishInstall picks them up. Nor is it
+    # rebuilt while indexUpdatesHeld, see installPackages.
+    # The path index is only kept up to date once it exists; lpm owns
+    # builds it when first needed.
+    def _pathsChanged(self, changes):
+        notInstalled = ('uninitialized', 'installing')
+        if self.indexUpdatesHeld == 0 and any(
+                table == 'binaries' and
+                self.db.getPackageStatus(spackage) not in notInstalled
+                for table, added, spackage, path in changes):
+            self.updateBinaryIndex()
+
+        indexFile = self.pathIndexFile()
+        if os.path.exists(indexFile):
+            pathindex.updateIndex(indexFile, (
+                (added, str(path), _pathKinds[table], spackage.name,
+                 str(spackage.version))
+                for table, added, spackage, path in changes))
+
+    def pathIndexFile(self):
+        return os.path.join(self.config.locations.dataDir,
+                            pathindex.indexName)
+
+    # Build the path index from scratch. See pathindex.
+    def rebuildPathIndex(self):
+        pathindex.writeIndex(self.pathIndexFile(), (
+            (str(path), kind, spackage.name, str(spackage.version))
+            for path, kind, spackage in self.db.getAllPaths()))
@@ -22,13 +22,20 @@
 # SOFTWARE.
 
 
+from contextlib import contextmanager
 from pathlib import Path
 import logging
-
-import package as p
+import random
+import sqlite3
+import threading
+import time
+
+import environment
+import graph
+import querycache
 import version as v
 
-log = logger.getLogger(__name__)
+log = logging.getLogger(__name__)
 
 # Use this for a list of dependancies so that sqlite3 knows how to
 # automatically convert it to/from text for database storage.
@@ -56,24 +63,45 @@ class SPackage:
         if protocol is sqlite3.PrepareProtocol:
             return "%s;%s" % (self.name, str(self.version))
 
+    def __eq__(self, other):
+        if not isinstance(other, SPackage):
+            return NotImplemented
+        return self.name == other.name and self.version == other.version
+
+    def __hash__(self):
+        return hash((self.name, self.version))
+
+    def __str__(self):
+        return "%s %s" % (self.name, self.version)
+
+    def __repr__(self):
+        return "SPackage(%r, %r)" % (self.name, str(self.version))
+
+class DatabaseException(Exception):
+    pass
+
 # Pass the configuration root in. The result will be a database object
 # if the database configuration is sane. Will raise an exception
-# otherwise.
+# otherwise, DatabaseException if the database cannot be opened.
 def getDb(conf):
     if conf.packageDb.type == "sqlite3":
         sqlite3Setup()
 
         dbFile = Path(conf.packageDb.dbFile)
 
-        if dbFile.exists():
-            if dbFile.is_file():
-                # TODO: handle empty files
-                return openSqlite3Db(conf.packageDb.dbFile)
+        try:
+            if dbFile.exists():
+                if dbFile.is_file():
+                    # TODO: handle empty files
+                    return openSqlite3Db(conf)
+                else:
+                    raise DatabaseException("Sqlite3 DB (%s) is not a file"
+                                            % conf.packageDb.dbFile)
             else:
-                log.critical("Sqlite3 DB (%s) is not a file",
-                             conf.packageDb.dbfile);
-        else:
-            return createSqlite3Db(conf.packageDb.dbFile)
+                return createSqlite3Db(conf)
+        except (sqlite3.Error, OSError) as e:
+            raise DatabaseException("Cannot open Sqlite3 DB (%s): %s" %
+                                    (conf.packageDb.dbFile, e))
 
 def sqlite3ConvertDeps(s):
     depStrings =  s.split('\t')
@@ -96,93 +124,828 @@ def sqlite3AdaptPath(path):
     return str(path)
 
 def sqlite3Setup():
-    import sqlite3
-
     # sqlite3.register_converter("deps", sqlite3ConvertDeps)
     sqlite3.register_converter("package", sqlite3ConvertPackage)
 
     sqlite3.register_adapter(Path, sqlite3AdaptPath)
+    sqlite3.register_adapter(type(Path()), sqlite3AdaptPath)
     sqlite3.register_converter("path", sqlite3ConvertPath)
 
-def sqlite3Connect(dbFile):
-    return sqlite3.connect(dbFile, detect_types=sqlite3.PARSE_DECLTYPES)
+# Seconds to wait for a lock held by another connection before giving
+# up with "database is locked".
+sqlite3DefaultTimeout = 30
+
+# Transactions are managed explicitly by Sqlite3V2.transaction, so the
+# connection is put in autocommit mode. Foreign keys have to be
+# switched on per connection for the cascading deletes to happen.
+# Column names of the form "name [type]" select a converter, which
+# lets queries hand back SPackage objects for joined name/version
+# columns. sqlite waits up to timeout seconds for busy locks itself.
+# Sqlite3Connections makes sure that a connection is only ever used
+# by one thread at a time, so the thread check is off.
+def sqlite3Connect(dbFile, timeout=sqlite3DefaultTimeout):
+    conn = sqlite3.connect(dbFile, timeout=timeout, isolation_level=None,
+                           check_same_thread=False,
+                           detect_types=sqlite3.PARSE_DECLTYPES |
+                                        sqlite3.PARSE_COLNAMES)
+    conn.execute('pragma foreign_keys = on;')
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def sqlite3IsBusy(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(error) or 'busy' in str(error)
+
+# Call func until it stops failing because the database is busy, for
+# at most timeout seconds. sqlite's busy handler already waits inside
+# most statements, this is for the cases where sqlite gives up on the
+# spot: changing the journal mode, and locks that could only be had by
+# deadlocking. The delay between attempts doubles each time, with some
+# jitter so that waiting processes do not all retry at once.
+def sqlite3Retry(func, timeout=sqlite3DefaultTimeout):
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            if not sqlite3IsBusy(e) or time.monotonic() + delay > deadline:
+                raise
+            log.debug("Database busy, retrying in %.3fs", delay)
+
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, 0.5)
+
+# Hands out the connections to one database file. Every thread reads
+# through a connection of its own. In WAL mode readers neither wait for
+# each other nor for the writer, they see the database as of the last
+# commit. All writes go through a single connection, held by one thread
+# from the start of its outermost transaction to the end of it; other
+# threads wanting to write wait for it in writer(). Other processes are
+# kept out by sqlite's own write lock, waited for with backoff.
+class Sqlite3Connections:
+    def __init__(self, dbFile, timeout=sqlite3DefaultTimeout):
+        self.dbFile = dbFile
+        self.timeout = timeout
+        self.local = threading.local()
+        self.writeLock = threading.RLock()
+        self.writerThread = None
+
+        conn = sqlite3Connect(dbFile, timeout)
+        mode = sqlite3Retry(
+            lambda: conn.execute('pragma journal_mode = wal;').fetchone()[0],
+            timeout)
+        if mode != 'wal':
+            log.warning("Sqlite3 DB (%s) cannot use WAL mode, using %s",
+                        dbFile, mode)
+        # WAL keeps the database consistent on power loss without a sync
+        # on every commit, only the last commits can be lost.
+        conn.execute('pragma synchronous = normal;')
+        self.writeCursor = conn.cursor()
+
+    # The cursor for the calling thread: the writer's while the thread is
+    # in a transaction, so that it sees its own changes, and its read
+    # cursor otherwise.
+    def cursor(self):
+        if self.writerThread == threading.get_ident():
+            return self.writeCursor
+
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is None:
+            cursor = sqlite3Connect(self.dbFile, self.timeout).cursor()
+            self.local.cursor = cursor
+        return cursor
+
+    def writing(self):
+        return self.writerThread == threading.get_ident()
+
+    # The writer's "pragma data_version", which changes whenever another
+    # connection, in this process or any other, commits. None while a
+    # thread is writing, the writer cannot be used then.
+    def dataVersion(self):
+        if not self.writeLock.acquire(blocking=False):
+            return None
+        try:
+            conn = self.writeCursor.connection
+            return conn.execute('pragma data_version;').fetchone()[0]
+        finally:
+            self.writeLock.release()
+
+    # Hold the writer for the duration of the block. Blocks while another
+    # thread holds it, and can be nested.
+    @contextmanager
+    def writer(self):
+        with self.writeLock:
+            outermost = self.writerThread is None
+            self.writerThread = threading.get_ident()
+            try:
+                yield self.writeCursor
+            finally:
+                if outermost:
+                    self.writerThread = None
+
+    # Start a write transaction on the writer. "begin immediate" takes
+    # the write lock right away; a deferred transaction would take it
+    # with its first write and fail instead of waiting if another
+    # process committed in the meantime.
+    def begin(self):
+        sqlite3Retry(lambda: self.writeCursor.execute('begin immediate;'),
+                     self.timeout)
+
+    # Close the writer and the calling thread's read connection. Other
+    # threads' connections are closed when those threads exit.
+    def close(self):
+        with self.writeLock:
+            self.writeCursor.connection.close()
+        cursor = getattr(self.local, 'cursor', None)
+        if cursor is not None:
+            cursor.connection.close()
+            del self.local.cursor
+
+# Find the sql script called name. Installed scripts live in
+# <dataDir>/sql, falling back to the ones next to this file when
+# running from the source tree.
+def sqlite3Script(conf, name):
+    scriptFile = Path(conf.locations.dataDir) / 'sql' / (name + '.sql')
+    if not scriptFile.is_file():
+        scriptFile = Path(__file__).parent / (name + '.sql')
+
+    with scriptFile.open() as f:
+        return f.read()
+
+# Run a script one statement at a time. Unlike executescript this
+# does not commit first, so the script becomes part of the current
+# transaction.
+def sqlite3ExecuteScript(cursor, script):
+    statement = ''
+    for line in script.splitlines(True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            cursor.execute(statement)
+            statement = ''
+
+# The format version databases are created with and migrated to.
+sqlite3FormatVersion = 6
+
+# Format 1 keyed every table by a "name;version" text column. Format 2
+# gives packages an integer id, stores the name and version in
+# separate columns and uses the id as the foreign key everywhere.
+def sqlite3MigrateV1(conf, cursor):
+    tables = ['format_version', 'packages', 'build_env', 'run_env',
+              'dependancies', 'bindirs', 'libdirs', 'binaries']
+    for table in tables:
+        cursor.execute('alter table %s rename to v1_%s;' % (table, table))
+
+    sqlite3ExecuteScript(cursor, sqlite3Script(conf, 'sqlite3V2TablesCreate'))
+
+    # The casts skip the package converter, the raw strings are needed
+    # to join the old tables against the new ids.
+    cursor.execute('create temp table v1_ids (package text primary key, '
+                   'id integer not null);')
+
+    def addPackage(s, status):
+        name, vers = s.split(';')
+        vers = v.Version(vers)
+        cursor.execute('''
+            insert into packages (name, version, safe_version, sort_key,
+                                  status)
+            values (?, ?, ?, ?, ?);''', (name, str(vers), vers.safeStr(),
+                                        vers.sortBytes(), status))
+        cursor.execute('insert into v1_ids values (?, ?);',
+                       (s, cursor.lastrowid))
+
+    cursor.execute('select cast(package as text), status from v1_packages;')
+    for s, status in cursor.fetchall():
+        addPackage(s, status)
+
+    # Format 1 did not require dependancies to be registered packages.
+    cursor.execute('''
+        select distinct cast(dependancy as text) from v1_dependancies
+        where dependancy not in (select package from v1_ids);''')
+    for s, in cursor.fetchall():
+        addPackage(s, 'uninitialized')
+
+    for table in ['build_env', 'run_env']:
+        cursor.execute('''
+            insert into %s (package_id, variable, value, mode, sep)
+            select ids.id, t.variable, t.value, t.mode, t.sep
+            from v1_%s t join v1_ids ids on ids.package = t.package;'''
+                       % (table, table))
+
+    cursor.execute('''
+        insert into dependancies (package_id, dependancy_id)
+        select ids.id, depIds.id from v1_dependancies t
+        join v1_ids ids on ids.package = t.package
+        join v1_ids depIds on depIds.package = t.dependancy;''')
+
+    for table, column in [('bindirs', 'dir'), ('libdirs', 'dir'),
+                          ('binaries', 'binary')]:
+        cursor.execute('''
+            insert into %s (package_id, %s)
+            select ids.id, t.%s
+            from v1_%s t join v1_ids ids on ids.package = t.package;'''
+                       % (table, column, column, table))
+
+    cursor.executemany('''
+        insert into dependancy_closure (package_id, dependancy_id, paths)
+        values (?, ?, ?);''', list(sqlite3ComputeClosure(cursor)))
+
+    # Children first, so dropping v1_packages has nothing to cascade to.
+    for table in reversed(tables):
+        cursor.execute('drop table v1_%s;' % table)
+    cursor.execute('drop table v1_ids;')
+
+# Compute the dependancy_closure table from scratch, yielding its
+# (package id, dependancy id, paths) rows. Walks the packages so that
+# each comes after its dependancies, adding up the closures of those.
+# Raises graph.CycleException if the dependancies contain a cycle.
+def sqlite3ComputeClosure(cursor):
+    cursor.execute('select id from packages order by id;')
+    ids = [row[0] for row in cursor.fetchall()]
+    index = {packageId: i for i, packageId in enumerate(ids)}
+
+    cursor.execute('select package_id, dependancy_id from dependancies;')
+    deps = graph.DependencyGraph(ids, [(index[source], index[target])
+                                       for source, target in cursor.fetchall()])
+
+    closure = {}
+    for packageId in deps.topologicalOrder():
+        paths = {}
+        for depId in deps.dependencies(packageId, transitive=False):
+            paths[depId] = paths.get(depId, 0) + 1
+            for indirectId, count in closure[depId].items():
+                paths[indirectId] = paths.get(indirectId, 0) + count
+        closure[packageId] = paths
+
+    for packageId, paths in closure.items():
+        for depId, count in paths.items():
+            yield packageId, depId, count
+
+# Format 3 adds the indexes behind the reverse lookups: the packages
+# depending on a package and the packages owning a path.
+def sqlite3MigrateV2(conf, cursor):
+    cursor.execute('''
+        create index dependancies_dependancy
+            on dependancies (dependancy_id);''')
+    cursor.execute('create index bindirs_dir on bindirs (dir);')
+    cursor.execute('create index libdirs_dir on libdirs (dir);')
+    cursor.execute('create index binaries_binary on binaries (binary);')
+    cursor.execute('update format_version set version = 3;')
+
+# Format 4 stores the sortBytes() of each version in packages.sort_key,
+# indexed to order the versions of a package. A not null column added
+# by alter table needs a default, every row gets its key right after.
+def sqlite3MigrateV3(conf, cursor):
+    cursor.execute('''
+        alter table packages
+        add column sort_key blob not null default x'';''')
+    cursor.execute('select id, version from packages;')
+    cursor.executemany('update packages set sort_key = ? where id = ?;',
+                       [(v.Version(vers).sortBytes(), packageId)
+                        for packageId, vers in cursor.fetchall()])
+    cursor.execute('''
+        create index packages_name_sort_key
+            on packages (name, sort_key);''')
+    cursor.execute('update format_version set version = 4;')
+
+# Format 5 adds the dependancy_closure table, filled from the
+# dependancies already registered.
+def sqlite3MigrateV4(conf, cursor):
+    cursor.execute('''
+        create table dependancy_closure (
+            package_id integer not null,
+            dependancy_id integer not null,
+            paths integer not null,
+            primary key (package_id, dependancy_id),
+            foreign key (package_id)
+                references packages(id)
+                on delete cascade,
+            foreign key (dependancy_id)
+                references packages(id)
+                on delete cascade
+        );''')
+    cursor.execute('''
+        create index dependancy_closure_dependancy
+            on dependancy_closure (dependancy_id);''')
+    cursor.executemany('''
+        insert into dependancy_closure (package_id, dependancy_id, paths)
+        values (?, ?, ?);''', list(sqlite3ComputeClosure(cursor)))
+    cursor.execute('update format_version set version = 5;')
+
+# Format 6 adds the manifest table. Packages installed before have no
+# manifest until they are rescanned.
+def sqlite3MigrateV5(conf, cursor):
+    cursor.execute('''
+        create table manifest (
+            package_id integer not null,
+            path text not null,
+            size integer not null,
+            mtime_ns integer not null,
+            inode integer not null,
+            mode integer not null,
+            digest text,
+            primary key (package_id, path),
+            foreign key (package_id)
+                references packages(id)
+                on delete cascade
+        ) without rowid;''')
+    cursor.execute('update format_version set version = 6;')
+
+# sqlite3Migrations[n] upgrades a format n database. Each leaves the
+# format it migrated to in format_version, which is not always n + 1:
+# format 1 is migrated by creating the tables afresh.
+sqlite3Migrations = {
+    1: sqlite3MigrateV1,
+    2: sqlite3MigrateV2,
+    3: sqlite3MigrateV3,
+    4: sqlite3MigrateV4,
+    5: sqlite3MigrateV5,
+}
+
+# Bring the database up to sqlite3FormatVersion. All steps run in one
+# transaction, so a failed migration leaves the database untouched.
+def sqlite3Migrate(conf, packageDb, formatVersion):
+    with packageDb.transaction():
+        while formatVersion < sqlite3FormatVersion:
+            log.info("Migrating Sqlite3 DB (%s) from format %d",
+                     conf.packageDb.dbFile, formatVersion)
+            sqlite3Migrations[formatVersion](conf, packageDb.cursor)
+            packageDb.cursor.execute('select version from format_version;')
+            formatVersion = packageDb.cursor.fetchone()[0]
+
+# Number of query results Sqlite3V2 keeps cached, 0 turns the cache off.
+sqlite3DefaultCacheSize = 4096
+
+def sqlite3Option(conf, key, default):
+    if key in conf.packageDb:
+        return conf.packageDb[key]
+    return default
+
+def sqlite3Open(conf):
+    connections = Sqlite3Connections(
+        conf.packageDb.dbFile,
+        sqlite3Option(conf, 'timeout', sqlite3DefaultTimeout))
+    return Sqlite3V2(connections, sqlite3Option(conf, 'cacheSize',
+                                                sqlite3DefaultCacheSize))
 
 def openSqlite3Db(conf):
-    conn = sqlite3Connect(conf.packageDb.dbFile)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    packageDb = sqlite3Open(conf)
+    cursor = packageDb.cursor
 
     cursor.execute('select version from format_version;')
     formatVersion = cursor.fetchone()[0]
 
-    if formatVersion <= 1:
-        return Sqlite3V1(conn, cursor)
-    else:
-        log.critical("Sqlite3 DB (%s) format is not supported", dbFile)
+    if formatVersion > sqlite3FormatVersion:
+        packageDb.close()
+        raise DatabaseException("Sqlite3 DB (%s) format is not supported"
+                                % conf.packageDb.dbFile)
 
-def createSqlite3Db(conf):
-    conn = sqlite3Connect(conf.packageDb.dbFile)
-    cursor = conn.cursor()
+    if formatVersion < sqlite3FormatVersion:
+        sqlite3Migrate(conf, packageDb, formatVersion)
 
-    tableFile = open(conf.locations.dataDir + '/sql/sqlite3V1TablesCreate')
-    tableScript = tableFile.read()
-    tableFile.close()
+    return packageDb
 
-    cursor.executescript(tableScript)
-
-    cursor.commit()
+# Another lpm may have created the database between the check in getDb
+# and the write lock being taken here, in which case the tables are
+# already there. The directory is created as well, on a fresh system
+# it does not exist yet.
+def createSqlite3Db(conf):
+    Path(conf.packageDb.dbFile).parent.mkdir(parents=True, exist_ok=True)
+    packageDb = sqlite3Open(conf)
+    with packageDb.transaction():
+        packageDb.cursor.execute('''
+            select 1 from sqlite_master
+            where type = 'table' and name = 'format_version';''')
+        if packageDb.cursor.fetchone() is None:
+            sqlite3ExecuteScript(packageDb.cursor,
+                                 sqlite3Script(conf, 'sqlite3V2TablesCreate'))
+
+    return packageDb
+
+class PackageNotFoundException(Exception):
+    pass
+
+# Selects a package's name and version as a single column that the
+# package converter turns back into an SPackage.
+_spackageColumn = '''p.name || ';' || p.version as "%s [package]"'''
+
+# The dependancy_closure rows added by an edge from package ? to
+# dependancy ?: every package depending on the former (or the former
+# itself) now depends on the latter and everything it depends on,
+# through as many new paths as the product of the path counts on
+# either side. Parameters are (package, package, dependancy,
+# dependancy). Removing the edge removes the same paths.
+_closureDelta = '''
+    select a.package_id, d.dependancy_id, a.paths * d.paths as paths
+    from (select ? as package_id, 1 as paths
+          union all
+          select package_id, paths from dependancy_closure
+          where dependancy_id = ?) a,
+         (select ? as dependancy_id, 1 as paths
+          union all
+          select dependancy_id, paths from dependancy_closure
+          where package_id = ?) d'''
+
+_missing = object()
+
+# The most parameters a statement may bind on any sqlite we may meet;
+# versions before 3.32 allow no more than this.
+_maxVariables = 999
+
+# Packages read per getPackageData query, three parameters each.
+_dataChunk = _maxVariables // 3
+
+# A row of kind 'package' for every package that exists, and its rows
+# from every table, along with their rowids. Packages are passed as
+# (index, name, version) and identified by their index. The cross
+# joins keep sqlite from scanning whole tables to join against target.
+_packageDataQuery = '''
+    with target(id, package) as (
+        select p.id, t.column1 from (values %s) t
+        cross join packages p on p.name = t.column2 and p.version = t.column3
+    )
+    select t.package, 'package' as kind,
+           null as a, null as b, null as c, null as d, 0 as seq
+    from target t
+    union all
+    select t.package, 'deps', p.name, p.version, null, null, d.rowid
+    from target t cross join dependancies d on d.package_id = t.id
+    cross join packages p on p.id = d.dependancy_id
+    union all
+    select t.package, 'bindirs', b.dir, null, null, null, b.rowid
+    from target t cross join bindirs b on b.package_id = t.id
+    union all
+    select t.package, 'libdirs', l.dir, null, null, null, l.rowid
+    from target t cross join libdirs l on l.package_id = t.id
+    union all
+    select t.package, 'binaries', b.binary, null, null, null, b.rowid
+    from target t cross join binaries b on b.package_id = t.id
+    union all
+    select t.package, 'buildEnv', e.variable, e.value, e.mode, e.sep, e.rowid
+    from target t cross join build_env e on e.package_id = t.id
+    union all
+    select t.package, 'runEnv', e.variable, e.value, e.mode, e.sep, e.rowid
+    from target t cross join run_env e on e.package_id = t.id;'''
+
+class Sqlite3V2:
+    def __init__(self, connections, cacheSize=sqlite3DefaultCacheSize):
+        self.connections = connections
+        self.transactionDepth = 0
+
+        # Results of the per package read methods, shared by all
+        # threads. Keys start with the kind of result, and entries are
+        # tagged with the kind and the package they were read for. A
+        # transaction collects the tags it changes in
+        # pendingInvalidations, None meaning all of them, and drops
+        # their entries when it commits. Commits by other connections
+        # show up as a new dataVersion and drop everything.
+        self.cache = None
+        if cacheSize > 0:
+            self.cache = querycache.QueryCache(cacheSize)
+        self.dataVersion = None
+        self.pendingInvalidations = set()
+
+        # Callables taking a list of SPackages whose composite
+        # environment changed, and the changes waiting for the
+        # transaction to commit.
+        self.envListeners = []
+        self.pendingEnvChanges = {}
+
+        # Callables taking a list of (table, added, package, path) for
+        # every row added to or removed from bindirs, libdirs and
+        # binaries, in order, once the transaction commits. Changes
+        # undone by a rollback are never reported.
+        self.pathListeners = []
+        self.pendingPathChanges = []
+
+    # Statements run on the writer inside a transaction and on the
+    # calling thread's own read connection outside of one. Everything
+    # changing the database has to happen in a transaction.
+    @property
+    def cursor(self):
+        return self.connections.cursor()
+
+    def close(self):
+        self.connections.close()
+
+    # Group any number of mutations into a single commit:
+    #     with db.transaction():
+    #         db.addPackageBinaries(package, binaries)
+    #         db.setPackageStatus(package, 'installed')
+    # Everything done inside the block is rolled back if it raises.
+    # Transactions nest; an inner block is a savepoint, so rolling it
+    # back leaves the work of the enclosing block intact. Only one
+    # thread can be in a transaction at a time, the others wait here.
+    # Listeners are called after the writer has been let go of.
+    @contextmanager
+    def transaction(self):
+        changes = None
+        with self.connections.writer() as cursor:
+            if self.transactionDepth == 0:
+                self.connections.begin()
+                commit = ['commit;']
+                rollback = ['rollback;']
+            else:
+                savepoint = 'sp%d' % self.transactionDepth
+                cursor.execute('savepoint %s;' % savepoint)
+                commit = ['release %s;' % savepoint]
+                rollback = ['rollback to %s;' % savepoint,
+                            'release %s;' % savepoint]
+
+            pathMark = len(self.pendingPathChanges)
+            self.transactionDepth += 1
+            try:
+                yield self
+                # A failed commit, a deferred constraint for one, is
+                # undone like a failed block.
+                for statement in commit:
+                    cursor.execute(statement)
+            except:
+                self.transactionDepth -= 1
+                self._rollback(cursor, rollback)
+                del self.pendingPathChanges[pathMark:]
+                if self.transactionDepth == 0:
+                    self.pendingEnvChanges.clear()
+                    self.pendingInvalidations = set()
+                raise
+            else:
+                self.transactionDepth -= 1
+                if self.transactionDepth == 0:
+                    changes = self._takeChanges()
+
+        if changes is not None:
+            self._notifyListeners(*changes)
+
+    # Undo a failed transaction or savepoint with the rollback
+    # statements. Some errors make sqlite roll back the whole
+    # transaction itself, after which there is nothing left to undo and
+    # the statements would only fail, hiding the error being handled.
+    def _rollback(self, cursor, statements):
+        if not cursor.connection.in_transaction:
+            return
+
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        except sqlite3.Error as e:
+            log.error("Sqlite3 DB (%s) rollback failed: %s",
+                      self.connections.dbFile, e)
+
+    # Run the reads in the block, through the cursor it yields, against
+    # one snapshot of the database, so that writes committing in
+    # between cannot make them disagree. Reads in a transaction see the
+    # writer's state, which no one else can change, anyway.
+    @contextmanager
+    def _snapshot(self):
+        cursor = self.cursor
+        if self.connections.writing() or cursor.connection.in_transaction:
+            yield cursor
+            return
+
+        cursor.execute('begin;')
+        try:
+            yield cursor
+        finally:
+            cursor.execute('commit;')
+
+    # Called once the outermost transaction has committed, still holding
+    # the writer, so no thread can use the cache before it is updated.
+    def _takeChanges(self):
+        if self.pendingInvalidations != set():
+            if self.cache is not None:
+                self.cache.invalidate(self.pendingInvalidations)
+            self.pendingInvalidations = set()
+
+        envChanges = list(self.pendingEnvChanges.values())
+        self.pendingEnvChanges.clear()
+        pathChanges = self.pendingPathChanges
+        self.pendingPathChanges = []
+        return envChanges, pathChanges
+
+    def _notifyListeners(self, envChanges, pathChanges):
+        if envChanges:
+            for listener in self.envListeners:
+                listener(envChanges)
+
+        if pathChanges:
+            for listener in self.pathListeners:
+                listener(pathChanges)
+
+    # Whether the calling thread can use the cache. Not inside a
+    # transaction, where reads see changes that are not committed yet,
+    # and not while another thread writes, when the data version cannot
+    # be checked.
+    def _cacheUsable(self):
+        if self.cache is None or self.connections.writing():
+            return False
 
-    return Sqlite3V1(conn, cursor)
+        version = self.connections.dataVersion()
+        if version is None:
+            return False
+        if version != self.dataVersion:
+            self.dataVersion = version
+            self.cache.invalidate()
+        return True
+
+    # Have the current transaction drop the cached results of the given
+    # kinds for packages when it commits, or all results if packages is
+    # None.
+    def _invalidate(self, packages, kinds=()):
+        if packages is None:
+            self.pendingInvalidations = None
+        elif self.pendingInvalidations is not None:
+            self.pendingInvalidations.update(
+                (kind, package.name, str(package.version))
+                for package in packages for kind in kinds)
+
+    # The result of query(), which reads data of package, through the
+    # cache under key, a tuple starting with the kind of result.
+    # Results are shared, callers must copy mutable ones before handing
+    # them out.
+    def _cached(self, key, package, query):
+        if not self._cacheUsable():
+            return query()
+
+        result, token = self.cache.lookup(key, _missing)
+        if result is _missing:
+            result = query()
+            tag = (key[0], package.name, str(package.version))
+            self.cache.store(token, key, (tag,), result)
+        return result
+
+    # The cache's hits, misses, entries and size, or None without one.
+    def cacheStats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def _packageId(self, package):
+        self.cursor.execute('''
+            select id from packages
+            where name = ? and version = ?;''',
+                            (package.name, str(package.version)))
 
-class Sqlite3V1:
-    def __init__(self, conn, cursor):
-        self.conn = conn
-        self.cursor = cursor
+        row = self.cursor.fetchone()
+        if row is None:
+            raise PackageNotFoundException(
+                "Package not found: {0} {1}".format(package.name,
+                                                    package.version))
+        return row[0]
 
     def createPackage(self, package):
-        self.cursor.execute('insert into packages values (%s, %s);',
-                            package, 'unitialized')
-
-        self.cursor.commit()
+        with self.transaction():
+            self.cursor.execute('''
+                insert into packages (name, version, safe_version, sort_key,
+                                      status)
+                values (?, ?, ?, ?, ?);''',
+                                (package.name, str(package.version),
+                                 package.version.safeStr(),
+                                 package.version.sortBytes(), 'uninitialized'))
+            self._invalidate([package], ['status'])
 
     def deletePackage(self, package):
-        # sqlite3 will automatically clean the environment and path
-        # tables for us.
-        self.cursor.execute('delete from packages where package = %s;',
-                            package)
+        with self.transaction():
+            self.cursor.execute('''
+                select id from packages
+                where name = ? and version = ?;''',
+                                (package.name, str(package.version)))
+            row = self.cursor.fetchone()
+            if row is None:
+                return
+
+            # Cascades into the dependancy lists of other packages.
+            self._invalidate(None)
+            self._invalidateEnv(row[0])
+            if self.pathListeners:
+                self._recordPackagePathsRemoved(package, row[0])
+
+            # Once the package depends on nothing, no path between two
+            # other packages runs through it, and the rows that are left
+            # in dependancy_closure all involve the package itself.
+            self.cursor.execute('''
+                select dependancy_id from dependancies
+                where package_id = ?;''', (row[0],))
+            for depId, in self.cursor.fetchall():
+                self._removeDepEdge(row[0], depId)
+
+            # sqlite3 will automatically clean the other tables for us.
+            self.cursor.execute('delete from packages where id = ?;',
+                                (row[0],))
+
+    # The status of package, or None if it is not registered.
+    def getPackageStatus(self, package):
+        return self._cached(('status', package.name, str(package.version)),
+                            package, lambda: self._readPackageStatus(package))
 
-        self.cursor.commit()
+    def _readPackageStatus(self, package):
+        self.cursor.execute('''
+            select status from packages
+            where name = ? and version = ?;''',
+                            (package.name, str(package.version)))
+
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
 
     # status is the packages current install status. One of
     # 'uninitialized', 'installing', or 'installed'.
     def setPackageStatus(self, package, status):
-        self.cursor.execute('''
-            update table packages set status = %s
-            where package = %s;''', status, package)
+        with self.transaction():
+            self.cursor.execute('''
+                update packages set status = ?
+                where name = ? and version = ?;''',
+                                (status, package.name, str(package.version)))
+            self._invalidate([package], ['status'])
 
     def packageExists(self, package):
-        # Let's make sure we have record of the package
-        self.cursor.execute('select * from packages where package = %s;',
-                            package)
+        return self.getPackageStatus(package) is not None
+
+    # Registered versions of the package called name, oldest first, as
+    # rows of (package, status). minVersion and maxVersion limit the
+    # result to the half-open range [minVersion, maxVersion) and
+    # status to packages in that status. Ordering and range are
+    # resolved by sqlite from the sort_key index.
+    def getPackageVersions(self, name, minVersion=None, maxVersion=None,
+                           status=None):
+        query = '''
+            select %s, p.status from packages p
+            where p.name = ?''' % (_spackageColumn % 'package')
+        args = (name,)
+
+        if minVersion is not None:
+            query += ' and p.sort_key >= ?'
+            args += (minVersion.sortBytes(),)
+        if maxVersion is not None:
+            query += ' and p.sort_key < ?'
+            args += (maxVersion.sortBytes(),)
+        if status is not None:
+            query += ' and p.status = ?'
+            args += (status,)
+
+        self.cursor.execute(query + ' order by p.sort_key;', args)
 
-        if self.cursor.fetchone() is None:
-            return False
-        else:
-            return True
+        return self.cursor.fetchall()
+
+    # Every registered package, by name and then oldest first, as rows
+    # of (package, status). status limits the result to packages in that
+    # status.
+    def getPackages(self, status=None):
+        query = '''
+            select %s, p.status from packages p''' % (_spackageColumn %
+                                                      'package')
+        args = ()
+
+        if status is not None:
+            query += ' where p.status = ?'
+            args += (status,)
+
+        self.cursor.execute(query + ' order by p.name, p.sort_key;', args)
+
+        return self.cursor.fetchall()
+
+    # The newest registered version of the package called name, only
+    # considering packages in status if given. None if there is none.
+    def getNewestVersion(self, name, status=None):
+        query = '''
+            select %s from packages p
+            where p.name = ?''' % (_spackageColumn % 'package')
+        args = (name,)
+
+        if status is not None:
+            query += ' and p.status = ?'
+            args += (status,)
+
+        self.cursor.execute(query + ' order by p.sort_key desc limit 1;', args)
+
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
 
     def addPackageEnv(self, package, varName, varValue,
                       varMode, varSep, build):
+        self.addPackageEnvs(package, [(varName, varValue, varMode, varSep)],
+                            build)
+
+    # Bulk form of addPackageEnv. variables is an iterable of
+    # (name, value, mode, sep) tuples.
+    def addPackageEnvs(self, package, variables, build):
         if build:
             table = 'build_env'
         else:
             table = 'run_env'
 
-        self.cursor.execute('''
-            insert into %s (package, variable, value, mode, sep)
-            values (%s, %s, %s, %s, %s);''', table, package, varName,
-                            varValue, varMode, varSep)
-
-        self.cursor.commit()
+        with self.transaction():
+            packageId = self._packageId(package)
+            self.cursor.executemany('''
+                insert into %s (package_id, variable, value, mode, sep)
+                values (?, ?, ?, ?, ?);''' % table,
+                ((packageId,) + tuple(var) for var in variables))
+            self._invalidateEnv(packageId)
+            self._invalidate([package], ['env'])
 
     def removePackageEnv(self, package, varName, varValue,
                          build):
@@ -191,114 +954,524 @@ class Sqlite3V1:
         else:
             table = 'run_env'
 
-        self.cursor.execute('''
-            delete from %s where
-            package = %s and variable = %s and value = %s;''',
-                            table, package, varName, varValue)
-
-        self.cursor.commit()
+        with self.transaction():
+            packageId = self._packageId(package)
+            self.cursor.execute('''
+                delete from %s where
+                package_id = ? and variable = ? and value = ?;''' % table,
+                                (packageId, varName, varValue))
+            self._invalidateEnv(packageId)
+            self._invalidate([package], ['env'])
 
     def getPackageEnv(self, package, varName=None, build=False):
+        return list(self._cached(
+            ('env', package.name, str(package.version), varName, build),
+            package, lambda: self._readPackageEnv(package, varName, build)))
+
+    def _readPackageEnv(self, package, varName, build):
         if build:
             table = 'build_env'
         else:
             table = 'run_env'
 
-        if varName is None:
-            self.cursor.execute('''
-                select (variable, value, mode, sep) from %s
-                where package = %s;''', table, package)
-
+        query = '''
+            select e.variable, e.value, e.mode, e.sep from %s e
+            join packages p on p.id = e.package_id
+            where p.name = ? and p.version = ?''' % table
+        args = (package.name, str(package.version))
+
+        if varName is not None:
+            query += ' and e.variable = ?'
+            args += (varName,)
+
+        self.cursor.execute(query + ';', args)
+
+        return tuple(self.cursor.fetchall())
+
+    # The environment of package merged with the environments of
+    # everything it depends on, as a dict mapping variable names to
+    # environment.Composed values. Dependancies are applied before the
+    # packages depending on them, so a package's own prepends end up in
+    # front. A package depends on strictly more packages than any of its
+    # dependancies, which makes the closure size a valid order.
+    # Everything is read in one query and the result is cached until an
+    # environment, dependancy or package it was built from changes.
+    def getCompositeVariables(self, package, build=False):
+        return dict(self._cached(
+            ('composite', package.name, str(package.version), build),
+            package, lambda: self._readCompositeVariables(package, build)))
+
+    def _readCompositeVariables(self, package, build):
+        if build:
+            table = 'build_env'
         else:
-            self.cursor.execute('''
-                select (package, variable, value, mode sep) from %s
-                where package = %s and variable = %s''',
-                                table, package, varName)
-
-        return self.cursor.fetchall()
-            
+            table = 'run_env'
 
-    def addPackageDep(self, package, dep):
+        self.cursor.execute('''
+            with target(id) as (
+                select id from packages where name = ? and version = ?
+            ),
+            members(id) as (
+                select id from target
+                union all
+                select c.dependancy_id from dependancy_closure c
+                where c.package_id = (select id from target)
+            ),
+            ranked(id, rank) as (
+                select m.id, (select count(*) from dependancy_closure c
+                              where c.package_id = m.id)
+                from members m
+            )
+            select e.variable, e.value, e.mode, e.sep
+            from ranked r join %s e on e.package_id = r.id
+            order by r.rank, r.id, e.rowid;''' % table,
+                            (package.name, str(package.version)))
+
+        return environment.composeVariables(self.cursor.fetchall())
+
+    # Everything registered for each of packages: a dict mapping every
+    # one of them that exists to a dict with the keys
+    #     deps      the SPackages it depends on directly
+    #     bindirs   its bin dirs, as Paths
+    #     libdirs   its lib dirs, as Paths
+    #     binaries  its binaries, as Paths
+    #     buildEnv  its build environment as (variable, value, mode,
+    #     runEnv    sep) tuples, in the order they were added
+    # One query reads all of it for up to _dataChunk packages.
+    def getPackageData(self, packages):
+        packages = list(packages)
+        result = {}
+
+        for start in range(0, len(packages), _dataChunk):
+            chunk = packages[start:start + _dataChunk]
+            args = []
+            for i, package in enumerate(chunk):
+                args += [i, package.name, str(package.version)]
+
+            self.cursor.execute(_packageDataQuery %
+                                ', '.join(['(?, ?, ?)'] * len(chunk)), args)
+
+            for i, kind, a, b, c, d, seq in self.cursor.fetchall():
+                data = result.get(chunk[i])
+                if data is None:
+                    data = result[chunk[i]] = {
+                        'deps': [], 'bindirs': [], 'libdirs': [],
+                        'binaries': [], 'buildEnv': [], 'runEnv': []}
+
+                if kind == 'deps':
+                    data[kind].append(SPackage(a, v.Version(b)))
+                elif kind.endswith('Env'):
+                    data[kind].append((seq, (a, b, c, d)))
+                elif kind != 'package':
+                    data[kind].append(Path(a))
+
+        # Sorting the few environment rows here is a lot cheaper than
+        # having sqlite sort the whole result.
+        for data in result.values():
+            for kind in ['buildEnv', 'runEnv']:
+                if data[kind]:
+                    data[kind] = [row for seq, row in sorted(data[kind])]
+
+        return result
+
+    # Like getCompositeVariables, but with the final values as strings.
+    def getCompositeEnv(self, package, build=False):
+        return {name: var.value() for name, var
+                in self.getCompositeVariables(package, build).items()}
+
+    # Called whenever the environment of packageId may have changed.
+    # Drops the cached results for it and for the packages depending on
+    # it, whose composite environments include its own, and queues the
+    # affected packages for the envListeners, which are called with the
+    # list of them once the transaction commits.
+    def _invalidateEnv(self, packageId):
+        if self.cache is None and not self.envListeners:
+            return
 
         self.cursor.execute('''
-            insert into dependancies (package, dependancy)
-            values (%s, %s);''', package, dep)
+            select p.id, %s from packages p
+            where p.id = ? or p.id in (select package_id
+                                       from dependancy_closure
+                                       where dependancy_id = ?);'''
+                            % (_spackageColumn % 'package'),
+                            (packageId, packageId))
+        affected = dict(tuple(row) for row in self.cursor.fetchall())
+
+        self._invalidate(affected.values(), ['composite'])
+        if self.envListeners:
+            self.pendingEnvChanges.update(affected)
 
-        self.cursor.commit()
+    def addPackageDep(self, package, dep):
+        self.addPackageDeps(package, [dep])
+
+    # Raises graph.CycleException instead of recording a dependancy
+    # that would make a package depend on itself.
+    def addPackageDeps(self, package, deps):
+        with self.transaction():
+            packageId = self._packageId(package)
+            for dep in deps:
+                depId = self._packageId(dep)
+                if depId == packageId or self._closureHas(depId, packageId):
+                    cycle = graph.DependencyGraph.load(self).path(dep, package)
+                    raise graph.CycleException([package] + cycle)
+
+                self.cursor.execute('''
+                    insert into dependancies (package_id, dependancy_id)
+                    values (?, ?);''', (packageId, depId))
+                self.cursor.execute('''
+                    insert into dependancy_closure
+                        (package_id, dependancy_id, paths)
+                    %s where true
+                    on conflict (package_id, dependancy_id)
+                    do update set paths = paths + excluded.paths;'''
+                                    % _closureDelta,
+                                    (packageId, packageId, depId, depId))
+
+            self._invalidateEnv(packageId)
+            self._invalidate([package], ['deps'])
 
     def removePackageDep(self, package, dep):
+        with self.transaction():
+            packageId = self._packageId(package)
+            depId = self._packageId(dep)
+            self.cursor.execute('''
+                delete from dependancies where
+                package_id = ? and dependancy_id = ?;''', (packageId, depId))
+            if self.cursor.rowcount:
+                self._removeDepEdge(packageId, depId)
+                self._invalidateEnv(packageId)
+                self._invalidate([package], ['deps'])
+
+    # Take the paths through the edge from packageId to depId out of
+    # dependancy_closure.
+    def _removeDepEdge(self, packageId, depId):
+        self.cursor.execute('''
+            with delta as (%s)
+            update dependancy_closure set paths = paths - (
+                select delta.paths from delta
+                where delta.package_id = dependancy_closure.package_id
+                and delta.dependancy_id = dependancy_closure.dependancy_id)
+            where (package_id, dependancy_id) in (
+                select package_id, dependancy_id from delta);'''
+                            % _closureDelta,
+                            (packageId, packageId, depId, depId))
         self.cursor.execute('''
-            delete from dependancies where
-            package = %s and dependancy = %s;''', package, dep)
+            delete from dependancy_closure where paths <= 0;''')
 
-        self.cursor.commit()
+    def _closureHas(self, packageId, depId):
+        self.cursor.execute('''
+            select 1 from dependancy_closure
+            where package_id = ? and dependancy_id = ?;''',
+                            (packageId, depId))
+        return self.cursor.fetchone() is not None
 
     def getPackageDeps(self, package):
+        return list(self._cached(
+            ('deps', package.name, str(package.version)), package,
+            lambda: self._readPackageDeps(package)))
+
+    def _readPackageDeps(self, package):
         self.cursor.execute('''
-            select (dependancy) from dependancies
-            where package = %s;''', package)
+            select %s from dependancies d
+            join packages p on p.id = d.dependancy_id
+            where d.package_id = (select id from packages
+                                  where name = ? and version = ?);'''
+                            % (_spackageColumn % 'dependancy'),
+                            (package.name, str(package.version)))
 
-        return self.cursor.fetchall()
+        return tuple(self.cursor.fetchall())
 
-    def addPackageBindir(self, package, dir):
+    # The packages that depend directly on package.
+    def getPackageDependants(self, package):
         self.cursor.execute('''
-            insert into bindirs (package, dir)
-            values (%s, %s);''', package, dir)
+            select %s from dependancies d
+            join packages p on p.id = d.package_id
+            where d.dependancy_id = (select id from packages
+                                     where name = ? and version = ?);'''
+                            % (_spackageColumn % 'dependant'),
+                            (package.name, str(package.version)))
 
-        self.cursor.execute()
+        return self.cursor.fetchall()
 
-    def removePackageBindir(self, package, dir):
+    # The packages owning path, as rows of (package, kind, path). kind
+    # is 'binary' when path is a registered binary, or 'bindir' or
+    # 'libdir' when path is, or lies inside, a registered directory.
+    # path should be absolute, like the registered paths.
+    def getPathOwners(self, path):
+        path = Path(path)
+        dirs = [str(path)] + [str(parent) for parent in path.parents]
+        dirArgs = ', '.join('?' * len(dirs))
+
+        # Column names of a compound select come from its first part,
+        # so only that one needs the converter annotations.
         self.cursor.execute('''
-            delete from bindirs where
-            package = %s and dir = %s;''', package, dir)
+            select %s, 'binary' as kind, t.binary as "path [path]"
+            from binaries t join packages p on p.id = t.package_id
+            where t.binary = ?
+            union all
+            select p.name || ';' || p.version, 'bindir', t.dir
+            from bindirs t join packages p on p.id = t.package_id
+            where t.dir in (%s)
+            union all
+            select p.name || ';' || p.version, 'libdir', t.dir
+            from libdirs t join packages p on p.id = t.package_id
+            where t.dir in (%s);''' % (_spackageColumn % 'package',
+                                        dirArgs, dirArgs),
+                            [str(path)] + dirs + dirs)
 
-        self.cursor.commit()
+        return self.cursor.fetchall()
 
-    def getPackageBindirs(self, package):
+    # Every registered binary, bin dir and lib dir, as rows of (path,
+    # kind, package) with kind as in getPathOwners.
+    def getAllPaths(self):
         self.cursor.execute('''
-            select (dir) from bindirs
-            where package = %s;''', package)
+            select t.binary as "path [path]", 'binary' as kind, %s
+            from binaries t join packages p on p.id = t.package_id
+            union all
+            select t.dir, 'bindir', p.name || ';' || p.version
+            from bindirs t join packages p on p.id = t.package_id
+            union all
+            select t.dir, 'libdir', p.name || ';' || p.version
+            from libdirs t join packages p on p.id = t.package_id;'''
+                            % (_spackageColumn % 'package'))
 
         return self.cursor.fetchall()
 
-    def addPackageLibdir(self, package, dir):
-        self.cursor.execute('''
-            insert into libdirs (package, dir)
-            values (%s, %s);''', package, dir)
+    # Everything needed to build a graph.DependencyGraph: the list of
+    # package ids, the SPackage for each of them and the list of
+    # (package id, dependancy id) edges.
+    def getDependencyGraph(self):
+        with self._snapshot() as cursor:
+            cursor.execute('''
+                select p.id, %s from packages p
+                order by p.id;''' % (_spackageColumn % 'package'))
+            rows = cursor.fetchall()
 
-        self.cursor.execute()
+            cursor.execute('''
+                select package_id, dependancy_id from dependancies;''')
+            edges = [tuple(row) for row in cursor.fetchall()]
 
-    def removePackageLibdir(self, package, dir):
+        return [row[0] for row in rows], [row[1] for row in rows], edges
+
+    # Everything package depends on, directly or not.
+    def getTransitiveDeps(self, package):
         self.cursor.execute('''
-            delete from libdirs where
-            package = %s and dir = %s;''', package, dir)
+            select %s from dependancy_closure c
+            join packages p on p.id = c.dependancy_id
+            where c.package_id = (select id from packages
+                                  where name = ? and version = ?);'''
+                            % (_spackageColumn % 'dependancy'),
+                            (package.name, str(package.version)))
 
-        self.cursor.commit()
+        return self.cursor.fetchall()
 
-    def getPackageLibdirs(self, package):
+    # Everything that depends on package, directly or not.
+    def getTransitiveDependants(self, package):
         self.cursor.execute('''
-            select (dir) from libdirs
-            where package = %s;''', package)
+            select %s from dependancy_closure c
+            join packages p on p.id = c.package_id
+            where c.dependancy_id = (select id from packages
+                                     where name = ? and version = ?);'''
+                            % (_spackageColumn % 'dependant'),
+                            (package.name, str(package.version)))
 
         return self.cursor.fetchall()
 
-    def addPackageBinary(self, package, binary):
+    # Whether package depends on dep, directly or not.
+    def dependsOn(self, package, dep):
         self.cursor.execute('''
-            insert into binaries (package binary)
-            values (%s, %s);''', package, binary)
+            select 1 from dependancy_closure
+            where package_id = (select id from packages
+                                where name = ? and version = ?)
+            and dependancy_id = (select id from packages
+                                 where name = ? and version = ?);''',
+                            (package.name, str(package.version),
+                             dep.name, str(dep.version)))
+
+        return self.cursor.fetchone() is not None
+
+    # Recompute dependancy_closure from scratch and compare it with the
+    # stored table. Returns the differences as a list of (package, dep,
+    # expected paths, stored paths) tuples, where a missing row counts
+    # as 0 paths. With repair, the stored table is replaced by the
+    # recomputed one.
+    def checkClosure(self, repair=False):
+        with self.transaction():
+            expected = {(packageId, depId): paths for packageId, depId, paths
+                        in sqlite3ComputeClosure(self.cursor)}
 
-        self.cursor.commit()
+            self.cursor.execute('''
+                select package_id, dependancy_id, paths
+                from dependancy_closure;''')
+            stored = {(packageId, depId): paths for packageId, depId, paths
+                      in self.cursor.fetchall()}
+
+            differences = []
+            for key in expected.keys() | stored.keys():
+                if expected.get(key, 0) != stored.get(key, 0):
+                    differences.append((key[0], key[1], expected.get(key, 0),
+                                        stored.get(key, 0)))
+
+            if repair and differences:
+                self._invalidate(None)
+                self.cursor.execute('delete from dependancy_closure;')
+                self.cursor.executemany('''
+                    insert into dependancy_closure
+                        (package_id, dependancy_id, paths)
+                    values (?, ?, ?);''',
+                    ((packageId, depId, paths)
+                     for (packageId, depId), paths in expected.items()))
+
+            if not differences:
+                return []
 
-    def removePackageBinary(self, package, binary):
+            self.cursor.execute('''
+                select p.id, %s from packages p;'''
+                                % (_spackageColumn % 'package'))
+            packages = dict(tuple(row) for row in self.cursor.fetchall())
+
+        return [(packages[packageId], packages[depId], expectedPaths,
+                 storedPaths)
+                for packageId, depId, expectedPaths, storedPaths
+                in differences]
+
+    # The path tables and the name of their path column.
+    _pathTables = (('bindirs', 'dir'), ('libdirs', 'dir'),
+                   ('binaries', 'binary'))
+
+    def _recordPackagePathsRemoved(self, package, packageId):
+        for table, column in self._pathTables:
+            self.cursor.execute('''
+                select %s from %s where package_id = ?;''' % (column, table),
+                                (packageId,))
+            self.pendingPathChanges.extend(
+                (table, False, package, path)
+                for path, in self.cursor.fetchall())
+
+    def _addPaths(self, table, column, package, paths):
+        if self.pathListeners:
+            paths = list(paths)
+
+        with self.transaction():
+            packageId = self._packageId(package)
+            self.cursor.executemany('''
+                insert into %s (package_id, %s)
+                values (?, ?);''' % (table, column),
+                ((packageId, path) for path in paths))
+            self._invalidate([package], [table])
+
+            if self.pathListeners:
+                self.pendingPathChanges.extend(
+                    (table, True, package, Path(path)) for path in paths)
+
+    def _removePath(self, table, column, package, path):
+        with self.transaction():
+            self.cursor.execute('''
+                delete from %s where
+                package_id = ? and %s = ?;''' % (table, column),
+                                (self._packageId(package), path))
+            self._invalidate([package], [table])
+
+            if self.pathListeners and self.cursor.rowcount > 0:
+                self.pendingPathChanges.append((table, False, package,
+                                                Path(path)))
+
+    def _getPaths(self, table, column, package):
+        return list(self._cached(
+            (table, package.name, str(package.version)), package,
+            lambda: self._readPaths(table, column, package)))
+
+    def _readPaths(self, table, column, package):
         self.cursor.execute('''
-            delete from binaries where
-            package = %s and binary = %s;''', package, binary)
+            select t.%s from %s t
+            join packages p on p.id = t.package_id
+            where p.name = ? and p.version = ?;''' % (column, table),
+                            (package.name, str(package.version)))
+
+        return tuple(self.cursor.fetchall())
+
+    def addPackageBindir(self, package, dir):
+        self.addPackageBindirs(package, [dir])
+
+    def addPackageBindirs(self, package, dirs):
+        self._addPaths('bindirs', 'dir', package, dirs)
+
+    def removePackageBindir(self, package, dir):
+        self._removePath('bindirs', 'dir', package, dir)
+
+    def getPackageBindirs(self, package):
+        return self._getPaths('bindirs', 'dir', package)
 
-        self.cursor.commit()
+    def addPackageLibdir(self, package, dir):
+        self.addPackageLibdirs(package, [dir])
+
+    def addPackageLibdirs(self, package, dirs):
+        self._addPaths('libdirs', 'dir', package, dirs)
+
+    def removePackageLibdir(self, package, dir):
+        self._removePath('libdirs', 'dir', package, dir)
+
+    def getPackageLibdirs(self, package):
+        return self._getPaths('libdirs', 'dir', package)
+
+    def addPackageBinary(self, package, binary):
+        self.addPackageBinaries(package, [binary])
+
+    def addPackageBinaries(self, package, binaries):
+        self._addPaths('binaries', 'binary', package, binaries)
+
+    def removePackageBinary(self, package, binary):
+        self._removePath('binaries', 'binary', package, binary)
 
     def getPackageBinaries(self, package):
+        return self._getPaths('binaries', 'binary', package)
+
+    # The binaries of all installed packages as rows of (binary,
+    # package), ordered by package name and newest version first.
+    def getInstalledBinaries(self):
         self.cursor.execute('''
-            select (binary) from binaries
-            where package = %s;''', package)
+            select b.binary, %s
+            from binaries b join packages p on p.id = b.package_id
+            where p.status = 'installed'
+            order by p.name, p.sort_key desc;'''
+                            % (_spackageColumn % 'package'))
 
         return self.cursor.fetchall()
+
+    # The manifest of package, see scan.rescanTree, as tuples of (path,
+    # size, mtime_ns, inode, mode, digest). Manifests run to hundreds of
+    # thousands of rows, so they come as plain tuples rather than Rows.
+    def getManifest(self, package):
+        packageId = self._packageId(package)
+        cursor = self.cursor.connection.cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute('''
+                select path, size, mtime_ns, inode, mode, digest
+                from manifest where package_id = ?;''', (packageId,))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    # Add rows of (path, size, mtime_ns, inode, mode, digest) to the
+    # manifest of package, replacing those for the same paths.
+    def setManifestEntries(self, package, rows):
+        with self.transaction():
+            packageId = self._packageId(package)
+            self.cursor.executemany('''
+                insert or replace into manifest
+                    (package_id, path, size, mtime_ns, inode, mode, digest)
+                values (?, ?, ?, ?, ?, ?, ?);''',
+                ((packageId,) + tuple(row) for row in rows))
+
+    def removeManifestEntries(self, package, paths):
+        with self.transaction():
+            packageId = self._packageId(package)
+            self.cursor.executemany('''
+                delete from manifest where package_id = ? and path = ?;''',
+                ((packageId, path) for path in paths))
+
+    def clearManifest(self, package):
+        with self.transaction():
+            self.cursor.execute('delete from manifest where package_id = ?;',
+                                (self._packageId(package),))
@@ -0,0 +1,55 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+
+import activation
+import binindex
+
+# Multi-call launcher for binaries from installed packages. lpm links
+# every binary name provided by an installed package to lpm-dispatch in
+# locations.binDir, next to the binary index (see binindex). Run under
+# some name, it looks that name up in the index and execs the binary
+# with the run environment of its package, from its activation files.
+# Neither the config nor the package database is read.
+def main(argv=sys.argv):
+    name = os.path.basename(argv[0])
+    binDir = os.path.dirname(argv[0])
+
+    try:
+        index = binindex.BinaryIndex(os.path.join(binDir, binindex.indexName))
+        entry = index.lookup(name)
+        if entry is None:
+            sys.exit('lpm: %s is not provided by any installed package' % name)
+        binary, instDir = entry
+        env = activation.activate(activation.readActivation(instDir),
+                                  os.environ)
+    except (binindex.IndexException, activation.ActivationException) as e:
+        sys.exit('lpm: %s' % e)
+
+    try:
+        os.execve(binary, [binary] + argv[1:], env)
+    except OSError as e:
+        sys.exit('lpm: %s: %s' % (binary, e.strerror))
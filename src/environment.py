@@ -0,0 +1,86 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Composition of environment variables from (variable, value, mode,
+# sep) rows, as stored in the run_env and build_env tables. Rows are
+# applied in order:
+#   append     adds the value at the end of the variable
+#   prepend    adds the value at the front of the variable
+#   overwrite  replaces everything set so far
+# and the parts of a variable are joined with the separator of the
+# first row that gave one, ':' if none did.
+
+defaultSeparator = ':'
+
+# A composed variable: the values going in front of and after whatever
+# the variable held before, and whether that old value is replaced
+# instead.
+class Composed:
+    __slots__ = ('before', 'after', 'separator', 'overwrite')
+
+    def __init__(self, before, after, separator, overwrite):
+        self.before = before
+        self.after = after
+        self.separator = separator
+        self.overwrite = overwrite
+
+    # The value of the variable, given the value it had before, if any.
+    def value(self, old=None):
+        if old and not self.overwrite:
+            return self.separator.join(self.before + [old] + self.after)
+        return self.separator.join(self.before + self.after)
+
+# Compose rows into a dict mapping each variable to a Composed.
+def composeVariables(rows):
+    # front holds prepended values in reverse, so that every mode is a
+    # list append and the whole composition stays linear.
+    variables = {}
+    for name, value, mode, sep in rows:
+        var = variables.get(name)
+        if var is None:
+            var = variables[name] = [[], [], sep, False]
+        elif var[2] is None:
+            var[2] = sep
+
+        if mode == 'append':
+            var[1].append(value)
+        elif mode == 'prepend':
+            var[0].append(value)
+        elif mode == 'overwrite':
+            var[0] = []
+            var[1] = [value]
+            var[3] = True
+
+    result = {}
+    for name, (front, values, sep, overwrite) in variables.items():
+        front.reverse()
+        if sep is None:
+            sep = defaultSeparator
+        result[name] = Composed(front, values, sep, overwrite)
+    return result
+
+# Compose rows into a dict mapping each variable to its value.
+def compose(rows):
+    return {name: var.value()
+            for name, var in composeVariables(rows).items()}
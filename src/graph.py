@@ -0,0 +1,191 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from array import array
+from collections import deque
+
+# Whole-database dependency graph. The graph is loaded with one query
+# over the dependancies table and kept in compressed sparse row form:
+# the packages get dense indexes, and the dependancies of package i
+# are targets[offsets[i]:offsets[i + 1]]. The same layout, reversed,
+# answers who depends on a package. For a one-off question about a
+# single package the queries on the database object backed by its
+# closure table (getTransitiveDeps, getTransitiveDependants,
+# dependsOn) are cheaper than loading the graph.
+
+class CycleException(Exception):
+    # cycle is the list of SPackages on the cycle, starting and ending
+    # with the same package.
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("Dependency cycle: " +
+                         " -> ".join(str(package) for package in cycle))
+
+def _csr(count, edges):
+    offsets = array('l', bytes(array('l').itemsize * (count + 1)))
+    for source, target in edges:
+        offsets[source + 1] += 1
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+
+    targets = array('l', bytes(array('l').itemsize * len(edges)))
+    fill = offsets[:-1]
+    for source, target in edges:
+        targets[fill[source]] = target
+        fill[source] += 1
+
+    return offsets, targets
+
+class DependencyGraph:
+    # packages is a list of SPackages, edges a list of (package index,
+    # dependancy index) pairs indexing into it.
+    def __init__(self, packages, edges):
+        self.packages = packages
+        self.index = {package: i for i, package in enumerate(packages)}
+        self.offsets, self.targets = _csr(len(packages), edges)
+        self.reverseOffsets, self.reverseTargets = _csr(
+            len(packages), [(target, source) for source, target in edges])
+
+    @staticmethod
+    def load(packageDb):
+        ids, packages, edges = packageDb.getDependencyGraph()
+        index = {packageId: i for i, packageId in enumerate(ids)}
+        return DependencyGraph(packages, [(index[source], index[target])
+                                          for source, target in edges])
+
+    def _indexOf(self, package):
+        try:
+            return self.index[package]
+        except KeyError:
+            raise KeyError("Package not in graph: {0}".format(package))
+
+    def _deps(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def _dependants(self, i):
+        return self.reverseTargets[self.reverseOffsets[i]:
+                                   self.reverseOffsets[i + 1]]
+
+    def _reach(self, start, neighbours):
+        seen = set(start)
+        queue = deque(start)
+        while queue:
+            for j in neighbours(queue.popleft()):
+                if j not in seen:
+                    seen.add(j)
+                    queue.append(j)
+        return seen
+
+    # The dependancies of package, all of them unless transitive is
+    # false.
+    def dependencies(self, package, transitive=True):
+        i = self._indexOf(package)
+        if transitive:
+            found = self._reach(self._deps(i), self._deps)
+        else:
+            found = self._deps(i)
+        return [self.packages[j] for j in found]
+
+    # The packages depending on package, directly or not.
+    def dependants(self, package, transitive=True):
+        i = self._indexOf(package)
+        if transitive:
+            found = self._reach(self._dependants(i), self._dependants)
+        else:
+            found = self._dependants(i)
+        return [self.packages[j] for j in found]
+
+    # A dependancy path from start to end as a list of SPackages, or
+    # None if start does not depend on end.
+    def path(self, start, end):
+        i = self._indexOf(start)
+        j = self._indexOf(end)
+        parents = {i: None}
+        queue = deque([i])
+        while queue:
+            current = queue.popleft()
+            if current == j:
+                result = []
+                while current is not None:
+                    result.append(self.packages[current])
+                    current = parents[current]
+                return result[::-1]
+            for k in self._deps(current):
+                if k not in parents:
+                    parents[k] = current
+                    queue.append(k)
+        return None
+
+    # Some cycle in the graph as a list of SPackages starting and ending
+    # with the same package, or None if there is no cycle.
+    def findCycle(self):
+        # 0: unvisited, 1: on the current path, 2: done
+        state = bytearray(len(self.packages))
+        for root in range(len(self.packages)):
+            if state[root]:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self._deps(root)))]
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if state[child] == 1:
+                        cycle = [entry[0] for entry in stack]
+                        cycle = cycle[cycle.index(child):] + [child]
+                        return [self.packages[k] for k in cycle]
+                    if state[child] == 0:
+                        state[child] = 1
+                        stack.append((child, iter(self._deps(child))))
+                        break
+                else:
+                    state[node] = 2
+                    stack.pop()
+        return None
+
+    # packages, or all packages if None, together with everything they
+    # depend on, ordered so that each package comes after its
+    # dependancies. Raises CycleException if that is impossible.
+    def topologicalOrder(self, packages=None):
+        if packages is None:
+            nodes = set(range(len(self.packages)))
+        else:
+            start = [self._indexOf(package) for package in packages]
+            nodes = self._reach(start, self._deps)
+
+        # Kahn's algorithm, counting unprocessed dependancies.
+        pending = {i: len(self._deps(i)) for i in nodes}
+        ready = deque(sorted(i for i in nodes if pending[i] == 0))
+        order = []
+        while ready:
+            i = ready.popleft()
+            order.append(self.packages[i])
+            for j in self._dependants(i):
+                if j in pending:
+                    pending[j] -= 1
+                    if pending[j] == 0:
+                        ready.append(j)
+
+        if len(order) < len(nodes):
+            raise CycleException(self.findCycle())
+        return order
@@ -0,0 +1,223 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import deque
+import concurrent.futures
+import logging
+import os
+
+import graph
+import scan
+import store
+import treecopy
+
+log = logging.getLogger(__name__)
+
+# Installs many packages at once, running the installs of packages
+# that do not depend on each other side by side:
+#     plan      the requested packages and everything they depend on
+#               that is not installed yet, from the dependency graph
+#     schedule  a package starts once all of its dependancies are in
+#     workers   run the installer, deduplicate the tree it produced
+#               against the store if that is on, and walk it
+#     manager   registers what was found and marks the package installed
+# Workers only touch the file system; the database is written by the
+# process running the scheduler alone.
+
+# States a package can end up in.
+INSTALLED = 'installed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+class InstallException(Exception):
+    # results maps every planned package to its state, errors the failed
+    # ones to what they failed with.
+    def __init__(self, results, errors):
+        self.results = results
+        self.errors = errors
+        skipped = sum(1 for state in results.values() if state == SKIPPED)
+        super().__init__(
+            "Failed to install %s (%d dependant(s) skipped)" %
+            (', '.join(str(package) for package in errors), skipped))
+
+# Called with (event, package, detail) as the install goes, where event
+# is 'start', INSTALLED, FAILED or SKIPPED. detail is the exception for
+# FAILED and the failed dependancy for SKIPPED.
+def logProgress(event, package, detail):
+    if event == 'start':
+        log.info("Installing %s", package)
+    elif event == INSTALLED:
+        log.info("Installed %s", package)
+    elif event == FAILED:
+        log.error("Failed to install %s: %s", package, detail)
+    elif event == SKIPPED:
+        log.warning("Skipping %s, it depends on %s", package, detail)
+
+# What a worker runs: installer(name, version, instDir) puts the files of
+# the package into instDir, which exists and is empty. The installer has
+# to be picklable, so a module level function or a functools.partial of
+# one. storeDir is the store to deduplicate against, if any. Returns the
+# (kind, path) pairs scan finds in the result, manifest included.
+def _installInWorker(installer, name, version, instDir, storeDir):
+    installer(name, version, instDir)
+    if storeDir is not None:
+        store.dedupe(instDir, storeDir)
+    return list(scan.classify(scan.walk(instDir, scan.lpmDirs), instDir))
+
+# An installer for builds staged in stageRoot/name/version, copying them
+# into the install dir with treecopy. Pass it to installPackages as
+# functools.partial(copyStaged, stageRoot, permissions).
+def copyStaged(stageRoot, permissions, name, version, instDir):
+    treecopy.copyTree(os.path.join(stageRoot, name, str(version)), instDir,
+                      permissions)
+
+def defaultJobs(conf):
+    if 'jobs' in conf.install and conf.install.jobs > 0:
+        return conf.install.jobs
+    return os.cpu_count() or 1
+
+# Install packages, a list of SPackages, and whatever they depend on
+# that is not installed yet, with up to jobs installs at a time. See
+# Manager.installPackages. The installs run on executor, or on a process
+# pool of our own, which is shut down when done; an executor passed in
+# is left running.
+def installPackages(manager, packages, installer, jobs=None, progress=None,
+                    executor=None):
+    packageDb = manager.db
+    if jobs is None:
+        jobs = defaultJobs(manager.config)
+    if jobs < 1:
+        raise ValueError("jobs must be at least 1, not %r" % jobs)
+    if progress is None:
+        progress = logProgress
+
+    storeDir = None
+    if manager.dedupeEnabled():
+        storeDir = manager.storeDir()
+
+    deps = graph.DependencyGraph.load(packageDb)
+    plan = [package for package in deps.topologicalOrder(packages)
+            if packageDb.getPackageStatus(package) != 'installed']
+    planned = set(plan)
+
+    # The number of planned dependancies each package waits for.
+    waiting = {package: sum(1 for dep in deps.dependencies(package, False)
+                            if dep in planned)
+               for package in plan}
+    ready = deque(package for package in plan if waiting[package] == 0)
+    results = {}
+    errors = {}
+
+    def fail(package, error):
+        results[package] = FAILED
+        errors[package] = error
+        progress(FAILED, package, error)
+        for dependant in deps.dependants(package):
+            if dependant in planned and dependant not in results:
+                results[dependant] = SKIPPED
+                progress(SKIPPED, dependant, package)
+
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+    # Futures of the installs in progress, and the Package objects for
+    # them.
+    running = {}
+    loaded = {}
+    manager.indexUpdatesHeld += 1
+    try:
+        while ready or running:
+            while ready and len(running) < jobs:
+                package = ready.popleft()
+                if package in results:
+                    continue
+
+                progress('start', package, None)
+                loaded[package] = manager.getPackage(package.name,
+                                                     package.version)
+                try:
+                    loaded[package].initialize()
+                except Exception as e:
+                    # Nothing was created, the install dir may well be
+                    # someone else's, so there is nothing to undo.
+                    del loaded[package]
+                    fail(package, e)
+                    continue
+                try:
+                    future = executor.submit(_installInWorker, installer,
+                                             package.name,
+                                             str(package.version),
+                                             str(loaded[package].instDir),
+                                             storeDir)
+                except Exception as e:
+                    manager.abortInstall(loaded.pop(package))
+                    fail(package, e)
+                    continue
+                running[future] = package
+
+            if not running:
+                continue
+
+            done, notDone = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                package = running.pop(future)
+                try:
+                    paths = future.result()
+                    with packageDb.transaction():
+                        scan.registerPaths(packageDb, package, paths)
+                        manager.finishInstall(loaded[package],
+                                              updateIndex=False)
+                except Exception as e:
+                    manager.abortInstall(loaded.pop(package))
+                    fail(package, e)
+                    continue
+                del loaded[package]
+
+                results[package] = INSTALLED
+                progress(INSTALLED, package, None)
+                for dependant in deps.dependants(package, False):
+                    if dependant in waiting:
+                        waiting[dependant] -= 1
+                        if waiting[dependant] == 0:
+                            ready.append(dependant)
+    finally:
+        if ownExecutor:
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for future in running:
+                future.cancel()
+            concurrent.futures.wait(running)
+        # Whatever was still running when something went wrong is left
+        # as it was before.
+        for package in running.values():
+            manager.abortInstall(loaded[package])
+        manager.indexUpdatesHeld -= 1
+        if any(state == INSTALLED for state in results.values()):
+            manager.updateBinaryIndex()
+
+    if errors:
+        raise InstallException(results, errors)
+    return results
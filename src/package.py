@@ -21,7 +21,15 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+
+from pathlib import Path
+
 import db
+import scan
+import treecopy
+
+class EnvironmentException(Exception):
+    pass
 
 class Environment:
     class Variable:
@@ -29,15 +37,17 @@ class Environment:
             self.mode = mode
 
             if mode == "append" or mode == "prepend":
-                self.values = values
+                self.values = list(values)
                 if sep is None:
                     self.separator = ":"
                 else:
                     self.separator = sep
             elif mode == "overwrite":
-                self.value = value
+                self.values = list(values[-1:])
+                self.separator = sep
             else:
-                # blow up
+                raise EnvironmentException(
+                    "Unknown variable mode: {0}".format(mode))
 
         def addValue(self, value):
             if self.mode == "append":
@@ -45,44 +55,53 @@ class Environment:
             elif self.mode == "prepend":
                 self.values.insert(0, value)
             elif self.mode == "overwrite":
-                self.value = value
+                self.values = [value]
 
         def setValue(self, value):
             if self.mode == "overwrite":
-                self.addValue(value):
+                self.addValue(value)
             else:
-                # blow up
+                raise EnvironmentException(
+                    "Cannot set a variable in {0} mode".format(self.mode))
 
         def get(self):
             if self.mode == "overwrite":
-                return self.value
+                return self.values[0] if self.values else None
             else:
-                result = ""
-                for value in self.values:
-                    result += value + self.sep
-                return result[:-1] # strip the trailing separator
+                return self.separator.join(self.values)
 
         def removeValue(self, value):
             self.values.remove(value)
             
 
+    # getter() returns the (variable, value, mode, sep) rows stored for
+    # all variables, in the order they were added. setter(name, value,
+    # mode, sep) stores one value and remover(name, value) deletes one.
     def __init__(self, getter, setter, remover):
-        self.variables = {}
+        self.variables = None
         self.getter = getter
         self.setter = setter
         self.remover = remover
 
-    def _cache(self, name):
-        if name not in self.variables:
-            var = self.getter(name)
-            if var is not None:
-                self.variables[name] 
+    # All variables are fetched with one getter call, on first use.
+    def _cache(self, name=None):
+        if self.variables is None:
+            rows = {}
+            for varName, value, mode, sep in self.getter():
+                rows.setdefault(varName, []).append((value, mode, sep))
+
+            self.variables = {}
+            for varName, varRows in rows.items():
+                self.variables[varName] = Environment.Variable(
+                    [row[0] for row in varRows], varRows[0][1],
+                    varRows[0][2])
 
     def get(self, name):
-        self._cache(name):
+        self._cache(name)
         return self.variables[name].get()
 
     def asDict(self):
+        self._cache()
         result = {}
 
         for name in self.variables:
@@ -92,20 +111,23 @@ class Environment:
 
     def addValue(self, name, value):
         self._cache(name)
-        self.setter(name, value, self.variable[name].mode,
-                    self.variable[name].separator)
-        self.variable[name].addValue(value)
+        self.setter(name, value, self.variables[name].mode,
+                    self.variables[name].separator)
+        self.variables[name].addValue(value)
 
     def removeValue(self, name, value):
         self._cache(name)
         self.remover(name, value)
-        self.variable[name].remove(value)
+        self.variables[name].removeValue(value)
 
     def addVariable(self, name, values=[], mode="append", sep=None):
-        self.setter(name, values, mode, sep)
-        self.variable[name] = Variable(values, mode, sep)
+        self._cache()
+        for value in values:
+            self.setter(name, value, mode, sep)
+        self.variables[name] = Environment.Variable(values, mode, sep)
 
     def removeVariable(self, name):
+        self._cache(name)
         for value in self.variables[name].values:
             self.remover(name, value)
 
@@ -117,61 +139,180 @@ class Package:
         self.name = name
         self.version = vers
         self.config = conf
-
-        self.buildEnv = Environment()
-        self.runEnv = Environment()
-        self.depCache = []
-        self.bindirCache = []
-        self.libdirCache = []
-        self.binaryCache = []
+        self.spackage = db.SPackage(name, vers)
+        self.instDir = Path(conf.locations.packageDir) / name / vers.safeStr()
+
+        self.buildEnv = Environment(self._buildEnvGetter,
+                                    self._buildEnvSetter,
+                                    self._buildEnvRemover)
+        self.runEnv = Environment(self._runEnvGetter,
+                                  self._runEnvSetter,
+                                  self._runEnvRemover)
+
+        # Everything registered for the package, read by _load the first
+        # time any of it is needed. The caches are sets of SPackages and
+        # Paths. envRows maps build to the environment rows, which the
+        # Environments turn into variables of their own.
+        self.depCache = None
+        self.bindirCache = None
+        self.libdirCache = None
+        self.binaryCache = None
+        self.envRows = None
+
+    def _load(self):
+        if self.depCache is None:
+            hydrate([self])
+
+    def _setData(self, data):
+        self.depCache = set(data['deps'])
+        self.bindirCache = set(data['bindirs'])
+        self.libdirCache = set(data['libdirs'])
+        self.binaryCache = set(data['binaries'])
+        self.envRows = {True: data['buildEnv'], False: data['runEnv']}
+
+    def _buildEnvGetter(self):
+        self._load()
+        return self.envRows[True]
 
     def _buildEnvSetter(self, varName, varValue, varMode, varSep):
-        self.db.addPackageEnv(self.name, self.version, varName,
+        self.db.addPackageEnv(self.spackage, varName,
                               varValue, varMode, varSep, build=True)
 
-    def 
+    def _buildEnvRemover(self, varName, varValue):
+        self.db.removePackageEnv(self.spackage, varName, varValue,
+                                 build=True)
+
+    def _runEnvGetter(self):
+        self._load()
+        return self.envRows[False]
+
+    def _runEnvSetter(self, varName, varValue, varMode, varSep):
+        self.db.addPackageEnv(self.spackage, varName,
+                              varValue, varMode, varSep, build=False)
+
+    def _runEnvRemover(self, varName, varValue):
+        self.db.removePackageEnv(self.spackage, varName, varValue,
+                                 build=False)
 
     def initialize(self):
         packageDir = Path(self.config.locations.packageDir)
-        instDir = packageDir / self.name / self.version.safeStr()
 
         packageDir.mkdir(mode=self.config.install.permissions,
-                         parents=True)
-        instDir.mkdir(parents=True)
-
-        self.db.setPackageStatus(self.name, self.version, 'installing')
-
+                         parents=True, exist_ok=True)
+        self.instDir.mkdir(parents=True)
+
+        self.db.setPackageStatus(self.spackage, 'installing')
+
+    # Copy the build staged in stageDir into the install dir, see
+    # treecopy.copyTree.
+    def installFrom(self, stageDir, jobs=treecopy.defaultJobs):
+        return treecopy.copyTree(stageDir, self.instDir,
+                                 self.config.install.permissions, jobs)
+
+    # Register what changed in the install tree since it was scanned,
+    # see scan.rescanTree.
+    def rescan(self, chunkSize=scan.defaultChunkSize, hash=False, jobs=1):
+        try:
+            return scan.rescanTree(self.db, self.spackage, self.instDir,
+                                   chunkSize, hash, jobs)
+        finally:
+            self.depCache = None
+
+    # Walk the install tree and register every bin dir, lib dir and
+    # executable found in it. See scan.registerTree. The paths go to the
+    # database directly, so what the package had loaded is read again.
+    def scan(self, chunkSize=scan.defaultChunkSize):
+        try:
+            return scan.registerTree(self.db, self.spackage, self.instDir,
+                                     chunkSize)
+        finally:
+            self.depCache = None
+
+    # Raises graph.CycleException instead of recording a dependancy
+    # that would make the package depend on itself.
     def addDep(self, dep):
-        self.db.addPackageDep(self.name, self.version,
-                              dep.name, dep.version)
+        self.db.addPackageDep(self.spackage, dep.spackage)
+        if self.depCache is not None:
+            self.depCache.add(dep.spackage)
 
     def removeDep(self, dep):
-        self.db.removePackageDep(self.name, self.version,
-                                 dep.name, dep.version)
+        self.db.removePackageDep(self.spackage, dep.spackage)
+        if self.depCache is not None:
+            self.depCache.discard(dep.spackage)
 
     def addLibdir(self, dir):
-        self.db.addPackageLibdir(self.name, self.version, dir)
-        self.libdirCache.append(dir)
+        self.db.addPackageLibdir(self.spackage, dir)
+        if self.libdirCache is not None:
+            self.libdirCache.add(Path(dir))
 
     def removeLibdir(self, dir):
-        self.db.removePackageLibdir(self.name, self.version, dir)
-        self.libdirCache.remove(dir)
+        self.db.removePackageLibdir(self.spackage, dir)
+        if self.libdirCache is not None:
+            self.libdirCache.discard(Path(dir))
 
     def addBindir(self, dir):
-        self.db.addPackageBindir(self.name, self.version, dir)
-        self.bindirCache.append(dir)
+        self.db.addPackageBindir(self.spackage, dir)
+        if self.bindirCache is not None:
+            self.bindirCache.add(Path(dir))
 
     def removeBindir(self, dir):
-        self.db.removePackageBindir(self.name, self.version, dir)
-        self.bindirCache.remove(dir)
+        self.db.removePackageBindir(self.spackage, dir)
+        if self.bindirCache is not None:
+            self.bindirCache.discard(Path(dir))
 
     def addBinary(self, binary):
-        self.db.addPackageBinary(self.name, self.version, binary)
-        self.binaryCache.append(binary)
+        self.db.addPackageBinary(self.spackage, binary)
+        if self.binaryCache is not None:
+            self.binaryCache.add(Path(binary))
 
     def removeBinary(self, binary):
-        self.db.removePackageBinary(self.name, self.version, binary)
-        self.binaryCache.remove(binary)
+        self.db.removePackageBinary(self.spackage, binary)
+        if self.binaryCache is not None:
+            self.binaryCache.discard(Path(binary))
+
+    # The SPackages the package depends on directly, and its bin dirs,
+    # lib dirs and binaries as Paths. These are the package's own sets,
+    # they must not be changed other than through the methods above.
+    def getDeps(self):
+        self._load()
+        return self.depCache
+
+    def getBindirs(self):
+        self._load()
+        return self.bindirCache
+
+    def getLibdirs(self):
+        self._load()
+        return self.libdirCache
+
+    def getBinaries(self):
+        self._load()
+        return self.binaryCache
 
     def getRunEnv(self):
-        
+        return self.runEnv
+
+    def getBuildEnv(self):
+        return self.buildEnv
+
+    # The environment of the package merged with those of everything it
+    # depends on, as a dict. See Sqlite3V2.getCompositeEnv.
+    def getCompositeEnv(self, build=False):
+        return self.db.getCompositeEnv(self.spackage, build)
+
+# Load the registered data of all packages that have not loaded it yet,
+# with a query per few hundred packages instead of several per package.
+# Listings should hydrate all of their packages up front.
+def hydrate(packages):
+    byDb = {}
+    for package in packages:
+        if package.depCache is None:
+            byDb.setdefault(id(package.db), []).append(package)
+
+    empty = {'deps': [], 'bindirs': [], 'libdirs': [], 'binaries': [],
+             'buildEnv': [], 'runEnv': []}
+    for dbPackages in byDb.values():
+        data = dbPackages[0].db.getPackageData(package.spackage
+                                               for package in dbPackages)
+        for package in dbPackages:
+            package._setData(data.get(package.spackage, empty))
@@ -0,0 +1,360 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import mmap
+import os
+import struct
+
+# The path index answers which packages own a path without the package
+# database. It holds every registered binary, bin dir and lib dir as
+# (path, kind, package name, package version), sorted by path and
+# front coded: each entry stores only the part of its path that differs
+# from the one before. Every restartInterval-th entry stores its whole
+# path and is listed in a restart table, so a lookup binary searches the
+# restarts and decodes at most one run of entries.
+#
+# Layout, integers being little endian:
+#   header    magic, then as 32 bit integers the entry count, the restart
+#             interval, the restart count, the offset of the restart
+#             table, the package count and the offset of the package
+#             table
+#   entries   shared prefix length, suffix length, and package number
+#             times four plus kind, each as a varint (7 bits per byte,
+#             low bits first, high bit set on all but the last byte),
+#             then the suffix
+#   restarts  32 bit offsets of every restartInterval-th entry
+#   packages  32 bit offsets of every package, then the name and
+#             version of every package, each NUL terminated
+#
+# Changes are not written into the index right away but appended to a
+# journal next to it, <index>.journal, and merged in once the journal
+# grows past a fraction of the index. See updateIndex.
+
+# Name of the index in locations.dataDir.
+indexName = 'paths.idx'
+
+restartInterval = 16
+
+# Journals are merged into the index once they have more entries than
+# minMergeSize, or than 1/mergeFraction of the index if that is more.
+minMergeSize = 1024
+mergeFraction = 8
+
+kinds = ('binary', 'bindir', 'libdir')
+_kindNumbers = {kind: i for i, kind in enumerate(kinds)}
+
+_magic = b'lpmpath1'
+_header = struct.Struct('<6I')
+_u32 = struct.Struct('<I')
+
+class IndexException(Exception):
+    pass
+
+def _varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+# The varint at offset in data, and the offset after it.
+def _readVarint(data, offset):
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    n = 0
+    shift = 0
+    while byte >= 0x80:
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        offset += 1
+        byte = data[offset]
+    return n | byte << shift, offset + 1
+
+def journalPath(path):
+    return path + '.journal'
+
+# Write entries, an iterable of (path, kind, name, version) with kind
+# one of kinds, to the index at path, replacing it and its journal.
+def writeIndex(path, entries):
+    packageNumbers = {}
+    records = set()
+    for entryPath, kind, name, version in entries:
+        package = (name, version)
+        number = packageNumbers.get(package)
+        if number is None:
+            number = packageNumbers[package] = len(packageNumbers)
+        records.add((os.fsencode(entryPath), _kindNumbers[kind], number))
+    records = sorted(records)
+
+    out = [b'']
+    offset = len(_magic) + _header.size
+    restarts = []
+    previous = b''
+    for i, (entryPath, kind, number) in enumerate(records):
+        shared = 0
+        if i % restartInterval == 0:
+            restarts.append(offset)
+        else:
+            limit = min(len(previous), len(entryPath))
+            while shared < limit and previous[shared] == entryPath[shared]:
+                shared += 1
+        suffix = entryPath[shared:]
+        data = (_varint(shared) + _varint(len(suffix)) +
+                _varint(number << 2 | kind) + suffix)
+        out.append(data)
+        offset += len(data)
+        previous = entryPath
+
+    restartsOffset = offset
+    out.extend(_u32.pack(restart) for restart in restarts)
+    offset += 4 * len(restarts)
+
+    packagesOffset = offset
+    packages = sorted(packageNumbers, key=packageNumbers.get)
+    strings = [os.fsencode(name) + b'\0' + os.fsencode(version) + b'\0'
+               for name, version in packages]
+    offset += 4 * len(packages)
+    for string in strings:
+        out.append(_u32.pack(offset))
+        offset += len(string)
+    out.extend(strings)
+
+    out[0] = _magic + _header.pack(len(records), restartInterval,
+                                   len(restarts), restartsOffset,
+                                   len(packages), packagesOffset)
+
+    tmpPath = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.writelines(out)
+    os.replace(tmpPath, path)
+    try:
+        os.unlink(journalPath(path))
+    except FileNotFoundError:
+        pass
+
+def _readJournal(path):
+    try:
+        with open(journalPath(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    fields = [os.fsdecode(field) for field in data.split(b'\0')]
+    # A write cut short leaves a partial record at the end; skip it.
+    count = (len(fields) - 1) // 5
+    return [(fields[i] == '+', fields[i + 1], fields[i + 2], fields[i + 3],
+             fields[i + 4])
+            for i in range(0, count * 5, 5)]
+
+# Record changes, an iterable of (added, path, kind, name, version), to
+# the index at path, merging the journal into the index once it is big
+# enough.
+def updateIndex(path, changes):
+    data = b''.join(b'\0'.join(os.fsencode(field) for field in
+                               ('+' if added else '-', str(changePath), kind,
+                                name, version)) + b'\0'
+                    for added, changePath, kind, name, version in changes)
+    if not data:
+        return
+
+    fd = os.open(journalPath(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                 0o644)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+    index = PathIndex(path)
+    try:
+        if len(index.journal) > max(minMergeSize,
+                                    len(index) // mergeFraction):
+            writeIndex(path, index.entries())
+    finally:
+        index.close()
+
+class PathIndex:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise IndexException('No path index at %s' % path)
+        except ValueError:
+            raise IndexException('%s is not a path index' % path)
+
+        if self.data[:len(_magic)] != _magic:
+            raise IndexException('%s is not a path index' % path)
+        (self.count, self.interval, self.restartCount, self.restartsOffset,
+         self.packageCount, self.packagesOffset) = \
+            _header.unpack_from(self.data, len(_magic))
+
+        self.journal = _readJournal(path)
+        self.journalPaths = {}
+        for change in self.journal:
+            self.journalPaths.setdefault(change[1], []).append(change)
+
+    def close(self):
+        self.data.close()
+
+    # Number of entries, not counting the journal.
+    def __len__(self):
+        return self.count
+
+    def _package(self, number):
+        offset, = _u32.unpack_from(self.data,
+                                   self.packagesOffset + 4 * number)
+        nameEnd = self.data.find(b'\0', offset)
+        versionEnd = self.data.find(b'\0', nameEnd + 1)
+        return (os.fsdecode(self.data[offset:nameEnd]),
+                os.fsdecode(self.data[nameEnd + 1:versionEnd]))
+
+    def _restartPath(self, i):
+        # Restart entries share nothing with the one before, so the
+        # first byte is always 0.
+        data = self.data
+        offset, = _u32.unpack_from(data, self.restartsOffset + 4 * i)
+        length = data[offset + 1]
+        if length < 0x80:
+            offset += 2
+        else:
+            length, offset = _readVarint(data, offset + 1)
+        while data[offset] >= 0x80:
+            offset += 1
+        offset += 1
+        return data[offset:offset + length]
+
+    # Decode entries from restart i on, as (path, kind, number).
+    def _scan(self, i):
+        if i >= self.restartCount:
+            return
+        offset, = _u32.unpack_from(self.data, self.restartsOffset + 4 * i)
+        end = self.restartsOffset
+        # Almost every varint is a single byte, so that case is decoded
+        # inline.
+        data = self.data
+        path = b''
+        while offset < end:
+            shared = data[offset]
+            if shared < 0x80:
+                offset += 1
+            else:
+                shared, offset = _readVarint(data, offset)
+            length = data[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = _readVarint(data, offset)
+            ref = data[offset]
+            if ref < 0x80:
+                offset += 1
+            else:
+                ref, offset = _readVarint(data, offset)
+            path = path[:shared] + data[offset:offset + length]
+            offset += length
+            yield path, ref & 3, ref >> 2
+
+    # Entries of the index itself for exactly key, a path as bytes, as
+    # a list of (kind, package number), and the path of the last entry
+    # sorting before key, or None if there is none.
+    def _find(self, key):
+        # The last restart whose path sorts before key. Entries for key
+        # can only start after it.
+        low = 0
+        high = self.restartCount
+        while low < high:
+            mid = (low + high) // 2
+            if self._restartPath(mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        start = max(low - 1, 0)
+
+        result = []
+        before = None
+        for entryPath, kind, number in self._scan(start):
+            if entryPath > key:
+                break
+            if entryPath == key:
+                result.append((kinds[kind], number))
+            else:
+                before = entryPath
+        return result, before
+
+    # Every entry, journal included, as (path, kind, name, version).
+    def entries(self):
+        entries = set()
+        for entryPath, kind, number in self._scan(0):
+            name, version = self._package(number)
+            entries.add((os.fsdecode(entryPath), kinds[kind], name, version))
+        for added, entryPath, kind, name, version in self.journal:
+            if added:
+                entries.add((entryPath, kind, name, version))
+            else:
+                entries.discard((entryPath, kind, name, version))
+        return entries
+
+    # The packages owning path, as a sorted list of (name, version, kind,
+    # owned path), with the same meaning as Sqlite3V2.getPathOwners.
+    def owners(self, path):
+        path = os.path.abspath(path)
+        probes = [os.fsencode(path)]
+        while True:
+            parent = os.path.dirname(probes[-1])
+            if parent == probes[-1]:
+                break
+            probes.append(parent)
+
+        owners = set()
+
+        # Probes go from path up to /. Every entry sorting between an
+        # ancestor of path and path starts with that ancestor, so once
+        # the entry before a probe is known, the probes it does not
+        # start with can be skipped.
+        i = 0
+        while i < len(probes):
+            probe = probes[i]
+            found, before = self._find(probe)
+            for kind, number in found:
+                if i == 0 or kind != 'binary':
+                    owners.add(self._package(number) +
+                               (kind, os.fsdecode(probe)))
+            if before is None:
+                break
+            i += 1
+            while i < len(probes) and not before.startswith(probes[i]):
+                i += 1
+
+        for i, probe in enumerate(probes):
+            for added, entryPath, kind, name, version in \
+                    self.journalPaths.get(os.fsdecode(probe), ()):
+                if i != 0 and kind == 'binary':
+                    continue
+                if added:
+                    owners.add((name, version, kind, entryPath))
+                else:
+                    owners.discard((name, version, kind, entryPath))
+        return sorted(owners)
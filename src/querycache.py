@@ -0,0 +1,99 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import OrderedDict
+import threading
+
+# Least recently used cache for database query results. Every entry
+# carries the tags of what it was read from, so that a write can drop
+# just the entries it affects. lookup hands out a token along with its
+# result, and store refuses results whose token predates the last
+# invalidation: the query behind them may have read the database from
+# before the write that caused it.
+class QueryCache:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.tagged = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # The cached value for key, or missing, and the token to store the
+    # result of the query with in the second case.
+    def lookup(self, key, missing=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return missing, self.generation
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0], self.generation
+
+    def store(self, token, key, tags, value):
+        with self.lock:
+            if token != self.generation or self.size <= 0:
+                return
+
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, tags)
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+
+            while len(self.entries) > self.size:
+                self._drop(next(iter(self.entries)))
+
+    # Drop the entries tagged with any of tags, or everything if tags is
+    # None.
+    def invalidate(self, tags=None):
+        with self.lock:
+            self.generation += 1
+            if tags is None:
+                self.entries.clear()
+                self.tagged.clear()
+                return
+
+            for tag in tags:
+                for key in list(self.tagged.get(tag, ())):
+                    self._drop(key)
+
+    def _drop(self, key):
+        value, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self.tagged[tag]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'size': self.size}
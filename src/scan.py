@@ -0,0 +1,318 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import concurrent.futures
+import hashlib
+import logging
+import mmap
+import os
+import stat
+
+import activation
+
+log = logging.getLogger(__name__)
+
+# Streaming scanner for package install trees. The tree is walked with
+# os.scandir and every stage is a generator, so memory use does not
+# depend on the size of the tree:
+#     walk -> classify -> registerTree (chunked bulk inserts)
+#
+# Registering a tree also records its manifest: the stat of every file,
+# directory and symlink in it but lpm's own, so that rescanTree can tell
+# what changed without reading file contents. Digests, which verify
+# checks the contents against, are left out until rescanTree is asked
+# to hash.
+
+BINDIR = 'bindir'
+LIBDIR = 'libdir'
+BINARY = 'binary'
+FILE = 'file'
+
+# How rescanTree found a path to have changed. When hashing, a file is
+# TOUCHED when its stat changed but neither its content nor its mode
+# did, UNREADABLE when it could not be hashed.
+ADDED = 'added'
+REMOVED = 'removed'
+MODIFIED = 'modified'
+TOUCHED = 'touched'
+UNREADABLE = 'unreadable'
+
+binDirNames = frozenset(['bin', 'sbin'])
+libDirNames = frozenset(['lib', 'lib32', 'lib64', 'libx32'])
+
+# How far below the install root a bin or lib dir may be, so bin and
+# usr/local/bin count but share/doc/foo/examples/bin does not.
+maxDirDepth = 3
+
+defaultChunkSize = 1000
+
+# What lpm keeps in install dirs, which is not part of the package.
+lpmDirs = frozenset([activation.artifactDir])
+
+# Files from this size on are hashed through mmap.
+mmapThreshold = 1 << 20
+
+_readSize = 1 << 20
+
+# Yield (depth, entry) for everything below root, where entry is an
+# os.DirEntry and depth is 1 for the immediate children of root.
+# Symlinked directories are reported but not descended into, and the
+# children of root named in skip are left out altogether.
+def walk(root, skip=frozenset()):
+    stack = [(str(root), 1)]
+    while stack:
+        path, depth = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if depth == 1 and entry.name in skip:
+                        continue
+                    yield depth, entry
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, depth + 1))
+        except OSError as e:
+            log.warning("Skipping unreadable directory %s: %s", path, e)
+
+def _isExecutable(entry):
+    try:
+        mode = entry.stat().st_mode
+    except OSError:
+        # dangling symlink
+        return False
+    return stat.S_ISREG(mode) and mode & 0o111 != 0
+
+# The manifest row of a walk entry: (path relative to root, size,
+# mtime_ns, inode, mode).
+def _manifestRow(entry, prefixLength):
+    st = entry.stat(follow_symlinks=False)
+    return (entry.path[prefixLength:], st.st_size, st.st_mtime_ns,
+            st.st_ino, st.st_mode)
+
+# The sha256 of the content of path, or of the target of a symlink, as
+# hex. Directories have none. Small files are read in one go, large ones
+# mapped, so that hashing them is a single call that does not hold the
+# GIL.
+def digest(path, mode):
+    if stat.S_ISDIR(mode):
+        return None
+    if stat.S_ISLNK(mode):
+        return hashlib.sha256(os.fsencode(os.readlink(path))).hexdigest()
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < mmapThreshold:
+            return hashlib.sha256(f.read()).hexdigest()
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.sha256(mapped).hexdigest()
+        except (OSError, ValueError):
+            pass
+
+        hash = hashlib.sha256()
+        for chunk in iter(lambda: f.read(_readSize), b''):
+            hash.update(chunk)
+        return hash.hexdigest()
+
+# digest, returning (digest, None), or (None, error) if path cannot be
+# read.
+def _tryDigest(path, mode):
+    try:
+        return digest(path, mode), None
+    except OSError as e:
+        return None, e
+
+# Turn the output of walk into (kind, path) pairs. kind is one of
+# BINDIR, LIBDIR or BINARY. Binaries are the executables directly
+# inside a bin dir. Given the root that was walked, there is also a
+# (FILE, row) pair for every entry, with the manifest row of it and no
+# digest yet.
+def classify(entries, root=None):
+    binDirs = set()
+    if root is not None:
+        prefixLength = len(os.path.join(str(root), ''))
+    for depth, entry in entries:
+        if root is not None:
+            yield FILE, _manifestRow(entry, prefixLength) + (None,)
+        if entry.is_dir(follow_symlinks=False):
+            if depth > maxDirDepth:
+                continue
+            if entry.name in binDirNames:
+                binDirs.add(entry.path)
+                yield BINDIR, entry.path
+            elif entry.name in libDirNames:
+                yield LIBDIR, entry.path
+        elif os.path.dirname(entry.path) in binDirs and _isExecutable(entry):
+            yield BINARY, entry.path
+
+# Register everything classify finds under root for package, and its
+# manifest. Results are buffered per kind and flushed with the bulk
+# insert methods every chunkSize paths, all inside one transaction.
+# Returns a dict mapping each kind to the number of paths registered.
+def registerTree(packageDb, package, root, chunkSize=defaultChunkSize):
+    return registerPaths(packageDb, package,
+                         classify(walk(root, lpmDirs), root), chunkSize)
+
+# Like registerTree, for (kind, path) pairs that were classified
+# already, possibly in another process.
+def registerPaths(packageDb, package, paths, chunkSize=defaultChunkSize):
+    flushers = {
+        BINDIR: packageDb.addPackageBindirs,
+        LIBDIR: packageDb.addPackageLibdirs,
+        BINARY: packageDb.addPackageBinaries,
+        FILE: packageDb.setManifestEntries,
+    }
+    buffers = {kind: [] for kind in flushers}
+    counts = {kind: 0 for kind in flushers}
+
+    with packageDb.transaction():
+        for kind, path in paths:
+            buffer = buffers[kind]
+            buffer.append(path)
+            if len(buffer) >= chunkSize:
+                flushers[kind](package, buffer)
+                counts[kind] += len(buffer)
+                buffer.clear()
+
+        for kind, buffer in buffers.items():
+            if buffer:
+                flushers[kind](package, buffer)
+                counts[kind] += len(buffer)
+
+    return counts
+
+# Replace the manifest of package with the tree at root as it is now.
+# For trees changed by lpm itself, deduplication for one.
+def recordManifest(packageDb, package, root, chunkSize=defaultChunkSize):
+    with packageDb.transaction():
+        packageDb.clearManifest(package)
+        registerPaths(packageDb, package,
+                      (pair for pair in classify(walk(root, lpmDirs), root)
+                       if pair[0] == FILE), chunkSize)
+
+# Bring the registration of package up to date with the tree at root,
+# returning what changed as (change, path) pairs, path relative to root.
+# Only paths whose size, mtime, inode or mode differ from the manifest
+# are looked at any closer, and those are MODIFIED with their digest
+# dropped. With hash, files are hashed instead, by jobs threads before
+# anything is written: changed files with a digest to tell MODIFIED
+# from TOUCHED and every file without one to fill it in. Files that
+# cannot be hashed, or are gone by the time they are, are UNREADABLE and
+# keep their manifest entry, so the next rescan looks at them again.
+# The bin dirs, lib dirs and binaries are classified again if paths
+# were added or removed or modes changed.
+def rescanTree(packageDb, package, root, chunkSize=defaultChunkSize,
+               hash=False, jobs=1):
+    root = str(root)
+    prefixLength = len(os.path.join(root, ''))
+    known = {row[0]: row for row in packageDb.getManifest(package)}
+    changes = []
+    updated = []
+    # (path, manifest row, old manifest row or None) of files to hash.
+    pending = []
+    reclassify = False
+
+    for depth, entry in walk(root, lpmDirs):
+        try:
+            row = _manifestRow(entry, prefixLength)
+        except FileNotFoundError:
+            continue
+        old = known.pop(row[0], None)
+        if old is None:
+            changes.append((ADDED, row[0]))
+            reclassify = True
+        elif old[1:5] != row[1:]:
+            if old[4] != row[4]:
+                reclassify = True
+        elif not hash or old[5] is not None or stat.S_ISDIR(row[4]):
+            continue
+
+        if stat.S_ISDIR(row[4]):
+            updated.append(row + (None,))
+        elif hash:
+            pending.append((entry.path, row, old))
+        else:
+            if old is not None:
+                changes.append((MODIFIED, row[0]))
+            updated.append(row + (None,))
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        digests = executor.map(_tryDigest,
+                               [path for path, row, old in pending],
+                               [row[4] for path, row, old in pending])
+        for (path, row, old), (newDigest, error) in zip(pending, digests):
+            if error is not None:
+                log.warning("Cannot hash %s: %s", path, error)
+                if old is None:
+                    updated.append(row + (None,))
+                else:
+                    changes.append((UNREADABLE, row[0]))
+                continue
+            if old is not None and old[1:5] != row[1:]:
+                if old[5] == newDigest and old[4] == row[4]:
+                    changes.append((TOUCHED, row[0]))
+                else:
+                    changes.append((MODIFIED, row[0]))
+            updated.append(row + (newDigest,))
+
+    removed = list(known)
+    for path in removed:
+        changes.append((REMOVED, path))
+        reclassify = True
+
+    with packageDb.transaction():
+        for i in range(0, len(updated), chunkSize):
+            packageDb.setManifestEntries(package, updated[i:i + chunkSize])
+        for i in range(0, len(removed), chunkSize):
+            packageDb.removeManifestEntries(package,
+                                            removed[i:i + chunkSize])
+        if reclassify:
+            _reclassify(packageDb, package, root)
+
+    changes.sort(key=lambda change: change[1])
+    return changes
+
+def _reclassify(packageDb, package, root):
+    registered = {
+        BINDIR: packageDb.getPackageBindirs(package),
+        LIBDIR: packageDb.getPackageLibdirs(package),
+        BINARY: packageDb.getPackageBinaries(package),
+    }
+    removers = {
+        BINDIR: packageDb.removePackageBindir,
+        LIBDIR: packageDb.removePackageLibdir,
+        BINARY: packageDb.removePackageBinary,
+    }
+    registered = {kind: set(str(row[0]) for row in rows)
+                  for kind, rows in registered.items()}
+
+    added = []
+    for kind, path in classify(walk(root, lpmDirs)):
+        if path in registered[kind]:
+            registered[kind].discard(path)
+        else:
+            added.append((kind, path))
+
+    for kind, paths in registered.items():
+        for path in paths:
+            removers[kind](package, path)
+    registerPaths(packageDb, package, added)
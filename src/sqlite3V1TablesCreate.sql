@@ -69,7 +69,7 @@ create table run_env (
 create table dependancies (
     package package not null,
     dependancy package not null,
-    primary key (package, depandancy),
+    primary key (package, dependancy),
     foreign key (package)
         references packages(package)
         on update cascade -- should not be needed
@@ -99,7 +99,7 @@ create table libdirs (
 create table binaries (
     package package not null,
     binary path not null,
-    primary key (package, path)
+    primary key (package, binary),
     foreign key (package)
         references packages(package)
         on update cascade -- should not be needed
@@ -0,0 +1,161 @@
+-- The MIT License (MIT)
+-- Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+-- Permission is hereby granted, free of charge, to any person
+-- obtaining a copy of this software and associated documentation
+-- files (the "Software"), to deal in the Software without
+-- restriction, including without limitation the rights to use, copy,
+-- modify, merge, publish, distribute, sublicense, and/or sell copies
+-- of the Software, and to permit persons to whom the Software is
+-- furnished to do so, subject to the following conditions:
+
+-- The above copyright notice and this permission notice shall be
+-- included in all copies or substantial portions of the Software.
+
+-- THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+-- EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+-- MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+-- NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+-- BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+-- ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+-- CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+-- SOFTWARE.
+
+-- The database format version specifier. Used to aid in backwards
+-- compatibility.
+create table format_version (
+    version integer primary key
+);
+
+insert into format_version values (6);
+
+-- Package master table. version is the version string as produced by
+-- str() on the parsed version, safe_version is its safeStr() and
+-- sort_key its sortBytes(), which orders the versions of a package.
+create table packages (
+    id integer primary key,
+    name text not null,
+    version text not null,
+    safe_version text not null,
+    sort_key blob not null,
+    status text not null,
+    unique (name, version)
+);
+
+create index packages_name_sort_key on packages (name, sort_key);
+
+-- Contains the build environment for installed packages. This build
+-- environment is used for building packages that depend on other
+-- packages we are tracking.
+create table build_env (
+    package_id integer not null, -- package to modify env of
+    variable text not null, -- variable to modify
+    value text not null,
+    mode text not null, -- how to modify (append, prepend, or overwrite)
+    sep text, -- separator used when appending or prepending
+    primary key (package_id, variable, value),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+);
+
+-- Similar to the build environment package but contains the
+-- environment used when running package binaries.
+create table run_env (
+    package_id integer not null,
+    variable text not null,
+    value text not null,
+    mode text not null,
+    sep text,
+    primary key (package_id, variable, value),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+);
+
+create table dependancies (
+    package_id integer not null,
+    dependancy_id integer not null,
+    primary key (package_id, dependancy_id),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade,
+    foreign key (dependancy_id)
+        references packages(id)
+        on delete cascade
+);
+
+create table bindirs (
+    package_id integer not null,
+    dir path not null,
+    primary key (package_id, dir),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+);
+
+create table libdirs (
+    package_id integer not null,
+    dir path not null,
+    primary key (package_id, dir),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+);
+
+create table binaries (
+    package_id integer not null,
+    binary path not null,
+    primary key (package_id, binary),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+);
+
+-- The primary keys above all lead with package_id. These cover the
+-- reverse direction: who depends on a package and which package owns
+-- a path.
+create index dependancies_dependancy on dependancies (dependancy_id);
+create index bindirs_dir on bindirs (dir);
+create index libdirs_dir on libdirs (dir);
+create index binaries_binary on binaries (binary);
+
+-- Transitive closure of dependancies: a row for every package and
+-- everything it depends on, directly or not. paths counts the distinct
+-- dependancy paths between the two, which is what lets removing an
+-- edge be handled incrementally. Kept up to date by the database
+-- class; see checkClosure there.
+create table dependancy_closure (
+    package_id integer not null,
+    dependancy_id integer not null,
+    paths integer not null,
+    primary key (package_id, dependancy_id),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade,
+    foreign key (dependancy_id)
+        references packages(id)
+        on delete cascade
+);
+
+create index dependancy_closure_dependancy
+    on dependancy_closure (dependancy_id);
+
+-- Every file, directory and symlink in the install dir of a package as
+-- it was when last scanned, path relative to the install dir. The stat
+-- columns tell whether a file changed since; digest is the sha256 of
+-- its content, or of the target of a symlink, null for directories and
+-- until lpm rescan --hash takes it.
+create table manifest (
+    package_id integer not null,
+    path text not null,
+    size integer not null,
+    mtime_ns integer not null,
+    inode integer not null,
+    mode integer not null,
+    digest text,
+    primary key (package_id, path),
+    foreign key (package_id)
+        references packages(id)
+        on delete cascade
+) without rowid;
@@ -0,0 +1,184 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import errno
+import logging
+import os
+import shutil
+
+import activation
+import scan
+
+log = logging.getLogger(__name__)
+
+# Content addressed file store. Files with the same content and mode in
+# different install trees, typically adjacent versions of a package,
+# become hard links to one blob in the store:
+#     <storeDir>/objects/<first 2 digits>/<rest of sha256>-<mode>
+# The mode is part of the name because linked files share it; write
+# permission is taken away from deduplicated files, so that writing to
+# one cannot change the others.
+#
+# The link count of a blob is its reference count. A blob whose only
+# link is the one in the store is not used by any tree and can go.
+# Every deduplicated tree lists its blobs in .lpm/store, so removing a
+# tree only has to look at those; collect sweeps the whole store.
+#
+# Store and install trees have to be on the same file system. Where they
+# are not, files are left as they are.
+
+manifestName = 'store'
+
+def _manifestPath(root):
+    return os.path.join(str(root), activation.artifactDir, manifestName)
+
+def blobPath(storeDir, digest, mode):
+    return os.path.join(storeDir, 'objects', digest[:2],
+                        '%s-%o' % (digest[2:], mode))
+
+# Replace path with a hard link to blob. Returns False if blob is gone.
+def _linkOver(blob, path):
+    tmpPath = path + '.lpm-tmp'
+    try:
+        os.link(blob, tmpPath)
+    except FileNotFoundError:
+        return False
+    os.replace(tmpPath, path)
+    return True
+
+# Deduplicate the regular files below root against the store. Files
+# whose content is in the store already are replaced by links to it,
+# the others become new blobs. Does nothing for a tree that was done
+# before, or one on another file system than the store. Returns a dict
+# with the number of 'files' looked at, how many of them were 'linked'
+# to existing blobs and the bytes that 'saved'.
+def dedupe(root, storeDir):
+    root = str(root)
+    stats = {'files': 0, 'linked': 0, 'saved': 0}
+    manifestFile = _manifestPath(root)
+    if os.path.exists(manifestFile):
+        return stats
+
+    os.makedirs(storeDir, exist_ok=True)
+    if os.stat(storeDir).st_dev != os.stat(root).st_dev:
+        log.warning("Store %s is on another file system than %s, "
+                    "not deduplicating", storeDir, root)
+        return stats
+
+    artifacts = os.path.join(root, activation.artifactDir)
+    blobs = set()
+    for depth, entry in scan.walk(root):
+        if entry.path.startswith(artifacts + os.sep) or \
+           not entry.is_file(follow_symlinks=False):
+            continue
+        st = entry.stat(follow_symlinks=False)
+        if st.st_size == 0:
+            continue
+
+        stats['files'] += 1
+        mode = st.st_mode & 0o7777 & ~0o222
+        blob = blobPath(storeDir, scan.digest(entry.path, st.st_mode), mode)
+        blobs.add(os.path.relpath(blob, storeDir))
+
+        try:
+            blobSt = os.stat(blob)
+        except FileNotFoundError:
+            blobSt = None
+
+        if blobSt is not None:
+            if (blobSt.st_dev, blobSt.st_ino) == (st.st_dev, st.st_ino):
+                continue
+            if _linkOver(blob, entry.path):
+                stats['linked'] += 1
+                stats['saved'] += st.st_size
+                continue
+
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(entry.path, blob)
+        except FileExistsError:
+            # Someone else stored the same content just now.
+            if _linkOver(blob, entry.path):
+                stats['linked'] += 1
+                stats['saved'] += st.st_size
+        except OSError as e:
+            # Mounts of the same file system, bind mounts for one, do
+            # not link to each other either. The files done so far are
+            # still recorded.
+            if e.errno != errno.EXDEV:
+                raise
+            log.warning("Cannot link %s into the store %s, not "
+                        "deduplicating the rest of %s", entry.path,
+                        storeDir, root)
+            blobs.discard(os.path.relpath(blob, storeDir))
+            break
+        else:
+            os.chmod(entry.path, mode)
+
+    os.makedirs(os.path.dirname(manifestFile), exist_ok=True)
+    with open(manifestFile + '.tmp', 'w') as f:
+        f.write(''.join(blob + '\n' for blob in sorted(blobs)))
+    os.replace(manifestFile + '.tmp', manifestFile)
+
+    return stats
+
+# Another process may link to the blob between the check and the
+# unlink. Its tree keeps the file, only the store loses track of it.
+def _release(blob):
+    try:
+        if os.stat(blob).st_nlink == 1:
+            os.unlink(blob)
+            return 1
+    except FileNotFoundError:
+        pass
+    return 0
+
+# Remove the tree at root and the blobs nothing else links to any more.
+# Returns the number of blobs removed.
+def removeTree(root, storeDir):
+    root = str(root)
+    try:
+        with open(_manifestPath(root)) as f:
+            blobs = f.read().split()
+    except FileNotFoundError:
+        blobs = []
+
+    shutil.rmtree(root, ignore_errors=True)
+    return sum(_release(os.path.join(storeDir, blob)) for blob in blobs)
+
+# Remove every blob in the store that no tree links to, for instance
+# after trees were deleted without removeTree. Returns the number of
+# blobs removed.
+def collect(storeDir):
+    objects = os.path.join(storeDir, 'objects')
+    if not os.path.isdir(objects):
+        return 0
+
+    removed = 0
+    for depth, entry in scan.walk(objects):
+        if entry.is_file(follow_symlinks=False) and \
+           entry.stat(follow_symlinks=False).st_nlink == 1:
+            os.unlink(entry.path)
+            removed += 1
+    return removed
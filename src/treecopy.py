@@ -0,0 +1,250 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import concurrent.futures
+import errno
+import logging
+import os
+import stat
+
+log = logging.getLogger(__name__)
+
+# Copies directory trees, staged builds into install dirs mostly, with
+# as little copying of data as the file system allows. File contents go
+# by the first of these that works:
+#     FICLONE          a reflink, sharing the blocks until either side
+#                      is written (btrfs, xfs and the like)
+#     copy_file_range  copied inside the kernel, or by the file system
+#     sendfile         copied inside the kernel
+#     read and write   the fallback
+# A method that turns out not to be supported between two file systems
+# is not tried again for them. Files are copied by a pool of threads,
+# which is worth it for trees of many small files where the time goes to
+# system calls; the directories are walked and created by the calling
+# thread.
+#
+# Copies keep the mode and times of files, directories and symlinks.
+# Symlinks are copied as symlinks. Other special files are skipped.
+
+# From linux/fs.h.
+FICLONE = 0x40049409
+
+# Threads mostly wait in system calls, but past a thread per CPU they
+# only get in each other's way.
+defaultJobs = min(8, os.cpu_count() or 1)
+
+# Files handed to a thread at a time.
+batchSize = 32
+
+_readSize = 1 << 20
+
+# errno values meaning a method cannot be used between two file systems,
+# as opposed to the copy failing.
+_unsupported = frozenset([errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                          errno.EINVAL, errno.ENOSYS])
+
+class CopyException(Exception):
+    pass
+
+# Each method returns the number of bytes it copied, which is less than
+# size when it ran into an end of file early.
+
+def _clone(src, dst, size):
+    import fcntl
+
+    fcntl.ioctl(dst, FICLONE, src)
+    return size
+
+def _copyRange(src, dst, size):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(src, dst, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+def _sendfile(src, dst, size):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(dst, src, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+def _readWrite(src, dst, size):
+    while True:
+        data = os.read(src, _readSize)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst, view):]
+
+_methods = [('clone', _clone), ('copy_file_range', _copyRange),
+            ('sendfile', _sendfile)]
+if not hasattr(os, 'copy_file_range'):
+    _methods = [m for m in _methods if m[0] != 'copy_file_range']
+
+# (method name, source device, destination device) for the methods
+# found not to work between those devices.
+_failed = set()
+
+def _copyData(src, dst, size, devices):
+    for name, method in _methods:
+        if (name,) + devices in _failed:
+            continue
+        try:
+            copied = method(src, dst, size)
+        except OSError as e:
+            if e.errno not in _unsupported:
+                raise
+            log.debug("%s does not work from device %d to %d: %s",
+                      name, devices[0], devices[1], e)
+            _failed.add((name,) + devices)
+            # Start over, the method may have copied some of it.
+            os.lseek(src, 0, os.SEEK_SET)
+            os.lseek(dst, 0, os.SEEK_SET)
+            os.ftruncate(dst, 0)
+            continue
+
+        if copied < size:
+            # Some file systems, procfs and FUSE ones among them, report
+            # sizes they do not deliver through the kernel copies, and
+            # some kernels will not copy_file_range across file
+            # systems. Whatever is left is read, up to the real end.
+            log.debug("%s stopped at %d of %d bytes, reading the rest",
+                      name, copied, size)
+            os.lseek(src, copied, os.SEEK_SET)
+            os.lseek(dst, copied, os.SEEK_SET)
+            _readWrite(src, dst, size)
+        return name
+
+    _readWrite(src, dst, size)
+    return 'read'
+
+# Copy the regular file src to dst, with st the result of stat on src
+# if it is at hand, keeping its mode and times. dst is replaced if it
+# exists. Returns the number of bytes copied.
+def copyFile(src, dst, st=None):
+    if st is None:
+        st = os.stat(src, follow_symlinks=False)
+
+    srcFd = os.open(src, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        dstFd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC |
+                        os.O_CLOEXEC, 0o600)
+        try:
+            if st.st_size > 0:
+                _copyData(srcFd, dstFd, st.st_size,
+                          (st.st_dev, os.fstat(dstFd).st_dev))
+            os.chmod(dstFd, stat.S_IMODE(st.st_mode))
+            os.utime(dstFd, ns=(st.st_atime_ns, st.st_mtime_ns))
+        finally:
+            os.close(dstFd)
+    finally:
+        os.close(srcFd)
+
+    return st.st_size
+
+def _copyBatch(batch):
+    return sum(copyFile(src, dst, st) for src, dst, st in batch)
+
+def _copySymlink(src, dst, st):
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    os.symlink(os.readlink(src), dst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns), follow_symlinks=False)
+
+# Copy the tree at src into dst, which is created with mode permissions
+# if it does not exist and merged into if it does. Up to jobs threads
+# copy files. Returns a dict with the number of 'files', 'dirs' and
+# 'symlinks' copied and the 'bytes' of file data.
+def copyTree(src, dst, permissions=0o755, jobs=defaultJobs):
+    src = str(src)
+    dst = str(dst)
+    stats = {'files': 0, 'dirs': 0, 'symlinks': 0, 'bytes': 0}
+
+    if not os.path.isdir(dst):
+        os.makedirs(dst, mode=permissions)
+        os.chmod(dst, permissions)
+
+    # Directory modes and times are set last, since creating the files
+    # changes the times and a read only mode would keep them out.
+    dirs = [(src, dst, None)]
+    batch = []
+    futures = []
+    executor = None
+
+    def flush():
+        nonlocal executor
+        if executor is None:
+            if jobs <= 1:
+                stats['bytes'] += _copyBatch(batch)
+                return
+            executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        futures.append(executor.submit(_copyBatch, list(batch)))
+
+    try:
+        i = 0
+        while i < len(dirs):
+            srcDir, dstDir, st = dirs[i]
+            i += 1
+            with os.scandir(srcDir) as entries:
+                for entry in entries:
+                    target = os.path.join(dstDir, entry.name)
+                    st = entry.stat(follow_symlinks=False)
+                    if stat.S_ISDIR(st.st_mode):
+                        if not os.path.isdir(target):
+                            os.mkdir(target, 0o700)
+                        dirs.append((entry.path, target, st))
+                        stats['dirs'] += 1
+                    elif stat.S_ISREG(st.st_mode):
+                        batch.append((entry.path, target, st))
+                        stats['files'] += 1
+                        if len(batch) >= batchSize:
+                            flush()
+                            batch.clear()
+                    elif stat.S_ISLNK(st.st_mode):
+                        _copySymlink(entry.path, target, st)
+                        stats['symlinks'] += 1
+                    else:
+                        log.warning("Not copying special file %s",
+                                    entry.path)
+        if batch:
+            flush()
+
+        for future in futures:
+            stats['bytes'] += future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    for srcDir, dstDir, st in reversed(dirs):
+        if st is not None:
+            os.chmod(dstDir, stat.S_IMODE(st.st_mode))
+            os.utime(dstDir, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    return stats
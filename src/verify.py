@@ -0,0 +1,123 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import concurrent.futures
+import logging
+import os
+import stat
+
+import scan
+
+log = logging.getLogger(__name__)
+
+# Checks the files of installed packages against the digests in their
+# manifests, taken by lpm rescan --hash, see scan.rescanTree. Files
+# are hashed by a pool of threads; hashlib lets go of the GIL while it
+# hashes, so they do run side by side. Results come out as files
+# finish, not in any particular order.
+
+# What verifyPackages found a file to be. A file is UNVERIFIED when its
+# manifest has no digest to check it against, because it was not hashed
+# since it was registered or changed. A package without any manifest is
+# UNVERIFIED as a whole.
+OK = 'ok'
+MISMATCH = 'mismatch'
+MISSING = 'missing'
+UNREADABLE = 'unreadable'
+UNVERIFIED = 'unverified'
+
+# States that mean the package is not known to be what was installed.
+failed = frozenset([MISMATCH, MISSING, UNREADABLE, UNVERIFIED])
+
+# Files waiting to be hashed per thread; bounds memory use for trees of
+# any size while keeping the threads busy.
+_queuedPerJob = 16
+
+def defaultJobs(conf):
+    if 'verify' in conf and conf.verify.jobs > 0:
+        return conf.verify.jobs
+    return os.cpu_count() or 1
+
+# Hash the file at path, which the manifest says has mode and digest
+# expected, returning its state and digest, or a message for
+# UNREADABLE.
+def _check(path, mode, expected):
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return MISSING, None
+    if stat.S_IFMT(st.st_mode) != stat.S_IFMT(mode):
+        return MISMATCH, None
+
+    try:
+        actual = scan.digest(path, st.st_mode)
+    except OSError as e:
+        return UNREADABLE, e.strerror
+    if actual != expected:
+        return MISMATCH, actual
+    return OK, actual
+
+def _wait(futures):
+    done, notDone = concurrent.futures.wait(
+        futures, return_when=concurrent.futures.FIRST_COMPLETED)
+    return done
+
+# Check the files of packages, Package objects, with up to jobs threads.
+# Yields (package, path, state, detail) for every file, as each
+# finishes. path is relative to the install dir of package, detail is
+# the digest found, or the reason for UNREADABLE and UNVERIFIED. A
+# package without a manifest yields one UNVERIFIED result with a path of
+# None.
+def verifyPackages(packages, jobs):
+    executor = concurrent.futures.ThreadPoolExecutor(jobs)
+    pending = {}
+
+    def finished(done):
+        for future in done:
+            package, path = pending.pop(future)
+            state, detail = future.result()
+            yield package, path, state, detail
+
+    try:
+        for package in packages:
+            root = os.path.join(str(package.instDir), '')
+            rows = package.db.getManifest(package.spackage)
+            if not rows:
+                yield package, None, UNVERIFIED, 'no manifest'
+                continue
+            for path, size, mtime, inode, mode, digest in rows:
+                if stat.S_ISDIR(mode):
+                    continue
+                if digest is None:
+                    yield package, path, UNVERIFIED, 'no digest'
+                    continue
+                future = executor.submit(_check, root + path, mode, digest)
+                pending[future] = (package, path)
+                if len(pending) >= jobs * _queuedPerJob:
+                    yield from finished(_wait(pending))
+
+        while pending:
+            yield from finished(_wait(pending))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -22,6 +22,8 @@
 # SOFTWARE.
 
 
+from collections import OrderedDict, namedtuple
+import threading
 import weakref
 import re
 
@@ -30,12 +32,16 @@ import re
 # Priority must be a positive integer. Lower numbers mean a higher priority. Multiple
 # items with the same priority are allowed. Iteration order is not garanteed between
 # two items with the same priority.
+# generation is bumped on every change, so users can tell when something
+# they derived from the list has gone stale.
 class PriorityList(list):
+    generation = 0
+
     def insert(self, priority, item):
-        if len(self) < priority or not self[priority]:
-            self[priority] = [item]
-        else:
-            self[priority].append(item)
+        while len(self) <= priority:
+            self.append([])
+        self[priority].append(item)
+        self.generation += 1
 
     def remove(self, item):
         # We redefined the iterator, we can't use for i in self here
@@ -44,28 +50,12 @@ class PriorityList(list):
                 self[i].remove(item)
             except ValueError:
                 pass
+        self.generation += 1
                 
     def __iter__(self):
-        self.currentIndex = 0
-        self.currentSubIndex = 0
-        return self
-
-    def __next__(self):
-        if self.currentIndex < 0:
-            raise StopIteration()
-        
-        result = self[self.currentIndex][self.currentSubIndex]
-
-        self.currentSubIndex += 1
-        
-        if self.currentSubIndex >= len(self[self.currentIndex]):
-            self.currentSubIndex = 0
-            self.currentIndex += 1
-
-            if self.currentIndex >= len(self):
-                self.currentIndex = -1
-
-        return result
+        for items in list.__iter__(self):
+            for item in items:
+                yield item
 
 class VersionParseException(Exception):
     pass
@@ -73,85 +63,303 @@ class VersionParseException(Exception):
 class IncomparableException(Exception):
     pass
 
+# Encode key, a tuple of non-negative ints, strings, None and nested
+# tuples of the same, as bytes that sort in the same order the tuples
+# do. Ints of different types and strings never meet in the keys
+# versions use, so values of different types are simply ordered None,
+# int, str, tuple. Used to let sqlite order versions.
+def encodeSortKey(key):
+    out = bytearray()
+    for item in key:
+        if item is None:
+            out += b'\x01'
+        elif isinstance(item, int):
+            # The length prefix makes longer numbers sort after shorter
+            # ones.
+            data = item.to_bytes((item.bit_length() + 7) // 8, 'big')
+            out += b'\x02' + bytes([len(data)]) + data
+        elif isinstance(item, str):
+            # Terminated by a 0 byte, so an embedded one is escaped.
+            out += b'\x03' + item.encode().replace(b'\x00', b'\x00\xff') + b'\x00'
+        else:
+            out += b'\x04' + encodeSortKey(item) + b'\x00'
+    return bytes(out)
+
+# Statistics about the parse cache, as returned by Version.cacheInfo.
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
 class VersionMeta(type):
+    def __new__(mcls, name, bases, namespace, **kwds):
+        return super().__new__(mcls, name, bases, namespace)
+
     def __init__(self, name, bases, namespace, **kwds):
+        super().__init__(name, bases, namespace)
         if name != "Version":
-            Version.versionHandlers.insert(kwds["priority"], weakref.ref(namespace))
+            Version.versionHandlers.insert(kwds["priority"], weakref.ref(self))
+
+    # Version(...) hands back an instance of whichever handler accepted
+    # the string. That instance is already initialized, so skip the
+    # __init__ call type.__call__ would otherwise make on it.
+    def __call__(self, *args, **kwds):
+        if self is Version:
+            return self.__new__(self, *args, **kwds)
+        return super().__call__(*args, **kwds)
 
 # Base class for internal version storage. Creating an instance of
 # Version will create an instance of the appropriate subclass that
 # knows how to handle the version string you passed. Subclasses must
-# be orderable. Subclasses must define the function __parse__ in their
-# class body. The function will be passed the arguments passed to
-# Version constructor. The first argument will be the version string
-# to be parsed. This function must return an instance of the subclass
-# if it knows how to handle the version string, and None if not.
+# be orderable. Subclasses must define the attribute pattern, a
+# regular expression matching the whole of the version strings they
+# handle, using unnamed groups only. Parsing tries the patterns in
+# priority order; with many subclasses they are combined into one
+# alternation instead, so a single match picks the handler. Subclasses
+# must also define the function
+# __parse__ in their class body. It is passed the tuple of groups
+# their pattern matched and must return an instance of the subclass.
 # Subclasses must also define the special function __str__, and they
 # must be able to parse the string it returns. Subclasses must define
 # the function safeStr, which will called with no arguments to obtain
 # a safe name for use in filenames and similar. This safe name must
 # be unique between any type of version, and must consist of upper and
-# lower case letters, numbers, and underscores only.
+# lower case letters, numbers, and underscores only. Instances are
+# shared through the parse cache, so they are immutable; subclasses
+# set their attributes once, through self.__dict__.
+# Ordering is driven by two attributes subclasses set on creation:
+# family, any hashable value, and sortKey, a tuple as accepted by
+# encodeSortKey. Only versions of the same family can be ordered,
+# comparing others raises IncomparableException. Versions are equal
+# when both values are.
 class Version(metaclass=VersionMeta):
     versionHandlers = PriorityList()
-    
-    def __new__(cls, versionString):
-        for handlerRef in Version.versionHandlers:
-            handler = handlerRef()
-            if not handler:
-                continue
-            
-            instance = handler.__parse__(versionString)
-            if instance:
+
+    # Parsed versions keyed by version string, least recently used
+    # first. Strings that parse to an already cached version map to
+    # the cached instance, so equal versions are usually identical
+    # objects too.
+    parseCacheSize = 4096
+    _parseCache = OrderedDict()
+    _parseCacheLock = threading.Lock()
+    _parseCacheHits = 0
+    _parseCacheMisses = 0
+
+    def __new__(cls, versionString, *args):
+        if cls is not Version:
+            return super().__new__(cls)
+
+        cache = Version._parseCache
+        with Version._parseCacheLock:
+            instance = cache.get(versionString)
+            if instance is not None:
+                cache.move_to_end(versionString)
+                Version._parseCacheHits += 1
                 return instance
-            
+            Version._parseCacheMisses += 1
+
+        instance = Version._parse(versionString)
+
+        with Version._parseCacheLock:
+            canonical = cache.setdefault(str(instance), instance)
+            if type(canonical) is type(instance):
+                instance = canonical
+            cache[versionString] = instance
+            while len(cache) > Version.parseCacheSize:
+                cache.popitem(last=False)
+
+        return instance
+
+    # Number of handlers up to which _parse tries the pattern of each
+    # in turn, which is the fastest way for a few handlers. Past it one
+    # combined pattern, which costs more per match but does not grow
+    # with the number of handlers, picks the handler.
+    sequentialHandlers = 8
+
+    # (generation, pattern, handlers) as of versionHandlers.generation.
+    # For up to sequentialHandlers handlers pattern is None and handlers
+    # lists (handler reference, fullmatch of its compiled pattern) in
+    # priority order.
+    # Otherwise pattern is the combined pattern of all handlers, and
+    # handlers maps the index of the group wrapping each handler's
+    # pattern to (handler reference, index of its first group, number of
+    # groups).
+    _dispatch = None
+
+    @staticmethod
+    def _dispatchTable():
+        dispatch = Version._dispatch
+        generation = Version.versionHandlers.generation
+        if dispatch is not None and dispatch[0] == generation:
+            return dispatch
+
+        live = [(handlerRef, handlerRef())
+                for handlerRef in Version.versionHandlers]
+        live = [(handlerRef, handler) for handlerRef, handler in live
+                if handler]
+
+        if len(live) <= Version.sequentialHandlers:
+            dispatch = (generation, None,
+                        [(handlerRef, re.compile(handler.pattern).fullmatch)
+                         for handlerRef, handler in live])
+            Version._dispatch = dispatch
+            return dispatch
+
+        alternatives = []
+        handlers = {}
+        group = 1
+        for handlerRef, handler in live:
+            groups = re.compile(handler.pattern).groups
+            alternatives.append('(' + handler.pattern + ')')
+            handlers[group] = (handlerRef, group + 1, groups)
+            group += 1 + groups
+
+        dispatch = (generation, re.compile('|'.join(alternatives)), handlers)
+        Version._dispatch = dispatch
+        return dispatch
+
+    @staticmethod
+    def _parse(versionString):
+        generation, pattern, handlers = Version._dispatchTable()
+
+        if pattern is None:
+            for handlerRef, fullmatch in handlers:
+                match = fullmatch(versionString)
+                if match:
+                    return Version._parseWith(handlerRef, match.groups(),
+                                              versionString)
+        else:
+            match = pattern.fullmatch(versionString)
+            if match:
+                # The group wrapping a handler's pattern closes after
+                # the groups inside it, so it is the last one matched.
+                handlerRef, first, count = handlers[match.lastindex]
+                return Version._parseWith(
+                    handlerRef, match.groups()[first - 1:first - 1 + count],
+                    versionString)
+
         raise VersionParseException("Failed to parse version string: {0}".format(versionString))
 
+    @staticmethod
+    def _parseWith(handlerRef, groups, versionString):
+        handler = handlerRef()
+        if not handler:
+            # Gone since the table was built, build it without it.
+            Version._dispatch = None
+            return Version._parse(versionString)
+        return handler.__parse__(groups)
+
+    @staticmethod
+    def cacheInfo():
+        with Version._parseCacheLock:
+            return CacheInfo(Version._parseCacheHits,
+                             Version._parseCacheMisses,
+                             Version.parseCacheSize,
+                             len(Version._parseCache))
+
+    @staticmethod
+    def clearCache():
+        with Version._parseCacheLock:
+            Version._parseCache.clear()
+            Version._parseCacheHits = 0
+            Version._parseCacheMisses = 0
+
+    def _comparable(self, other):
+        if not isinstance(other, Version):
+            return False
+        if self.family != other.family:
+            raise IncomparableException(
+                "Cannot compare versions {0} and {1}".format(self, other))
+        return True
+
+    def __eq__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return self.family == other.family and self.sortKey == other.sortKey
+
+    def __ne__(self, other):
+        if not isinstance(other, Version):
+            return NotImplemented
+        return not self == other
+
+    def __lt__(self, other):
+        if not self._comparable(other):
+            return NotImplemented
+        return self.sortKey < other.sortKey
+
+    def __le__(self, other):
+        if not self._comparable(other):
+            return NotImplemented
+        return self.sortKey <= other.sortKey
+
+    def __gt__(self, other):
+        if not self._comparable(other):
+            return NotImplemented
+        return self.sortKey > other.sortKey
+
+    def __ge__(self, other):
+        if not self._comparable(other):
+            return NotImplemented
+        return self.sortKey >= other.sortKey
+
+    def __hash__(self):
+        return hash((self.family, self.sortKey))
+
+    # The sort key encoded with encodeSortKey, with the family appended
+    # so that versions of different families get a total, if
+    # arbitrary, order as well.
+    def sortBytes(self):
+        return encodeSortKey(self.sortKey + (self.family,))
+
+    # Pickled, and copied, as the version string, so that unpickling
+    # parses it again and gets the cached instance like any other
+    # Version() call. The default would bypass __new__ and __setattr__.
+    def __reduce__(self):
+        return (Version, (str(self),))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Version objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Version objects are immutable")
+
+_dnPatchPattern = re.compile(r'([A-Za-z]+)([1-9][0-9]*)')
+
 # somepackage version 12.3.4-r1
+# A patch release comes after the plain version, and only versions on
+# the same branch are comparable.
 class DottedNumberVersion(Version, priority=1):
-    def __init__(self, numbers, patch, branch):
-        self.numbers = numbers
-        self.branch = branch
+    pattern = (r'((?:[1-9][0-9]*|0)(?:\.(?:[1-9][0-9]*|0))*)\.?' # numbers
+               r'(?:-([A-Za-z]+[1-9][0-9]*))?'                    # patch
+               r'\s*(?:\((\w+)\))?\s*')                           # branch
 
+    def __init__(self, numbers, patch, branch):
         if patch:
-            match = re.match(r'([A-Za-z]+)([1-9][0-9]*)', patch)
-            self.patchDesc = match.group(1)
-            self.patchNumber = match.group(2)
+            match = _dnPatchPattern.match(patch)
+            patchDesc = match.group(1)
+            patchNumber = int(match.group(2))
         else:
-            self.patchDesc = None
-            self.patchNumber = None
+            patchDesc = None
+            patchNumber = None
 
-            
-    def __parse__(version):
-        number = re.compile(r'([1-9][0-9]*|0)\.?')
-        rest = re.compile(r'(?:-([A-Za-z]+[1-9][0-9]*))?\s*(?:\((\W+)\))?\s*$')
+        numbers = tuple(int(number) for number in numbers)
+        # Laid out like the keys of SemanticVersion, which shares the
+        # family of versions without a branch.
+        sortKey = (numbers, 1, patchDesc or '', patchNumber or 0, '')
 
-        numbers = []
-        while True:
-            match = number.match(version)
-            if match:
-                numbers.append(match.group(1))
-                version = version[match.end():]
-            else:
-                return None
-
-        match = rest.match(version)
-        if match:
-            patch = match.group(1)
-            branch = match.group(2)
-        else:
-            return None
+        self.__dict__.update(numbers=numbers, branch=branch,
+                             patchDesc=patchDesc, patchNumber=patchNumber,
+                             family=('dn', branch or ''), sortKey=sortKey)
 
-        return DottedNumberVersion(numbers, patch, branch)
+    def __parse__(groups):
+        numbers, patch, branch = groups
+        return DottedNumberVersion(numbers.split('.'), patch, branch)
 
     def __str__(self):
-        numbers = '.'.join(self.numbers)
+        numbers = '.'.join(map(str, self.numbers))
         if self.patchDesc is not None:
-            patch = '-' + self.patchDesc + self.patchNumber
+            patch = '-' + self.patchDesc + str(self.patchNumber)
         else:
             patch = ''
 
-        if len(self.branch) == 0:
+        if not self.branch:
             # We have no branch
             branch = ''
         else:
@@ -161,10 +369,98 @@ class DottedNumberVersion(Version, priority=1):
         return numbers + patch + branch
 
     def safeStr(self):
-        numbers = '_'.join(self.numbers)
+        numbers = '_'.join(map(str, self.numbers))
         if self.patchDesc is not None:
-            patch = self.patchDesc + self.patchNumber
+            patch = self.patchDesc + str(self.patchNumber)
         else:
             patch = ''
 
-        return 'dn_' + numbers + patch + self.branch
+        return 'dn_' + numbers + patch + (self.branch or '')
+
+# Escape everything but letters and digits in s as _<hex code>.
+def _safeChars(s):
+    return ''.join(c if c.isalnum() and c.isascii() else '_%x' % ord(c)
+                   for c in s)
+
+# Semantic versions (semver.org), like 1.0.0-rc.1+build.5. Versions
+# that are also valid dotted number versions, like 1.2.3 or 1.2.3-rc1,
+# are parsed as those. Semantic versions are comparable with dotted
+# number versions without a branch, so 1.0.0-rc.1 < 1.0.0 < 1.0.0-r1.
+# Build metadata does not affect precedence, it only breaks ties so
+# that the ordering stays total.
+class SemanticVersion(Version, priority=2):
+    _identifier = r'(?:0|[1-9][0-9]*|[0-9]*[A-Za-z-][0-9A-Za-z-]*)'
+    pattern = (r'(0|[1-9][0-9]*)\.(0|[1-9][0-9]*)\.(0|[1-9][0-9]*)'
+               r'(?:-(' + _identifier + r'(?:\.' + _identifier + r')*))?'
+               r'(?:\+([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?')
+
+    def __init__(self, major, minor, patch, prerelease, build):
+        numbers = (major, minor, patch)
+        if prerelease is None:
+            sortKey = (numbers, 1, '', 0, build or '')
+        else:
+            # Prereleases come before the release, numeric identifiers
+            # before alphanumeric ones.
+            identifiers = tuple((0, int(ident)) if ident.isdigit()
+                                else (1, ident)
+                                for ident in prerelease.split('.'))
+            sortKey = (numbers, 0, identifiers, build or '')
+
+        self.__dict__.update(major=major, minor=minor, patch=patch,
+                             prerelease=prerelease, build=build,
+                             family=('dn', ''), sortKey=sortKey)
+
+    def __parse__(groups):
+        major, minor, patch, prerelease, build = groups
+        return SemanticVersion(int(major), int(minor), int(patch),
+                               prerelease, build)
+
+    def __str__(self):
+        result = '%d.%d.%d' % (self.major, self.minor, self.patch)
+        if self.prerelease is not None:
+            result += '-' + self.prerelease
+        if self.build is not None:
+            result += '+' + self.build
+        return result
+
+    def safeStr(self):
+        result = 'sv_%d_%d_%d' % (self.major, self.minor, self.patch)
+        if self.prerelease is not None:
+            result += '_p' + _safeChars(self.prerelease)
+        if self.build is not None:
+            result += '_b' + _safeChars(self.build)
+        return result
+
+# Calendar versions written as ISO dates, like 2016-10-17, optionally
+# followed by a release number for the day: 2016-10-17.2. Dotted dates
+# such as 2016.10.17 are dotted number versions, which order them the
+# same way.
+class CalendarVersion(Version, priority=3):
+    pattern = (r'([1-9][0-9]{3})-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+               r'(?:\.([1-9][0-9]*|0))?')
+
+    def __init__(self, year, month, day, micro):
+        sortKey = (year, month, day)
+        if micro is not None:
+            sortKey += (micro,)
+
+        self.__dict__.update(year=year, month=month, day=day, micro=micro,
+                             family=('cv',), sortKey=sortKey)
+
+    def __parse__(groups):
+        year, month, day, micro = groups
+        if micro is not None:
+            micro = int(micro)
+        return CalendarVersion(int(year), int(month), int(day), micro)
+
+    def __str__(self):
+        result = '%04d-%02d-%02d' % (self.year, self.month, self.day)
+        if self.micro is not None:
+            result += '.%d' % self.micro
+        return result
+
+    def safeStr(self):
+        result = 'cv_%04d_%02d_%02d' % (self.year, self.month, self.day)
+        if self.micro is not None:
+            result += '_%d' % self.micro
+        return result
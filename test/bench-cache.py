@@ -0,0 +1,85 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Latency of the per package read methods with the query cache, on
+# hits, and without it.
+import sys
+import tempfile
+import time
+
+import config
+import db
+import version as v
+
+packageCount = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+rounds = 20
+
+tmpDir = tempfile.TemporaryDirectory()
+
+def open(cacheSize):
+    return db.getDb(config.resolve([('bench', {
+        'locations': {'dataDir': tmpDir.name},
+        'packageDb': {'type': 'sqlite3',
+                      'dbFile': tmpDir.name + '/packages.db',
+                      'cacheSize': cacheSize},
+    })]))
+
+packages = [db.SPackage('pkg%d' % i, v.Version('1.%d' % (i % 10)))
+            for i in range(packageCount)]
+
+packageDb = open(0)
+with packageDb.transaction():
+    for i, package in enumerate(packages):
+        prefix = '/opt/pkg%d' % i
+        packageDb.createPackage(package)
+        packageDb.addPackageBinaries(package, [prefix + '/bin/tool%d' % j
+                                               for j in range(3)])
+        packageDb.addPackageEnvs(package, [('PATH', prefix + '/bin',
+                                            'prepend', ':')], build=False)
+        if i > 0:
+            packageDb.addPackageDeps(package, [packages[i // 2]])
+packageDb.close()
+
+# The packages an operation would keep asking about.
+working = packages[-100:]
+
+def bench(label, packageDb):
+    methods = [packageDb.packageExists, packageDb.getPackageDeps,
+               packageDb.getPackageBinaries, packageDb.getPackageEnv,
+               packageDb.getCompositeEnv]
+    start = time.perf_counter()
+    for i in range(rounds):
+        for method in methods:
+            for package in working:
+                method(package)
+    elapsed = time.perf_counter() - start
+    calls = rounds * len(methods) * len(working)
+    print("%-12s %8.1f us/read" % (label, elapsed / calls * 1e6))
+
+bench("uncached", open(0))
+cached = open(4096)
+bench("cached", cached)
+print("cache stats: %r" % (cached.cacheStats(),))
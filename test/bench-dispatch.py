@@ -0,0 +1,99 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Cost of launching through the dispatcher: looking a name up in a
+# binary index of 100k names, and a whole launch through the dispatcher
+# compared to running the binary directly.
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import activation
+import binindex
+import core
+import environment
+
+nameCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+lookups = 10000
+launches = 50
+
+tmpDir = tempfile.TemporaryDirectory()
+binDir = tmpDir.name + '/bin'
+instDir = tmpDir.name + '/inst'
+os.makedirs(binDir)
+os.makedirs(instDir)
+activation.writeActivation(instDir, environment.composeVariables(
+    [('PATH', instDir + '/bin', 'prepend', None)]))
+
+indexFile = os.path.join(binDir, binindex.indexName)
+start = time.perf_counter()
+binindex.writeIndex(indexFile,
+                    [('tool%06d' % i, '/bin/true', instDir)
+                     for i in range(nameCount)])
+print("wrote index of %d names (%d bytes) in %.2fs" %
+      (nameCount, os.path.getsize(indexFile), time.perf_counter() - start))
+
+# What the dispatcher does per launch: open, map and search.
+names = ['tool%06d' % (i * 7919 % nameCount) for i in range(lookups)]
+start = time.perf_counter()
+for name in names:
+    index = binindex.BinaryIndex(indexFile)
+    assert index.lookup(name) is not None
+    index.close()
+elapsed = time.perf_counter() - start
+print("open + lookup               %8.1f us" % (elapsed / lookups * 1e6))
+
+index = binindex.BinaryIndex(indexFile)
+start = time.perf_counter()
+for name in names:
+    index.lookup(name)
+elapsed = time.perf_counter() - start
+print("lookup                      %8.1f us" % (elapsed / lookups * 1e6))
+
+start = time.perf_counter()
+for name in names:
+    activation.activate(activation.readActivation(instDir), os.environ)
+elapsed = time.perf_counter() - start
+print("read activation             %8.1f us" % (elapsed / lookups * 1e6))
+
+def launch(argv):
+    start = time.perf_counter()
+    for i in range(launches):
+        subprocess.run(argv, check=True)
+    return (time.perf_counter() - start) / launches
+
+link = os.path.join(binDir, 'tool000042')
+os.symlink(core.dispatcher, link)
+direct = launch(['/bin/true'])
+dispatched = launch([link])
+interpreter = launch(['/bin/python3', '-S', '-c', 'pass'])
+print("direct launch               %8.2f ms" % (direct * 1e3))
+print("launch through dispatcher   %8.2f ms" % (dispatched * 1e3))
+print("  of which bare interpreter %8.2f ms" % ((interpreter - direct) * 1e3))
+print("  of which dispatching      %8.2f ms" %
+      ((dispatched - interpreter) * 1e3))
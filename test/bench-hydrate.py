@@ -0,0 +1,102 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Time to load the deps, dirs, binaries and environments of every
+# registered package: table by table for each package, the way Package
+# used to, against one bulk hydration.
+import sys
+import tempfile
+import time
+
+import config
+import core
+import db
+import package
+import version as v
+
+packageCount = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('bench', {
+    'locations': {'dataDir': tmpDir.name,
+                  'packageDir': tmpDir.name + '/packages',
+                  'binDir': tmpDir.name + '/bin'},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db',
+                  'cacheSize': 0},
+})])
+
+manager = core.Manager(conf)
+packageDb = manager.db
+
+spackages = [db.SPackage('pkg%d' % i, v.Version('1.%d' % (i % 10)))
+             for i in range(packageCount)]
+with packageDb.transaction():
+    for i, spackage in enumerate(spackages):
+        prefix = '/opt/pkg%d' % i
+        packageDb.createPackage(spackage)
+        packageDb.addPackageBindirs(spackage, [prefix + '/bin'])
+        packageDb.addPackageLibdirs(spackage, [prefix + '/lib'])
+        packageDb.addPackageBinaries(spackage, [prefix + '/bin/tool%d' % j
+                                                for j in range(3)])
+        packageDb.addPackageEnvs(spackage, [('PATH', prefix + '/bin',
+                                             'prepend', ':')], build=False)
+        if i > 0:
+            packageDb.addPackageDeps(spackage, [spackages[i // 2]])
+
+def perTable():
+    for spackage in spackages:
+        p = package.Package(conf, packageDb, spackage.name, spackage.version)
+        p._setData({
+            'deps': [row[0] for row in packageDb.getPackageDeps(spackage)],
+            'bindirs': [row[0] for row
+                        in packageDb.getPackageBindirs(spackage)],
+            'libdirs': [row[0] for row
+                        in packageDb.getPackageLibdirs(spackage)],
+            'binaries': [row[0] for row
+                         in packageDb.getPackageBinaries(spackage)],
+            'buildEnv': packageDb.getPackageEnv(spackage, build=True),
+            'runEnv': packageDb.getPackageEnv(spackage, build=False)})
+
+def perPackage():
+    for spackage in spackages:
+        package.Package(conf, packageDb, spackage.name,
+                        spackage.version).getDeps()
+
+def bench(label, fn):
+    best = None
+    for i in range(3):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print("%-24s %8.1f ms" % (label, best * 1e3))
+
+bench("query per table", perTable)
+bench("query per package", perPackage)
+bench("listPackages (bulk)", manager.listPackages)
+bench("getPackageData (bulk)", lambda: packageDb.getPackageData(spackages))
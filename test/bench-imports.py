@@ -0,0 +1,105 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Import time of the lpm entry point for the commands shell integration
+# runs on every prompt, from -X importtime. Modules the interpreter
+# imports by itself are not counted. Exits with status 1 if a command
+# goes over the budget, given in milliseconds as the first argument.
+import os
+import subprocess
+import sys
+import tempfile
+
+import activation
+import environment
+
+budget = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+runs = 5
+
+srcDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+lpm = os.path.join(srcDir, 'lpm')
+
+tmpDir = tempfile.TemporaryDirectory()
+environ = {'XDG_DATA_HOME': tmpDir.name,
+           'XDG_CONFIG_HOME': tmpDir.name + '/config',
+           'HOME': tmpDir.name,
+           'PATH': os.environ['PATH']}
+
+# A package with activation files is all run and env look at.
+nameDir = tmpDir.name + '/lpm/packages/tool'
+instDir = nameDir + '/dn_1_0'
+os.makedirs(instDir)
+activation.writeActivation(instDir, environment.composeVariables(
+    [('PATH', instDir + '/bin', 'prepend', None)]))
+activation.setCurrent(nameDir, 'dn_1_0')
+
+# Self times in microseconds of the modules imported by argv.
+def importTimes(argv):
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + argv,
+                            env=environ, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(selfTime)
+    return times
+
+baseline = set(importTimes(['-c', 'pass']))
+
+# Commands with an explicit version have to parse it, which needs
+# version and re. They are shown, but not held to the budget.
+commands = [(['env', 'tool'], True),
+            (['run', 'tool', 'true'], True),
+            (['env', '-v', '1.0', 'tool'], False)]
+
+failed = False
+for command, budgeted in commands:
+    best = None
+    for i in range(runs):
+        times = {name: us for name, us in importTimes([lpm] + command).items()
+                 if name not in baseline}
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+
+    total = sum(best.values()) / 1000
+    if not budgeted:
+        status = 'not budgeted'
+    elif total > budget:
+        status = 'OVER BUDGET'
+        failed = True
+    else:
+        status = 'ok'
+    print("lpm %-22s %6.1f ms in %3d imports  %s" %
+          (' '.join(command), total, len(best), status))
+    if budgeted and total > budget:
+        for name in sorted(best, key=best.get, reverse=True)[:5]:
+            print("    %-30s %6.1f ms" % (name, best[name] / 1000))
+
+print("budget %.1f ms" % budget)
+if failed:
+    sys.exit(1)
@@ -0,0 +1,100 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+# Reverse dependency and path ownership lookup latency with 50k
+# registered packages, with and without the secondary indexes.
+import random
+import sys
+import tempfile
+import time
+
+import config
+import db
+import version as v
+
+packageCount = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+lookups = 1000
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+
+packageDb = db.getDb(conf)
+
+packages = [db.SPackage('pkg%d' % i, v.Version('1.%d' % (i % 10)))
+            for i in range(packageCount)]
+
+start = time.perf_counter()
+with packageDb.transaction():
+    for i, package in enumerate(packages):
+        prefix = '/opt/pkg%d' % i
+        packageDb.createPackage(package)
+        packageDb.addPackageBindirs(package, [prefix + '/bin'])
+        packageDb.addPackageLibdirs(package, [prefix + '/lib'])
+        packageDb.addPackageBinaries(package, [prefix + '/bin/tool%d' % j
+                                               for j in range(3)])
+        if i > 0:
+            packageDb.addPackageDeps(package, [packages[i // 2]])
+print("populated %d packages in %.2fs" % (packageCount,
+                                          time.perf_counter() - start))
+
+def bench(label, fn, args):
+    start = time.perf_counter()
+    for arg in args:
+        fn(arg)
+    elapsed = time.perf_counter() - start
+    print("%-28s %8.1f us/lookup" % (label, elapsed / len(args) * 1e6))
+
+random.seed(0)
+depTargets = random.sample(packages, lookups)
+pathTargets = ['/opt/pkg%d/bin/tool1' % random.randrange(packageCount)
+               for i in range(lookups)]
+libTargets = ['/opt/pkg%d/lib/a/b/libx.so' % random.randrange(packageCount)
+              for i in range(lookups)]
+
+def run(suffix):
+    bench("reverse deps" + suffix, packageDb.getPackageDependants,
+          depTargets)
+    bench("binary owner" + suffix, packageDb.getPathOwners, pathTargets)
+    bench("libdir file owner" + suffix, packageDb.getPathOwners, libTargets)
+
+run('')
+
+for index in ['dependancies_dependancy', 'bindirs_dir', 'libdirs_dir',
+              'binaries_binary']:
+    packageDb.cursor.execute('drop index %s;' % index)
+
+depTargets = depTargets[:lookups // 50]
+pathTargets = pathTargets[:lookups // 50]
+libTargets = libTargets[:lookups // 50]
+run(' (no index)')
@@ -0,0 +1,132 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Path ownership lookups through the path index against the database,
+# with a few hundred thousand registered paths, and the cost of keeping
+# the index up to date.
+import os
+import random
+import sys
+import tempfile
+import time
+
+import config
+import core
+import db
+import pathindex
+import version as v
+
+packageCount = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+lookups = 2000
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('bench', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+
+manager = core.Manager(conf)
+packageDb = manager.db
+
+prefix = '/home/build/.local/share/lpm/packages'
+packages = [db.SPackage('pkg%d' % i, v.Version('1.%d' % (i % 10)))
+            for i in range(packageCount)]
+
+start = time.perf_counter()
+pathCount = 0
+with packageDb.transaction():
+    for i, package in enumerate(packages):
+        instDir = '%s/pkg%d/dn_1_%d' % (prefix, i, i % 10)
+        packageDb.createPackage(package)
+        packageDb.addPackageBindirs(package, [instDir + '/bin'])
+        packageDb.addPackageLibdirs(package, [instDir + '/lib'])
+        packageDb.addPackageBinaries(package, ['%s/bin/tool%d' % (instDir, j)
+                                               for j in range(8)])
+        pathCount += 10
+print("registered %d paths in %.2fs" % (pathCount,
+                                        time.perf_counter() - start))
+
+start = time.perf_counter()
+manager.rebuildPathIndex()
+indexFile = manager.pathIndexFile()
+print("built index in %.2fs, %d bytes (%.1f per path)" %
+      (time.perf_counter() - start, os.path.getsize(indexFile),
+       os.path.getsize(indexFile) / pathCount))
+
+random.seed(0)
+queries = []
+for i in range(lookups):
+    n = random.randrange(packageCount)
+    queries.append(random.choice([
+        '%s/pkg%d/dn_1_%d/bin/tool%d' % (prefix, n, n % 10, n % 8),
+        '%s/pkg%d/dn_1_%d/lib/sub/libx.so' % (prefix, n, n % 10),
+        '/usr/bin/unowned%d' % n]))
+
+def bench(label, fn):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    elapsed = time.perf_counter() - start
+    print("%-28s %8.1f us/lookup" % (label, elapsed / lookups * 1e6))
+
+index = pathindex.PathIndex(indexFile)
+bench("path index", index.owners)
+bench("database", packageDb.getPathOwners)
+index.close()
+
+start = time.perf_counter()
+index = pathindex.PathIndex(indexFile)
+index.owners(queries[0])
+index.close()
+print("index open + first lookup    %8.1f us" %
+      ((time.perf_counter() - start) * 1e6))
+
+start = time.perf_counter()
+db.getDb(conf).getPathOwners(queries[0])
+print("database open + first lookup %8.1f us" %
+      ((time.perf_counter() - start) * 1e6))
+
+extra = db.SPackage('extra', v.Version('1.0'))
+packageDb.createPackage(extra)
+start = time.perf_counter()
+for i in range(100):
+    packageDb.addPackageBinary(extra, '/opt/extra/bin/tool%d' % i)
+elapsed = time.perf_counter() - start
+print("register one binary          %8.2f ms (index kept up to date)" %
+      (elapsed / 100 * 1e3))
+
+start = time.perf_counter()
+manager.rebuildPathIndex()
+print("full rebuild                 %8.2f ms" %
+      ((time.perf_counter() - start) * 1e3))
@@ -0,0 +1,87 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Rescanning an installed package of 100000 files by default: with
+# nothing changed, which only takes a stat per file, and with a few
+# files touched or edited, which get hashed.
+import os
+import sys
+import tempfile
+import time
+
+import config
+import core
+import version as v
+
+fileCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+filesPerDir = 500
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('bench', {
+    'locations': {'dataDir': tmpDir.name,
+                  'packageDir': tmpDir.name + '/packages',
+                  'binDir': tmpDir.name + '/bin'},
+    'install': {'permissions': 0o755},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db'},
+})])
+
+manager = core.Manager(conf)
+package = manager.createPackage('big', v.Version('1.0'))
+package.initialize()
+root = str(package.instDir)
+for i in range(fileCount):
+    dirPath = '%s/share/d%d' % (root, i // filesPerDir)
+    if i % filesPerDir == 0:
+        os.makedirs(dirPath)
+    with open('%s/f%d' % (dirPath, i), 'w') as f:
+        f.write('file %d\n' % i)
+
+start = time.perf_counter()
+package.scan()
+print("%d files, registering:      %8.3f s" %
+      (fileCount, time.perf_counter() - start))
+
+def timeRescan(label):
+    times = []
+    for run in range(3):
+        start = time.perf_counter()
+        changes = package.rescan()
+        times.append(time.perf_counter() - start)
+    print("%-30s %8.3f s, %d changes" % (label, min(times), len(changes)))
+
+timeRescan("rescan, unchanged:")
+
+for i in range(0, fileCount, fileCount // 100):
+    path = '%s/share/d%d/f%d' % (root, i // filesPerDir, i)
+    with open(path, 'a') as f:
+        f.write('edited\n')
+start = time.perf_counter()
+changes = package.rescan()
+print("%-30s %8.3f s, %d changes" % ("rescan, 100 edited:",
+                                     time.perf_counter() - start,
+                                     len(changes)))
+timeRescan("rescan, unchanged again:")
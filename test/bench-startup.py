@@ -0,0 +1,83 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Config loading at startup: cold (nothing cached), with only the parser
+# tables cached, and warm (merged config cached). Every run is a fresh
+# interpreter, like a real invocation of lpm.
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+tmpDir = tempfile.TemporaryDirectory()
+cacheDir = tmpDir.name + '/cache'
+srcDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+program = '''
+import sys, time
+import config
+start = time.perf_counter()
+config.load(sys.argv[1], sys.argv[2])
+print(time.perf_counter() - start, 'ply.yacc' in sys.modules)
+'''
+
+def loadOnce():
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', program, 'test.conf',
+                          cacheDir],
+                         env=dict(os.environ, PYTHONPATH=srcDir),
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True, check=True).stdout.split()
+    return time.perf_counter() - start, float(out[0]), out[1] == 'True'
+
+def bench(label, prepare):
+    total = 0
+    load = 0
+    for i in range(runs):
+        prepare()
+        runTotal, runLoad, usedPly = loadOnce()
+        total += runTotal
+        load += runLoad
+    print("%-14s %7.1f ms/run %7.1f ms in config.load  ply %s" %
+          (label, total / runs * 1e3, load / runs * 1e3,
+           'used' if usedPly else 'not imported'))
+
+def clearAll():
+    shutil.rmtree(cacheDir, ignore_errors=True)
+
+def clearConfig():
+    try:
+        os.unlink(cacheDir + '/config.marshal')
+    except FileNotFoundError:
+        pass
+
+bench('cold', clearAll)
+bench('tables cached', clearConfig)
+bench('warm', lambda: None)
@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+# Time to copy a synthetic tree of many small files, 50000 by default,
+# with shutil.copytree against treecopy, by one thread and by a pool.
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import treecopy
+
+fileCount = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+filesPerDir = 100
+
+tmpDir = tempfile.TemporaryDirectory(dir=os.environ.get('BENCH_DIR'))
+src = tmpDir.name + '/src'
+
+# Mostly small files, with one in a hundred at 256k.
+for i in range(fileCount):
+    dirPath = '%s/d%d/e%d' % (src, i // (filesPerDir * 10),
+                              i // filesPerDir % 10)
+    if i % filesPerDir == 0:
+        os.makedirs(dirPath)
+    size = 262144 if i % 100 == 99 else 512 + i % 4096
+    with open('%s/f%d' % (dirPath, i), 'wb') as f:
+        f.write(os.urandom(size))
+    if i % 1000 == 0:
+        os.symlink('f%d' % i, '%s/l%d' % (dirPath, i))
+
+def timeCopy(label, copy):
+    times = []
+    for run in range(3):
+        dst = '%s/dst-%s' % (tmpDir.name, run)
+        start = time.perf_counter()
+        copy(src, dst)
+        times.append(time.perf_counter() - start)
+        shutil.rmtree(dst)
+    print("%-28s %8.2f s" % (label, min(times)))
+
+print("%d files" % fileCount)
+timeCopy("shutil.copytree", lambda src, dst:
+         shutil.copytree(src, dst, symlinks=True))
+timeCopy("treecopy, 1 thread", lambda src, dst:
+         treecopy.copyTree(src, dst, jobs=1))
+timeCopy("treecopy, 4 threads", lambda src, dst:
+         treecopy.copyTree(src, dst, jobs=4))
+print("methods given up on: %s" %
+      (', '.join(sorted(set(f[0] for f in treecopy._failed))) or 'none'))
@@ -0,0 +1,79 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+# Version parse throughput, per scheme, with and without the parse
+# cache. Parsing itself is timed both ways Version can dispatch: trying
+# each handler's pattern in turn, the default for few handlers, and
+# through the combined pattern used for many.
+import time
+
+import version as v
+
+count = 100000
+
+samples = {
+    'dotted': ['%d.%d.%d-r%d' % (i % 7, i % 13, i, i % 5 + 1) for i in range(count)],
+    'semver': ['%d.%d.%d-rc.%d+b%d' % (i % 7, i % 13, i, i % 5, i) for i in range(count)],
+    'calver': ['20%02d-%02d-%02d.%d' % (i % 100, i % 12 + 1, i % 28 + 1, i)
+               for i in range(count)],
+}
+
+# The best of a few runs, which is the least disturbed by whatever else
+# the machine is doing.
+def bench(label, fn, strings, runs=3):
+    elapsed = None
+    for i in range(runs):
+        start = time.perf_counter()
+        for s in strings:
+            fn(s)
+        took = time.perf_counter() - start
+        if elapsed is None or took < elapsed:
+            elapsed = took
+    print("%-24s %10.0f parses/s" % (label, len(strings) / elapsed))
+
+# Time _parse with Version trying up to threshold handlers in turn.
+def dispatch(label, threshold, strings):
+    sequentialHandlers = v.Version.sequentialHandlers
+    v.Version.sequentialHandlers = threshold
+    v.Version._dispatch = None
+    try:
+        bench(label, v.Version._parse, strings)
+    finally:
+        v.Version.sequentialHandlers = sequentialHandlers
+        v.Version._dispatch = None
+
+for scheme, strings in samples.items():
+    v.Version.parseCacheSize = 0
+    v.Version.clearCache()
+    bench(scheme + ' uncached', v.Version, strings)
+    dispatch(scheme + ' sequential only',
+             len(list(v.Version.versionHandlers)), strings)
+    dispatch(scheme + ' combined only', 0, strings)
+
+    v.Version.parseCacheSize = 4096
+    v.Version.clearCache()
+    hot = strings[:1000] * (count // 1000)
+    bench(scheme + ' cached', v.Version, hot)
+    print("%-24s %s" % ('', v.Version.cacheInfo()))
@@ -0,0 +1,189 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import activation
+import config
+import core
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+# Laid out the way the default config would, so that the lpm script can
+# find the packages with just XDG_DATA_HOME pointing here.
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name + '/lpm',
+        'packageDir': tmpDir.name + '/lpm/packages',
+        'binDir': tmpDir.name + '/lpm/bin',
+    },
+    'install': {
+        'permissions': 0o755,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/lpm/packages.db',
+    },
+})])
+
+os.makedirs(conf.locations.dataDir)
+manager = core.Manager(conf)
+
+# The database is only opened once something needs it.
+assert not os.path.exists(conf.packageDb.dbFile)
+
+def install(name, vers):
+    package = manager.createPackage(name, v.Version(vers))
+    package.initialize()
+    (package.instDir / 'bin').mkdir()
+    return package
+
+def readEnv(package, environ):
+    return activation.activate(activation.readActivation(package.instDir),
+                               environ)
+
+base = install('base', '1.0')
+base.getRunEnv().addVariable('PATH', ['/base/bin'], 'prepend')
+base.getRunEnv().addVariable('MANPATH', ['/base/man'], 'append')
+manager.finishInstall(base)
+
+tool = install('tool', '2.0')
+tool.addDep(base)
+tool.getRunEnv().addVariable('PATH', ['/tool/bin'], 'prepend')
+tool.getRunEnv().addVariable('TOOL_HOME', ['/tool'], 'overwrite')
+manager.finishInstall(tool)
+
+# Activation files reflect the composite environment, and extend
+# whatever the caller already has.
+env = readEnv(tool, {'PATH': '/usr/bin', 'TOOL_HOME': '/elsewhere'})
+assert env['PATH'] == '/tool/bin:/base/bin:/usr/bin'
+assert env['MANPATH'] == '/base/man'
+assert env['TOOL_HOME'] == '/tool'
+env = readEnv(tool, {'MANPATH': '/usr/man'})
+assert env['PATH'] == '/tool/bin:/base/bin'
+assert env['MANPATH'] == '/usr/man:/base/man'
+
+# The shell form agrees with the machine readable one.
+script = tool.instDir / activation.artifactDir / activation.scriptName
+# sh makes up a PATH if there is none, so use an empty one instead.
+for environ in ({'PATH': '/usr/bin', 'MANPATH': '/usr/man'}, {'PATH': ''}):
+    out = subprocess.run(['/bin/sh', '-c',
+                          '. "$0"; printf "%s\\n%s\\n%s" '
+                          '"$PATH" "$MANPATH" "$TOOL_HOME"', str(script)],
+                         env=environ, stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True).stdout
+    env = readEnv(tool, environ)
+    assert out.split('\n') == [env['PATH'], env['MANPATH'], env['TOOL_HOME']]
+
+# Changing a dependancy's environment regenerates its dependants.
+base.getRunEnv().addVariable('BASE_OPTS', ['-x'])
+assert readEnv(tool, {})['BASE_OPTS'] == '-x'
+assert readEnv(base, {})['BASE_OPTS'] == '-x'
+base.getRunEnv().removeVariable('BASE_OPTS')
+assert 'BASE_OPTS' not in readEnv(tool, {})
+
+lib = install('lib', '1.0')
+lib.getRunEnv().addVariable('LD_LIBRARY_PATH', ['/lib/lib'])
+manager.finishInstall(lib)
+base.addDep(lib)
+assert readEnv(tool, {})['LD_LIBRARY_PATH'] == '/lib/lib'
+base.removeDep(lib)
+assert 'LD_LIBRARY_PATH' not in readEnv(tool, {})
+
+# Packages that are not installed yet get no activation files.
+pending = install('pending', '1.0')
+pending.addDep(base)
+base.getRunEnv().addValue('PATH', '/base/sbin')
+assert not (pending.instDir / activation.artifactDir).exists()
+assert readEnv(tool, {})['PATH'] == '/tool/bin:/base/sbin:/base/bin'
+
+# A failed transaction does not regenerate anything.
+try:
+    with manager.db.transaction():
+        base.getRunEnv().addVariable('BROKEN', ['1'])
+        raise RuntimeError
+except RuntimeError:
+    pass
+assert 'BROKEN' not in readEnv(tool, {})
+
+# current follows the newest installed version.
+nameDir = Path(conf.locations.packageDir) / 'tool'
+assert os.readlink(str(nameDir / 'current')) == tool.instDir.name
+tool3 = install('tool', '3.0')
+assert os.readlink(str(nameDir / 'current')) == tool.instDir.name
+manager.finishInstall(tool3)
+assert os.readlink(str(nameDir / 'current')) == tool3.instDir.name
+manager.removePackage(tool3)
+assert os.readlink(str(nameDir / 'current')) == tool.instDir.name
+
+# Several writers at once each use temporary names of their own.
+scratch = Path(tmpDir.name) / 'scratch'
+scratch.mkdir()
+errors = []
+def writer(n):
+    try:
+        for i in range(50):
+            activation._writeFile(str(scratch / 'file'),
+                                  ('%d\n' % n).encode() * 1000)
+            activation.setCurrent(str(scratch), 'v%d' % n)
+    except Exception as e:
+        errors.append(e)
+threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+assert errors == []
+data = (scratch / 'file').read_bytes()
+assert data == data[:2] * 1000
+assert os.readlink(str(scratch / 'current')) in ['v%d' % n for n in range(8)]
+assert sorted(os.listdir(str(scratch))) == ['current', 'file']
+
+# The lpm script runs commands from the activation files alone.
+lpm = Path(__file__).resolve().parent.parent / 'src' / 'lpm'
+environ = {'XDG_DATA_HOME': tmpDir.name,
+           'XDG_CONFIG_HOME': tmpDir.name + '/config',
+           'HOME': tmpDir.name,
+           'PATH': os.environ['PATH']}
+os.rename(conf.packageDb.dbFile, conf.packageDb.dbFile + '.hidden')
+out = subprocess.run([sys.executable, str(lpm), 'run', 'tool',
+                      'sh', '-c', 'echo "$TOOL_HOME $PATH"'],
+                     env=environ, stdout=subprocess.PIPE,
+                     universal_newlines=True, check=True).stdout
+assert out == '/tool /tool/bin:/base/sbin:/base/bin:%s\n' % os.environ['PATH']
+out = subprocess.run([sys.executable, str(lpm), 'env', '-v', '1.0', 'base'],
+                     env=environ, stdout=subprocess.PIPE,
+                     universal_newlines=True, check=True).stdout
+assert out == (base.instDir / activation.artifactDir /
+               activation.scriptName).read_text()
+assert not Path(conf.packageDb.dbFile).exists()
+
+print("All activation tests passed")
@@ -0,0 +1,202 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+import aio
+import config
+import db
+import verify
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {'permissions': 0o755},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db',
+                  'timeout': 5},
+})])
+
+def spackage(name):
+    return db.SPackage(name, v.Version('1.0'))
+
+# Counts how often the event loop gets to run while something else is
+# going on.
+async def ticker(ticks, stop):
+    while not stop.is_set():
+        ticks.append(time.monotonic())
+        await asyncio.sleep(0.01)
+
+async def main():
+    async with aio.AsyncManager(conf, jobs=4) as manager:
+        # Blocking work happens off the event loop.
+        ticks = []
+        stop = asyncio.Event()
+        tick = asyncio.ensure_future(ticker(ticks, stop))
+        await manager.run(time.sleep, 0.3)
+        stop.set()
+        await tick
+        assert len(ticks) > 10, ticks
+
+        tool = await manager.createPackage('tool', v.Version('1.0'))
+        assert tool.name == 'tool'
+        assert await manager.db.getPackageStatus(tool.spackage) == \
+            'uninitialized'
+        assert (await manager.getPackage('tool', v.Version('1.0'))).spackage \
+            == tool.spackage
+        assert await manager.getPackage('none', v.Version('1.0')) is None
+
+        # Reads from many threads at once.
+        statuses = await asyncio.gather(*[
+            manager.db.getPackageStatus(tool.spackage) for i in range(50)])
+        assert statuses == ['uninitialized'] * 50
+
+        # Transactions commit, and roll back on errors.
+        async with manager.transaction() as transaction:
+            for i in range(600):
+                await transaction.db.createPackage(spackage('pkg%03d' % i))
+            await transaction.db.addPackageDep(spackage('pkg001'),
+                                               spackage('pkg000'))
+        assert await manager.db.packageExists(spackage('pkg599'))
+
+        try:
+            async with manager.db.transaction() as transaction:
+                await transaction.db.createPackage(spackage('failed'))
+                raise RuntimeError('stop')
+        except RuntimeError:
+            pass
+        assert not await manager.db.packageExists(spackage('failed'))
+
+        # Cancelled transactions roll back, once what they were running
+        # is done.
+        started = asyncio.Event()
+        async def cancelled():
+            async with manager.transaction() as transaction:
+                await transaction.db.createPackage(spackage('cancelled'))
+                started.set()
+                await transaction.run(time.sleep, 0.2)
+                await transaction.db.createPackage(spackage('never'))
+        task = asyncio.ensure_future(cancelled())
+        await started.wait()
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+            assert False, 'not cancelled'
+        except asyncio.CancelledError:
+            pass
+        async with manager.transaction() as transaction:
+            await transaction.db.createPackage(spackage('after'))
+        assert not await manager.db.packageExists(spackage('cancelled'))
+        assert not await manager.db.packageExists(spackage('never'))
+        assert await manager.db.packageExists(spackage('after'))
+
+        # Also while waiting for another transaction to finish.
+        holding = asyncio.Event()
+        release = asyncio.Event()
+        async def holder():
+            async with manager.transaction() as transaction:
+                await transaction.db.createPackage(spackage('held'))
+                holding.set()
+                await release.wait()
+        async def waiter():
+            async with manager.transaction() as transaction:
+                await transaction.db.createPackage(spackage('waited'))
+        holderTask = asyncio.ensure_future(holder())
+        await holding.wait()
+        waiterTask = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0.1)
+        waiterTask.cancel()
+        try:
+            await waiterTask
+            assert False, 'not cancelled'
+        except asyncio.CancelledError:
+            pass
+        release.set()
+        await holderTask
+        async with manager.transaction() as transaction:
+            await transaction.db.createPackage(spackage('last'))
+        assert await manager.db.packageExists(spackage('held'))
+        assert not await manager.db.packageExists(spackage('waited'))
+        assert await manager.db.packageExists(spackage('last'))
+
+        # Listings come a chunk at a time, loaded.
+        names = []
+        async for package in manager.iterPackages(chunkSize=100):
+            assert package.depCache is not None
+            names.append(package.name)
+        assert len(names) == 604 and names == sorted(names)
+        deps = [package async for package in manager.iterPackages()
+                if package.name == 'pkg001'][0].getDeps()
+        assert [dep.name for dep in deps] == ['pkg000']
+        installed = await manager.listPackages('installed')
+        assert installed == []
+
+        # Files, and iterators stopped early.
+        await manager.run(tool.initialize)
+        for i in range(20):
+            with open('%s/f%d' % (tool.instDir, i), 'w') as f:
+                f.write('%d\n' % i)
+        os.makedirs(str(tool.instDir / 'bin'))
+        with open(str(tool.instDir / 'bin' / 'tool'), 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(str(tool.instDir / 'bin' / 'tool'), 0o755)
+        await manager.run(tool.scan)
+        await manager.finishInstall(tool)
+        paths = [path async for path in manager.iterPaths()]
+        assert [(kind, str(path.name)) for path, kind, owner in paths] == \
+            [('binary', 'tool'), ('bindir', 'bin')], paths
+
+        assert await manager.rescanPackages([tool], hash=True) == \
+            {tool: []}
+        results = manager.verifyPackages([tool], jobs=2, chunkSize=5)
+        async for package, path, state, detail in results:
+            assert state == verify.OK
+            break
+        await results.aclose()
+        states = [state async for package, path, state, detail
+                  in manager.verifyPackages()]
+        assert states == [verify.OK] * 21
+        assert list((await manager.rescanPackages()).values()) == [[]]
+        assert await manager.rescanPackages(installed) == {}
+
+    # Everything the manager started is done.
+    assert manager.executor._shutdown
+    assert not [thread for thread in threading.enumerate()
+                if thread.name.startswith('lpm')]
+
+asyncio.run(main())
+
+print("All asyncio tests passed")
@@ -0,0 +1,211 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import config
+import db
+import graph
+import version as v
+
+def makeConf(dbFile, timeout=30):
+    return config.resolve([('test', {
+        'locations': {'dataDir': str(Path(dbFile).parent)},
+        'packageDb': {'type': 'sqlite3', 'dbFile': dbFile,
+                      'timeout': timeout},
+    })])
+
+# Registers a chain of packages called <prefix>-<n>, each depending on
+# the one before it and with all of its rows added in one transaction.
+def writePackages(packageDb, prefix, count):
+    previous = None
+    for n in range(count):
+        package = db.SPackage('%s-%d' % (prefix, n), v.Version('1.0'))
+        with packageDb.transaction():
+            packageDb.createPackage(package)
+            packageDb.addPackageBinaries(package, [
+                Path('/opt/%s/%d/bin/b%d' % (prefix, n, i)) for i in range(3)])
+            packageDb.addPackageEnvs(package, [
+                ('PATH', '/opt/%s/%d/bin' % (prefix, n), 'prepend', ':')],
+                                     build=False)
+            if previous is not None:
+                packageDb.addPackageDeps(package, [previous])
+            packageDb.setPackageStatus(package, 'installed')
+        previous = package
+
+# The invariants a reader must see however the writes interleave: a
+# package is never seen half registered, and its environment covers
+# the whole chain below it.
+def checkPackages(packageDb, prefix):
+    errors = []
+    n = 0
+    while True:
+        package = db.SPackage('%s-%d' % (prefix, n), v.Version('1.0'))
+        if packageDb.getPackageStatus(package) is None:
+            return errors
+        if len(packageDb.getPackageBinaries(package)) != 3:
+            errors.append('%s has partial binaries' % package)
+        path = packageDb.getCompositeEnv(package).get('PATH', '')
+        if len(path.split(':')) != n + 1:
+            errors.append('%s has PATH %r' % (package, path))
+        n += 1
+
+# Run as "test-concurrency.py worker <db file> <prefix> <count>" this
+# is one of the competing processes.
+if len(sys.argv) == 5 and sys.argv[1] == 'worker':
+    packageDb = db.getDb(makeConf(sys.argv[2]))
+    writePackages(packageDb, sys.argv[3], int(sys.argv[4]))
+    errors = checkPackages(packageDb, sys.argv[3])
+    print('\n'.join(errors))
+    sys.exit(1 if errors else 0)
+
+tmpDir = tempfile.TemporaryDirectory()
+dbFile = tmpDir.name + '/packages.db'
+packageDb = db.getDb(makeConf(dbFile))
+
+check = sqlite3.connect(dbFile)
+assert check.execute('pragma journal_mode;').fetchone()[0] == 'wal'
+
+# Threads sharing one database object, writers and readers running
+# at once.
+writers = 4
+readers = 4
+perWriter = 25
+done = threading.Event()
+errors = []
+
+def writer(i):
+    try:
+        writePackages(packageDb, 'thread%d' % i, perWriter)
+    except Exception as e:
+        errors.append('writer %d: %r' % (i, e))
+
+def reader():
+    reads = 0
+    try:
+        while not done.is_set() or reads == 0:
+            for i in range(writers):
+                errors.extend(checkPackages(packageDb, 'thread%d' % i))
+            # The packages and edges have to come from the same state.
+            graph.DependencyGraph.load(packageDb)
+            reads += 1
+    except Exception as e:
+        errors.append('reader: %r' % e)
+
+writerThreads = [threading.Thread(target=writer, args=(i,))
+                 for i in range(writers)]
+readerThreads = [threading.Thread(target=reader) for i in range(readers)]
+for thread in readerThreads + writerThreads:
+    thread.start()
+for thread in writerThreads:
+    thread.join()
+done.set()
+for thread in readerThreads:
+    thread.join()
+
+assert not errors, errors
+for i in range(writers):
+    assert checkPackages(packageDb, 'thread%d' % i) == []
+    package = db.SPackage('thread%d-%d' % (i, perWriter - 1), v.Version('1.0'))
+    assert len(packageDb.getTransitiveDeps(package)) == perWriter - 1
+
+# Separate processes writing to and reading from the same file, with
+# this one reading along.
+processes = [subprocess.Popen([sys.executable, __file__, 'worker', dbFile,
+                               'process%d' % i, '20'],
+                              stdout=subprocess.PIPE, text=True)
+             for i in range(4)]
+while any(process.poll() is None for process in processes):
+    for i in range(len(processes)):
+        assert checkPackages(packageDb, 'process%d' % i) == []
+for process in processes:
+    output = process.stdout.read()
+    process.stdout.close()
+    assert process.returncode == 0, output
+
+for i in range(len(processes)):
+    assert checkPackages(packageDb, 'process%d' % i) == []
+assert len(packageDb.getInstalledBinaries()) == 3 * (writers * perWriter + 80)
+assert packageDb.checkClosure() == []
+
+# A writer in another process makes transactions wait for it, reads
+# go on meanwhile.
+lock = sqlite3.connect(dbFile, isolation_level=None,
+                       check_same_thread=False)
+lock.execute('begin immediate;')
+started = time.monotonic()
+threading.Timer(0.3, lambda: lock.execute('commit;')).start()
+foo = db.SPackage('foo', v.Version('1'))
+assert packageDb.getPackageStatus(foo) is None
+packageDb.createPackage(foo)
+assert time.monotonic() - started >= 0.25
+assert packageDb.getPackageStatus(foo) == 'uninitialized'
+
+# ... but not for longer than the timeout.
+shortDb = db.getDb(makeConf(dbFile, timeout=0.2))
+lock.execute('begin immediate;')
+started = time.monotonic()
+try:
+    shortDb.createPackage(db.SPackage('bar', v.Version('1')))
+    assert False, 'transaction did not time out'
+except sqlite3.OperationalError as e:
+    assert db.sqlite3IsBusy(e)
+assert time.monotonic() - started < 5
+lock.execute('rollback;')
+shortDb.createPackage(db.SPackage('bar', v.Version('1')))
+shortDb.close()
+
+# sqlite3Retry backs off on busy errors only.
+attempts = []
+def flaky():
+    attempts.append(time.monotonic())
+    if len(attempts) < 4:
+        raise sqlite3.OperationalError('database is locked')
+    return 'done'
+assert db.sqlite3Retry(flaky, 5) == 'done'
+assert len(attempts) == 4
+assert attempts[3] - attempts[2] > attempts[1] - attempts[0]
+
+def broken():
+    attempts.append(None)
+    raise sqlite3.OperationalError('no such table: nothing')
+attempts = []
+try:
+    db.sqlite3Retry(broken, 5)
+    assert False, 'non busy error was retried'
+except sqlite3.OperationalError:
+    pass
+assert len(attempts) == 1
+
+packageDb.close()
+
+print("All concurrency tests passed")
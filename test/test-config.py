@@ -0,0 +1,145 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import os
+import tempfile
+
+import config
+
+tmpDir = tempfile.TemporaryDirectory()
+cacheDir = tmpDir.name + '/cache'
+confFile = tmpDir.name + '/lpm.conf'
+systemFile = tmpDir.name + '/system.conf'
+
+def load(environ={}):
+    return config.load(confFile, cacheDir, systemFile, environ)
+
+defaultDbFile = config.defaultConfig['packageDb']['dbFile']
+
+# Without config files load just resolves the defaults.
+conf = load()
+assert conf.packageDb.dbFile == defaultDbFile
+assert config.source(conf, 'packageDb.dbFile') == 'defaults'
+assert not os.path.exists(cacheDir)
+
+# Resolved configurations are read only.
+try:
+    conf.packageDb.dbFile = '/elsewhere'
+except config.FrozenException:
+    pass
+else:
+    assert False
+try:
+    conf.packageDb.newKey = 1
+except AttributeError:
+    pass
+else:
+    assert False
+assert config.defaultConfig['packageDb']['dbFile'] == defaultDbFile
+
+with open(systemFile, 'w') as f:
+    f.write('packageDb { dbFile "/var/lpm.db"; type "sqlite3" }\n'
+            'extra = [1, 2]\n')
+with open(confFile, 'w') as f:
+    f.write('packageDb { dbFile "/tmp/lpm.db" }\n"odd-key" 3\n')
+
+# Sections are merged key by key, later layers winning, and every key
+# remembers where it came from.
+conf = load()
+assert conf.packageDb.dbFile == '/tmp/lpm.db'
+assert config.source(conf, 'packageDb.dbFile') == confFile
+assert conf.packageDb.type == 'sqlite3'
+assert config.source(conf, 'packageDb.type') == systemFile
+assert conf.install.permissions == 0o755
+assert config.source(conf, 'install.permissions') == 'defaults'
+assert conf.extra == [1, 2]
+assert conf['odd-key'] == 3
+assert 'odd-key' in conf and 'missing' not in conf
+assert set(conf) == {'locations', 'install', 'packageDb', 'verify',
+                     'extra', 'odd-key'}
+assert config.asDict(conf)['packageDb'] == {'type': 'sqlite3',
+                                            'dbFile': '/tmp/lpm.db',
+                                            'timeout': 30,
+                                            'cacheSize': 4096}
+assert os.path.exists(cacheDir + '/config.marshal')
+assert os.path.exists(cacheDir + '/parsetab.pickle')
+
+# LPM_* variables override keys they name, in any case, and are
+# converted to the type of the value they replace.
+conf = load({'LPM_PACKAGEDB_DBFILE': '/env.db',
+             'LPM_INSTALL_PERMISSIONS': '0o700',
+             'LPM_NO_SUCH_KEY': 'x',
+             'LPM_INSTALL': 'not a section',
+             'HOME': '/'})
+assert conf.packageDb.dbFile == '/env.db'
+assert config.source(conf, 'packageDb.dbFile') == 'LPM_PACKAGEDB_DBFILE'
+assert conf.install.permissions == 0o700
+assert conf.packageDb.type == 'sqlite3'
+assert isinstance(conf.install, config.Section)
+
+# Layers are shared, not copied.
+shared = ['a']
+conf = config.resolve([('one', {'list': shared, 'section': {'a': 1}}),
+                       ('two', {'section': {'b': 2}})])
+assert conf.list is shared
+assert (conf.section.a, conf.section.b) == (1, 2)
+conf = config.resolve([('one', {'section': {'a': 1}}),
+                       ('two', {'section': 'replaced'}),
+                       ('three', {'section': {'b': 2}})])
+assert 'a' not in conf.section and conf.section.b == 2
+
+# Unchanged files come from the cache without touching the parser.
+realParser = config.ConfigFileParser
+class NoParser:
+    def __init__(self, cacheDir=None):
+        raise AssertionError('config file parsed again')
+config.ConfigFileParser = NoParser
+conf = load()
+assert conf.packageDb.dbFile == '/tmp/lpm.db'
+assert config.source(conf, 'packageDb.type') == systemFile
+config.ConfigFileParser = realParser
+
+# Any change to a file is picked up, even one keeping the mtime.
+st = os.stat(confFile)
+with open(confFile, 'w') as f:
+    f.write('packageDb { dbFile "/tmp/other.db" }\n')
+os.utime(confFile, ns=(st.st_atime_ns, st.st_mtime_ns))
+assert load().packageDb.dbFile == '/tmp/other.db'
+os.unlink(confFile)
+assert load().packageDb.dbFile == '/var/lpm.db'
+
+# Parser tables are reused rather than rebuilt.
+tablesMtime = os.stat(cacheDir + '/parsetab.pickle').st_mtime_ns
+parser = config.ConfigFileParser(cacheDir)
+assert parser.parseFile(systemFile)['packageDb']['dbFile'] == '/var/lpm.db'
+assert os.stat(cacheDir + '/parsetab.pickle').st_mtime_ns == tablesMtime
+
+# A damaged cache is just a miss.
+with open(cacheDir + '/config.marshal', 'wb') as f:
+    f.write(b'garbage')
+assert load().packageDb.dbFile == '/var/lpm.db'
+
+print("All config tests passed")
@@ -0,0 +1,294 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+import os
+import tempfile
+from pathlib import Path
+
+import config
+import db
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+
+packageDb = db.getDb(conf)
+
+foo = db.SPackage('foo', v.Version('1.2.3'))
+bar = db.SPackage('bar', v.Version('0.1'))
+
+# Batched writes land in a single commit.
+with packageDb.transaction():
+    packageDb.createPackage(foo)
+    packageDb.createPackage(bar)
+    packageDb.addPackageBinaries(foo, (Path('/opt/foo/bin/foo%d' % i)
+                                       for i in range(1000)))
+    packageDb.addPackageBindirs(foo, [Path('/opt/foo/bin')])
+    packageDb.addPackageLibdirs(foo, [Path('/opt/foo/lib')])
+    packageDb.addPackageEnvs(foo, [('PATH', '/opt/foo/bin', 'prepend', ':')],
+                             build=False)
+    packageDb.addPackageDeps(foo, [bar])
+
+assert len(packageDb.getPackageBinaries(foo)) == 1000
+assert packageDb.getPackageBindirs(foo)[0][0] == Path('/opt/foo/bin')
+assert packageDb.getPackageDeps(foo)[0][0].name == 'bar'
+assert packageDb.getPackageEnv(foo)[0]['mode'] == 'prepend'
+
+# Reverse lookups.
+assert packageDb.getPackageDependants(bar)[0][0].name == 'foo'
+assert packageDb.getPackageDependants(foo) == []
+owners = packageDb.getPathOwners('/opt/foo/bin/foo7')
+assert sorted(row['kind'] for row in owners) == ['binary', 'bindir']
+assert owners[0]['package'].name == 'foo'
+owners = packageDb.getPathOwners('/opt/foo/lib/python/site.py')
+assert [row['kind'] for row in owners] == ['libdir']
+assert owners[0]['path'] == Path('/opt/foo/lib')
+assert packageDb.getPathOwners('/opt/bar/bin/bar') == []
+
+# Versions are ordered by sqlite.
+with packageDb.transaction():
+    for s in ['0.2', '0.10', '0.9-r1', '0.9']:
+        packageDb.createPackage(db.SPackage('bar', v.Version(s)))
+    packageDb.setPackageStatus(db.SPackage('bar', v.Version('0.10')),
+                               'installed')
+
+assert str(packageDb.getNewestVersion('bar').version) == '0.10'
+assert str(packageDb.getNewestVersion('bar', 'uninitialized').version) == '0.9-r1'
+assert packageDb.getNewestVersion('baz') is None
+rows = packageDb.getPackageVersions('bar', v.Version('0.2'), v.Version('0.10'))
+assert [str(row[0].version) for row in rows] == ['0.2', '0.9', '0.9-r1']
+
+# Composite environments merge the whole dependancy closure.
+base = db.SPackage('envbase', v.Version('1'))
+mid = db.SPackage('envmid', v.Version('1'))
+top = db.SPackage('envtop', v.Version('1'))
+with packageDb.transaction():
+    for pkg in [base, mid, top]:
+        packageDb.createPackage(pkg)
+    packageDb.addPackageEnvs(base, [('PATH', '/base/bin', 'prepend', ':'),
+                                    ('CC', 'gcc', 'overwrite', None),
+                                    ('FLAGS', '-O2', 'append', ' ')], False)
+    packageDb.addPackageEnvs(mid, [('PATH', '/mid/bin', 'prepend', ':'),
+                                   ('FLAGS', '-g', 'append', ' ')], False)
+    packageDb.addPackageEnvs(top, [('PATH', '/top/bin', 'prepend', ':'),
+                                   ('CC', 'clang', 'overwrite', None)], False)
+    packageDb.addPackageDeps(top, [mid, base])
+    packageDb.addPackageDeps(mid, [base])
+
+assert packageDb.getCompositeEnv(top) == {
+    'PATH': '/top/bin:/mid/bin:/base/bin', 'CC': 'clang', 'FLAGS': '-O2 -g'}
+assert packageDb.getCompositeEnv(mid)['PATH'] == '/mid/bin:/base/bin'
+assert packageDb.getCompositeEnv(top, build=True) == {}
+
+# Cached results follow changes to the environments and dependancies.
+packageDb.addPackageEnv(base, 'PATH', '/base/sbin', 'append', ':', False)
+assert packageDb.getCompositeEnv(top)['PATH'] == \
+    '/top/bin:/mid/bin:/base/bin:/base/sbin'
+packageDb.removePackageDep(top, mid)
+assert packageDb.getCompositeEnv(top)['PATH'] == \
+    '/top/bin:/base/bin:/base/sbin'
+packageDb.deletePackage(base)
+assert packageDb.getCompositeEnv(top) == {'PATH': '/top/bin', 'CC': 'clang'}
+
+# A failing block leaves nothing behind.
+try:
+    with packageDb.transaction():
+        packageDb.addPackageBinary(bar, Path('/opt/bar/bin/bar'))
+        packageDb.addPackageBinary(foo, Path('/opt/foo/bin/foo0'))
+except db.sqlite3.IntegrityError:
+    pass
+
+assert packageDb.getPackageBinaries(bar) == []
+
+# A failing inner block only undoes its own work.
+with packageDb.transaction():
+    packageDb.addPackageLibdir(bar, Path('/opt/bar/lib'))
+    try:
+        with packageDb.transaction():
+            packageDb.addPackageBinary(bar, Path('/opt/bar/bin/bar'))
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+
+assert len(packageDb.getPackageLibdirs(bar)) == 1
+assert packageDb.getPackageBinaries(bar) == []
+
+# So does a failing commit, here on a deferred foreign key.
+pathChanges = []
+packageDb.pathListeners.append(pathChanges.append)
+try:
+    with packageDb.transaction():
+        packageDb.addPackageBinary(bar, Path('/opt/bar/bin/bar'))
+        packageDb.cursor.execute('pragma defer_foreign_keys = on;')
+        packageDb.cursor.execute('''
+            insert into dependancies (package_id, dependancy_id)
+            select id, -1 from packages where name = 'bar';''')
+except db.sqlite3.IntegrityError:
+    pass
+else:
+    assert False
+
+assert packageDb.transactionDepth == 0
+assert not packageDb.cursor.connection.in_transaction
+with packageDb.transaction():
+    pass
+assert pathChanges == []
+assert packageDb.getPackageBinaries(bar) == []
+packageDb.pathListeners.remove(pathChanges.append)
+
+# A transaction sqlite rolled back already does not hide the error.
+try:
+    with packageDb.transaction():
+        with packageDb.transaction():
+            packageDb.cursor.execute('rollback;')
+            raise RuntimeError()
+except RuntimeError:
+    pass
+else:
+    assert False
+assert packageDb.transactionDepth == 0
+
+packageDb.deletePackage(foo)
+assert not packageDb.packageExists(foo)
+assert packageDb.getPackageBinaries(foo) == []
+
+# A format 1 database is upgraded in place when opened.
+conf = config.resolve([
+    ('test', config.asDict(conf)),
+    ('v1', {'packageDb': {'dbFile': tmpDir.name + '/v1.db'}}),
+])
+conn = db.sqlite3.connect(conf.packageDb.dbFile)
+conn.executescript(db.sqlite3Script(conf, 'sqlite3V1TablesCreate'))
+conn.executescript('''
+    insert into packages values ('foo;1.2.3', 'installed');
+    insert into run_env values ('foo;1.2.3', 'PATH', '/opt/foo/bin',
+                                'prepend', ':');
+    insert into dependancies values ('foo;1.2.3', 'bar;0.1');
+    insert into binaries values ('foo;1.2.3', '/opt/foo/bin/foo');
+''')
+conn.close()
+
+packageDb = db.getDb(conf)
+packageDb.cursor.execute('select version from format_version;')
+assert packageDb.cursor.fetchone()[0] == db.sqlite3FormatVersion
+assert packageDb.packageExists(foo)
+assert packageDb.packageExists(bar)
+assert packageDb.getPackageVersions('foo')[0]['status'] == 'installed'
+assert packageDb.getPackageVersions('bar')[0]['status'] == 'uninitialized'
+assert packageDb.getPackageDeps(foo)[0][0].name == 'bar'
+assert packageDb.dependsOn(foo, bar)
+assert packageDb.getPackageEnv(foo)[0]['value'] == '/opt/foo/bin'
+assert packageDb.getPackageBinaries(foo)[0][0] == Path('/opt/foo/bin/foo')
+packageDb.setManifestEntries(foo, [('bin/foo', 10, 20, 30, 0o100755, None)])
+assert [tuple(row) for row in packageDb.getManifest(foo)] == \
+    [('bin/foo', 10, 20, 30, 0o100755, None)]
+packageDb.close()
+
+# So is a format 2 one, which had neither the reverse indexes, the
+# version sort keys, the dependancy closure nor the manifest.
+conf = config.resolve([
+    ('test', config.asDict(conf)),
+    ('v2', {'packageDb': {'dbFile': tmpDir.name + '/v2.db'}}),
+])
+conn = db.sqlite3.connect(conf.packageDb.dbFile)
+conn.executescript(db.sqlite3Script(conf, 'sqlite3V2TablesCreate'))
+conn.executescript('''
+    drop table manifest;
+    drop index dependancies_dependancy;
+    drop index bindirs_dir;
+    drop index libdirs_dir;
+    drop index binaries_binary;
+    drop index packages_name_sort_key;
+    alter table packages drop column sort_key;
+    drop table dependancy_closure;
+    update format_version set version = 2;
+    insert into packages (name, version, safe_version, status)
+    values ('foo', '1.10', '1.10', 'installed'),
+           ('foo', '1.2.3', '1.2.3', 'installed'),
+           ('bar', '0.1', '0.1', 'installed'),
+           ('baz', '2', '2', 'installed');
+    insert into dependancies (package_id, dependancy_id)
+    values (2, 3), (3, 4);
+''')
+conn.close()
+
+packageDb = db.getDb(conf)
+packageDb.cursor.execute('select version from format_version;')
+assert packageDb.cursor.fetchone()[0] == db.sqlite3FormatVersion
+assert packageDb.getPackageStatus(foo) == 'installed'
+assert list(packageDb.getManifest(foo)) == []
+assert [row[0] for row in packageDb.getPackageVersions('foo')] == \
+    [foo, db.SPackage('foo', v.Version('1.10'))]
+assert packageDb.getNewestVersion('foo').version == v.Version('1.10')
+baz = db.SPackage('baz', v.Version('2'))
+assert packageDb.dependsOn(foo, baz)
+assert packageDb.checkClosure() == []
+packageDb.cursor.execute('''
+    select name from sqlite_master where type = 'index'
+    and name in ('dependancies_dependancy', 'bindirs_dir', 'libdirs_dir',
+                 'binaries_binary', 'packages_name_sort_key');''')
+assert len(packageDb.cursor.fetchall()) == 5
+
+# The directory of a new database is created, and databases that
+# cannot be opened are reported as such.
+conf = config.resolve([
+    ('test', config.asDict(conf)),
+    ('fresh', {'packageDb': {'dbFile': tmpDir.name + '/new/lpm/fresh.db'}}),
+])
+db.getDb(conf).close()
+assert os.path.isfile(conf.packageDb.dbFile)
+conn = db.sqlite3.connect(conf.packageDb.dbFile)
+conn.execute('update format_version set version = 99;')
+conn.commit()
+conn.close()
+try:
+    db.getDb(conf)
+except db.DatabaseException as e:
+    assert 'not supported' in str(e), e
+else:
+    assert False, 'a newer format was opened'
+
+for dbFile in [tmpDir.name + '/new', tmpDir.name + '/new/lpm/fresh.db/x']:
+    conf = config.resolve([
+        ('test', config.asDict(conf)),
+        ('bad', {'packageDb': {'dbFile': dbFile}}),
+    ])
+    try:
+        db.getDb(conf)
+    except db.DatabaseException as e:
+        assert dbFile in str(e), e
+    else:
+        assert False, '%s was opened' % dbFile
+
+print("All database tests passed")
@@ -0,0 +1,139 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import os
+import subprocess
+import tempfile
+
+import binindex
+import config
+import core
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {
+        'permissions': 0o755,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+binDir = conf.locations.binDir
+indexFile = os.path.join(binDir, binindex.indexName)
+
+# The index on its own.
+binindex.writeIndex(tmpDir.name + '/plain.idx',
+                    [('b%d' % i, '/opt/b%d' % i, '/inst/%d' % i)
+                     for i in range(1000)])
+index = binindex.BinaryIndex(tmpDir.name + '/plain.idx')
+assert len(index) == 1000
+assert index.lookup('b0') == ('/opt/b0', '/inst/0')
+assert index.lookup('b999') == ('/opt/b999', '/inst/999')
+assert index.lookup('b5000') is None
+assert index.lookup('a') is None and index.lookup('c') is None
+assert list(index.names()) == sorted('b%d' % i for i in range(1000))
+index.close()
+binindex.writeIndex(tmpDir.name + '/empty.idx', [])
+assert binindex.BinaryIndex(tmpDir.name + '/empty.idx').lookup('x') is None
+
+manager = core.Manager(conf)
+
+# Installs a package whose binaries print the package's TOOL_HOME and
+# their arguments.
+def install(name, vers, binaries):
+    package = manager.createPackage(name, v.Version(vers))
+    package.initialize()
+    (package.instDir / 'bin').mkdir()
+    for binary in binaries:
+        path = package.instDir / 'bin' / binary
+        path.write_text('#!/bin/sh\necho "%s $TOOL_HOME $*"\n' % binary)
+        path.chmod(0o755)
+    package.getRunEnv().addVariable('TOOL_HOME', [str(package.instDir)],
+                                    'overwrite')
+    package.scan()
+    return package
+
+def run(name, *args):
+    return subprocess.run([os.path.join(binDir, name)] + list(args),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+tool1 = install('tool', '1.0', ['hello', 'bye'])
+
+# Binaries of packages still being installed are not dispatched.
+assert not os.path.exists(os.path.join(binDir, 'hello'))
+manager.finishInstall(tool1)
+assert os.readlink(os.path.join(binDir, 'hello')) == core.dispatcher
+
+out = run('hello', 'a', 'b')
+assert out.returncode == 0, out.stderr
+assert out.stdout == 'hello %s a b\n' % tool1.instDir
+
+# The newest version wins, and the binary runs in its environment.
+tool2 = install('tool', '2.0', ['hello'])
+manager.finishInstall(tool2)
+assert run('hello').stdout == 'hello %s \n' % tool2.instDir
+assert run('bye').stdout == 'bye %s \n' % tool1.instDir
+
+# Binaries of other packages never displace those of the first by name.
+other = install('other', '1.0', ['hello', 'other'])
+manager.finishInstall(other)
+assert run('hello').stdout == 'hello %s \n' % other.instDir
+assert run('other').returncode == 0
+
+# Unregistering a binary relinks the index at once.
+manager.db.removePackageBinary(other.spackage,
+                               other.instDir / 'bin' / 'other')
+assert not os.path.lexists(os.path.join(binDir, 'other'))
+assert binindex.BinaryIndex(indexFile).lookup('other') is None
+
+manager.removePackage(other)
+assert run('hello').stdout == 'hello %s \n' % tool2.instDir
+manager.removePackage(tool2)
+assert run('hello').stdout == 'hello %s \n' % tool1.instDir
+
+# Links not made by lpm are left alone.
+os.symlink('/bin/true', os.path.join(binDir, 'mine'))
+manager.removePackage(tool1)
+assert not os.path.lexists(os.path.join(binDir, 'hello'))
+assert os.path.lexists(os.path.join(binDir, 'mine'))
+assert len(binindex.BinaryIndex(indexFile)) == 0
+
+# Names missing from the index fail cleanly.
+os.symlink(core.dispatcher, os.path.join(binDir, 'stale'))
+out = run('stale')
+assert out.returncode == 1
+assert 'not provided by any installed package' in out.stderr
+
+print("All dispatch tests passed")
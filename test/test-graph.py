@@ -0,0 +1,147 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+import random
+import tempfile
+
+import config
+import db
+import graph
+import package
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+
+packageDb = db.getDb(conf)
+
+# app -> lib -> base, app -> tool -> base, tool -> lib
+names = ['app', 'lib', 'tool', 'base', 'other']
+pkgs = {}
+for name in names:
+    pkgs[name] = package.Package(conf, packageDb, name, v.Version('1.0'))
+    packageDb.createPackage(pkgs[name].spackage)
+
+for name, dep in [('app', 'lib'), ('app', 'tool'), ('lib', 'base'),
+                  ('tool', 'base'), ('tool', 'lib')]:
+    pkgs[name].addDep(pkgs[dep])
+
+def sp(name):
+    return pkgs[name].spackage
+
+def names(packages):
+    return sorted(package.name for package in packages)
+
+g = graph.DependencyGraph.load(packageDb)
+assert g.findCycle() is None
+assert names(g.dependencies(sp('app'))) == ['base', 'lib', 'tool']
+assert names(g.dependencies(sp('app'), transitive=False)) == ['lib', 'tool']
+assert names(g.dependants(sp('base'))) == ['app', 'lib', 'tool']
+assert g.path(sp('app'), sp('base'))[0] == sp('app')
+assert g.path(sp('base'), sp('app')) is None
+
+order = [p.name for p in g.topologicalOrder()]
+for name, dep in [('app', 'lib'), ('app', 'tool'), ('lib', 'base'),
+                  ('tool', 'base'), ('tool', 'lib')]:
+    assert order.index(dep) < order.index(name)
+assert names(g.topologicalOrder([sp('lib')])) == ['base', 'lib']
+
+# The recursive queries agree with the graph.
+assert names(row[0] for row in packageDb.getTransitiveDeps(sp('app'))) == \
+    ['base', 'lib', 'tool']
+assert names(row[0] for row in packageDb.getTransitiveDependants(sp('lib'))) == \
+    ['app', 'tool']
+assert packageDb.dependsOn(sp('app'), sp('base'))
+assert not packageDb.dependsOn(sp('base'), sp('app'))
+
+# The closure table survives edits.
+assert packageDb.checkClosure() == []
+pkgs['tool'].removeDep(pkgs['lib'])
+assert packageDb.dependsOn(sp('tool'), sp('base'))
+assert not packageDb.dependsOn(sp('tool'), sp('lib'))
+pkgs['other'].addDep(pkgs['app'])
+assert packageDb.dependsOn(sp('other'), sp('base'))
+packageDb.deletePackage(sp('app'))
+assert not packageDb.dependsOn(sp('other'), sp('base'))
+assert packageDb.checkClosure() == []
+
+random.seed(0)
+edges = set()
+ids = list(range(30))
+nodes = [db.SPackage('n%d' % i, v.Version('1')) for i in ids]
+with packageDb.transaction():
+    for node in nodes:
+        packageDb.createPackage(node)
+for step in range(300):
+    a, b = sorted(random.sample(ids, 2))
+    if (a, b) in edges:
+        packageDb.removePackageDep(nodes[a], nodes[b])
+        edges.remove((a, b))
+    else:
+        packageDb.addPackageDep(nodes[a], nodes[b])
+        edges.add((a, b))
+assert packageDb.checkClosure() == []
+
+# A damaged table is reported and repaired.
+packageDb.cursor.execute('delete from dependancy_closure where rowid % 3 = 0;')
+assert packageDb.checkClosure(repair=True) != []
+assert packageDb.checkClosure() == []
+
+# Adding a dependancy that closes a cycle is refused...
+try:
+    pkgs['base'].addDep(pkgs['tool'])
+except graph.CycleException as e:
+    assert e.cycle[0] == e.cycle[-1] == sp('base')
+    assert str(e) == 'Dependency cycle: base 1.0 -> tool 1.0 -> base 1.0'
+else:
+    assert False
+assert not packageDb.dependsOn(sp('base'), sp('tool'))
+
+# ...but the graph still detects one written behind its back.
+packageDb.cursor.execute('''
+    insert into dependancies
+    select b.id, t.id from packages b, packages t
+    where b.name = 'base' and t.name = 'tool';''')
+g = graph.DependencyGraph.load(packageDb)
+cycle = g.findCycle()
+assert cycle[0] == cycle[-1]
+try:
+    g.topologicalOrder()
+except graph.CycleException:
+    pass
+else:
+    assert False
+
+print("All graph tests passed")
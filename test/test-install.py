@@ -0,0 +1,217 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import concurrent.futures
+import functools
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import config
+import core
+import db
+import install
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {'permissions': 0o755, 'jobs': 2},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db'},
+})])
+
+logFile = tmpDir.name + '/log'
+
+# Puts a binary named after the package into instDir, noting when it
+# started and finished. Packages called broken* fail.
+def installer(logFile, delay, name, version, instDir):
+    with open(logFile, 'a') as log:
+        log.write('start %s\n' % name)
+    time.sleep(delay)
+    if name.startswith('broken'):
+        raise RuntimeError('%s does not build' % name)
+
+    os.makedirs(instDir + '/bin')
+    binary = instDir + '/bin/' + name
+    with open(binary, 'w') as f:
+        f.write('#!/bin/sh\n')
+    os.chmod(binary, 0o755)
+    with open(logFile, 'a') as log:
+        log.write('end %s\n' % name)
+
+def readLog():
+    with open(logFile) as f:
+        return [line.split() for line in f]
+
+manager = core.Manager(conf)
+packageDb = manager.db
+
+def add(name, deps=()):
+    package = manager.createPackage(name, v.Version('1.0'))
+    for dep in deps:
+        package.addDep(manager.getPackage(dep, v.Version('1.0')))
+    return package.spackage
+
+#   app -> liba -> base
+#       -> libb -> base
+#   other
+#   top -> broken -> base
+base = add('base')
+liba = add('liba', ['base'])
+libb = add('libb', ['base'])
+app = add('app', ['liba', 'libb'])
+other = add('other')
+broken = add('broken', ['base'])
+top = add('top', ['broken', 'app'])
+
+events = []
+def progress(event, package, detail):
+    events.append((event, package.name))
+
+# The binary index is rebuilt once, at the end.
+indexUpdates = []
+updateBinaryIndex = manager.updateBinaryIndex
+def countIndexUpdates():
+    indexUpdates.append(manager.indexUpdatesHeld)
+    updateBinaryIndex()
+manager.updateBinaryIndex = countIndexUpdates
+
+try:
+    manager.installPackages([top, other],
+                            functools.partial(installer, logFile, 0.2),
+                            progress=progress)
+    assert False, 'the failed install was not reported'
+except install.InstallException as e:
+    results = e.results
+    assert list(e.errors) == [broken]
+    assert 'broken' in str(e)
+
+assert indexUpdates == [0]
+del manager.updateBinaryIndex
+assert results[broken] == install.FAILED
+assert results[top] == install.SKIPPED
+for package in [base, liba, libb, app, other]:
+    assert results[package] == install.INSTALLED
+    assert packageDb.getPackageStatus(package) == 'installed'
+    binary = Path(manager._instDir(package)) / 'bin' / package.name
+    assert [row[0] for row in packageDb.getPackageBinaries(package)] == \
+        [binary]
+    assert os.path.islink(tmpDir.name + '/bin/' + package.name)
+    assert sorted(row[0] for row in packageDb.getManifest(package)) == \
+        ['bin', 'bin/' + package.name]
+
+# Failures are undone, so they can be tried again.
+for package in [broken, top]:
+    assert packageDb.getPackageStatus(package) == 'uninitialized'
+    assert not manager._instDir(package).exists()
+assert ('skipped', 'top') in events and ('failed', 'broken') in events
+
+# Everything started after its dependancies finished, and no more than
+# two ran at once.
+log = readLog()
+position = {(event, name): i for i, (event, name) in enumerate(log)}
+for package, deps in [(liba, [base]), (libb, [base]), (app, [liba, libb]),
+                      (broken, [base])]:
+    for dep in deps:
+        assert position[('start', package.name)] > \
+            position[('end', dep.name)]
+running = 0
+for event, name in log:
+    if event == 'start':
+        running += 1
+    elif event == 'end' or name == 'broken':
+        running -= 1
+    assert running <= 2
+assert ('start', 'top') not in position
+
+# Once broken is fixed, only what is left gets installed.
+def fixedInstaller(name, version, instDir):
+    installer(logFile, 0, name.replace('broken', 'fixed'), version, instDir)
+os.remove(logFile)
+results = manager.installPackages([top], fixedInstaller, jobs=1)
+assert results == {broken: install.INSTALLED, top: install.INSTALLED}
+assert [line[1] for line in readLog()] == ['fixed', 'fixed', 'top', 'top']
+assert manager.installPackages([top], fixedInstaller) == {}
+
+# Independent packages do run at the same time.
+names = ['par%d' % i for i in range(4)]
+for name in names:
+    add(name)
+start = time.monotonic()
+results = manager.installPackages(
+    [db.SPackage(name, v.Version('1.0')) for name in names],
+    functools.partial(installer, logFile, 0.5), jobs=4)
+assert len(results) == 4
+assert time.monotonic() - start < 1.5
+
+# A package whose install dir is already there fails without touching
+# it.
+taken = add('taken')
+os.makedirs(manager._instDir(taken) / 'bin')
+(manager._instDir(taken) / 'bin' / 'mine').touch()
+try:
+    manager.installPackages([taken], functools.partial(installer, logFile, 0))
+    assert False, 'the failed install was not reported'
+except install.InstallException as e:
+    assert e.results == {taken: install.FAILED}
+    assert isinstance(e.errors[taken], FileExistsError)
+assert (manager._instDir(taken) / 'bin' / 'mine').exists()
+assert packageDb.getPackageStatus(taken) == 'uninitialized'
+
+# At least one install has to be allowed at a time.
+executor = concurrent.futures.ThreadPoolExecutor(1)
+add('idle')
+for jobs in (0, -1):
+    try:
+        manager.installPackages([db.SPackage('idle', v.Version('1.0'))],
+                                fixedInstaller, jobs=jobs, executor=executor)
+    except ValueError:
+        pass
+    else:
+        assert False, 'jobs=%d was accepted' % jobs
+
+# An executor passed in is not ours to shut down.
+results = manager.installPackages([db.SPackage('idle', v.Version('1.0'))],
+                                  fixedInstaller, executor=executor)
+assert list(results.values()) == [install.INSTALLED]
+assert executor.submit(int, '1').result() == 1
+executor.shutdown()
+
+# Any executor will do, threads for instance.
+add('threaded')
+results = manager.installPackages(
+    [db.SPackage('threaded', v.Version('1.0'))],
+    functools.partial(installer, logFile, 0),
+    executor=concurrent.futures.ThreadPoolExecutor(1))
+assert list(results.values()) == [install.INSTALLED]
+
+print("All install tests passed")
@@ -0,0 +1,119 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import config
+import core
+import package
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {'permissions': 0o755},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db',
+                  'cacheSize': 0},
+})])
+
+manager = core.Manager(conf)
+packageDb = manager.db
+
+base = manager.createPackage('base', v.Version('1'))
+tool = manager.createPackage('tool', v.Version('2'))
+empty = manager.createPackage('empty', v.Version('3'))
+
+with packageDb.transaction():
+    tool.addDep(base)
+    for i in range(5):
+        tool.addBinary('/opt/tool/bin/t%d' % i)
+    tool.addBindir(Path('/opt/tool/bin'))
+    tool.addLibdir(Path('/opt/tool/lib'))
+    # Added out of alphabetical order, which has to be kept.
+    for value in ['/z', '/a', '/m']:
+        tool.getRunEnv().addVariable('PATH', [value], 'append')
+    tool.getBuildEnv().addVariable('CC', ['cc'], 'overwrite')
+
+# Loading a package is one query, however much it has registered.
+queries = []
+packageDb.cursor.connection.set_trace_callback(queries.append)
+
+tool = manager.getPackage('tool', v.Version('2'))
+queries.clear()
+assert base.spackage in tool.getDeps()
+assert Path('/opt/tool/bin/t3') in tool.getBinaries()
+assert tool.getBindirs() == {Path('/opt/tool/bin')}
+assert tool.getLibdirs() == {Path('/opt/tool/lib')}
+assert tool.getRunEnv().get('PATH') == '/z:/a:/m'
+assert tool.getBuildEnv().get('CC') == 'cc'
+assert len(queries) == 1, queries
+
+# Changes made through the package show up in its sets right away.
+tool.removeBinary('/opt/tool/bin/t3')
+assert Path('/opt/tool/bin/t3') not in tool.getBinaries()
+assert len(packageDb.getPackageBinaries(tool.spackage)) == 4
+tool.removeDep(base)
+assert tool.getDeps() == set()
+tool.addDep(base)
+assert tool.getDeps() == {base.spackage}
+
+assert empty.getDeps() == set() and empty.getBinaries() == set()
+assert empty.getRunEnv().asDict() == {}
+
+# Listing hydrates every package together, within the parameter limit
+# of sqlite before 3.32.
+packageDb.cursor.connection.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER,
+                                     999)
+for i in range(1000):
+    manager.createPackage('bulk%04d' % i, v.Version('1.0')).addBinary(
+        '/opt/bulk%d/bin/b' % i)
+queries.clear()
+packages = manager.listPackages()
+assert len(packages) == 1003
+assert [p.name for p in packages[:3]] == ['base', 'bulk0000', 'bulk0001']
+assert sum(len(p.getBinaries()) for p in packages) == 1004
+assert len(queries) < 10, len(queries)
+
+installed = manager.listPackages('installed')
+assert installed == []
+packageDb.setPackageStatus(tool.spackage, 'installed')
+assert [p.name for p in manager.listPackages('installed')] == ['tool']
+
+# A package that is not registered hydrates to nothing.
+ghost = package.Package(conf, packageDb, 'ghost', v.Version('1'))
+package.hydrate([ghost])
+assert ghost.getBinaries() == set()
+
+packageDb.cursor.connection.set_trace_callback(None)
+
+print("All package tests passed")
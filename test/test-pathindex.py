@@ -0,0 +1,223 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import config
+import core
+import db
+import pathindex
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+random.seed(7)
+
+# Owners of path among entries, the slow way.
+def reference(entries, path):
+    owners = set()
+    for entryPath, kind, name, version in entries:
+        if entryPath == path or (kind != 'binary' and
+                                 path.startswith(entryPath + '/')):
+            owners.add((name, version, kind, entryPath))
+    return sorted(owners)
+
+def randomPath():
+    return '/' + '/'.join(random.choice(['opt', 'usr', 'lib', 'bin', 'a',
+                                         'ab', 'abc', 'b'])
+                          for i in range(random.randint(1, 5)))
+
+entries = set()
+for i in range(3000):
+    entries.add((randomPath(), random.choice(pathindex.kinds),
+                 'pkg%d' % random.randrange(50), '1.%d' % random.randrange(3)))
+
+indexFile = tmpDir.name + '/plain.idx'
+pathindex.writeIndex(indexFile, entries)
+index = pathindex.PathIndex(indexFile)
+assert index.entries() == entries
+queries = [path for path, kind, name, version in random.sample(
+    sorted(entries), 200)] + [randomPath() + '/x' for i in range(200)]
+for query in queries:
+    assert index.owners(query) == reference(entries, query), query
+assert index.owners('/nowhere') == []
+index.close()
+
+# The journal is consulted until it gets merged.
+pathindex.minMergeSize = 50
+pathindex.mergeFraction = 1000
+merged = False
+changes = []
+for i in range(150):
+    entry = random.choice(sorted(entries))
+    if random.random() < 0.5:
+        entries.discard(entry)
+        changes.append((False,) + entry)
+    else:
+        entry = (randomPath(), random.choice(pathindex.kinds), 'new', '2.0')
+        entries.add(entry)
+        changes.append((True,) + entry)
+
+    if i % 10 == 9:
+        pathindex.updateIndex(indexFile, changes)
+        changes = []
+        index = pathindex.PathIndex(indexFile)
+        assert len(index.journal) <= pathindex.minMergeSize
+        merged = merged or not index.journal
+        for query in queries[::10]:
+            assert index.owners(query) == reference(entries, query), query
+        index.close()
+assert merged
+index = pathindex.PathIndex(indexFile)
+assert index.entries() == entries
+index.close()
+
+# Front coding pays off on realistic paths.
+realistic = [('/home/build/.local/share/lpm/packages/pkg%d/dn_1_0/bin/tool%d'
+              % (i // 10, i), 'binary', 'pkg%d' % (i // 10), '1.0')
+             for i in range(1000)]
+pathindex.writeIndex(tmpDir.name + '/realistic.idx', realistic)
+assert (os.path.getsize(tmpDir.name + '/realistic.idx') <
+        sum(len(entry[0]) for entry in realistic) // 3)
+
+pathindex.writeIndex(tmpDir.name + '/empty.idx', [])
+assert pathindex.PathIndex(tmpDir.name + '/empty.idx').owners('/a') == []
+
+# Kept up to date by the Manager, and agreeing with the database.
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name + '/lpm',
+        'packageDir': tmpDir.name + '/lpm/packages',
+        'binDir': tmpDir.name + '/lpm/bin',
+    },
+    'install': {
+        'permissions': 0o755,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/lpm/packages.db',
+    },
+})])
+os.makedirs(conf.locations.dataDir)
+manager = core.Manager(conf)
+packageDb = manager.db
+
+packages = []
+for i in range(20):
+    package = db.SPackage('pkg%d' % i, v.Version('1.%d' % (i % 3)))
+    packageDb.createPackage(package)
+    packages.append(package)
+
+used = set()
+def addRandomPaths(package, count):
+    for i in range(count):
+        kind = random.randrange(3)
+        path = randomPath()
+        while (package, kind, path) in used:
+            path = randomPath()
+        used.add((package, kind, path))
+        if kind == 0:
+            packageDb.addPackageBinary(package, path + '/tool')
+        elif kind == 1:
+            packageDb.addPackageBindir(package, path)
+        else:
+            packageDb.addPackageLibdir(package, path)
+
+def check():
+    index = pathindex.PathIndex(manager.pathIndexFile())
+    for query in queries[::4]:
+        expected = sorted((row['package'].name, str(row['package'].version),
+                           row['kind'], str(row['path']))
+                          for row in packageDb.getPathOwners(query))
+        assert index.owners(query) == expected, query
+    index.close()
+
+with packageDb.transaction():
+    for package in packages:
+        addRandomPaths(package, 30)
+manager.rebuildPathIndex()
+check()
+
+# Registering and unregistering only touches the journal.
+pathindex.minMergeSize = 1000000
+pathindex.mergeFraction = 1
+indexMtime = os.stat(manager.pathIndexFile()).st_mtime_ns
+addRandomPaths(packages[0], 10)
+for row in packageDb.getPackageBindirs(packages[1]):
+    packageDb.removePackageBindir(packages[1], row[0])
+packageDb.deletePackage(packages[2])
+try:
+    with packageDb.transaction():
+        addRandomPaths(packages[3], 5)
+        raise RuntimeError
+except RuntimeError:
+    pass
+assert os.stat(manager.pathIndexFile()).st_mtime_ns == indexMtime
+check()
+
+pathindex.minMergeSize = 10
+pathindex.mergeFraction = 1000
+with packageDb.transaction():
+    addRandomPaths(packages[4], 20)
+assert not os.path.exists(pathindex.journalPath(manager.pathIndexFile()))
+check()
+
+# lpm owns, one path at a time or in batches from stdin.
+binary = '/srv/foo/bin/foo'
+packageDb.addPackageBinary(packages[5], binary)
+lpm = Path(__file__).resolve().parent.parent / 'src' / 'lpm'
+environ = {'XDG_DATA_HOME': tmpDir.name,
+           'XDG_CONFIG_HOME': tmpDir.name + '/config',
+           'HOME': tmpDir.name,
+           'PATH': os.environ['PATH']}
+
+out = subprocess.run([sys.executable, str(lpm), 'owns', binary],
+                     env=environ, stdout=subprocess.PIPE,
+                     universal_newlines=True)
+assert out.returncode == 0
+assert out.stdout == '%s: pkg5 1.2 (binary %s)\n' % (binary, binary)
+
+out = subprocess.run([sys.executable, str(lpm), 'owns'],
+                     input='%s\n/nowhere\n%s\n' % (binary, binary),
+                     env=environ, stdout=subprocess.PIPE,
+                     stderr=subprocess.PIPE, universal_newlines=True)
+assert out.returncode == 1
+assert out.stdout.count('pkg5') == 2
+assert '/nowhere is not owned' in out.stderr
+
+# Without an index, lpm owns builds one.
+os.unlink(manager.pathIndexFile())
+out = subprocess.run([sys.executable, str(lpm), 'owns', binary],
+                     env=environ, stdout=subprocess.PIPE,
+                     universal_newlines=True)
+assert out.returncode == 0 and 'pkg5' in out.stdout
+assert os.path.exists(manager.pathIndexFile())
+
+print("All path index tests passed")
@@ -0,0 +1,152 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import config
+import db
+import querycache
+import version as v
+
+# The cache on its own: least recently used entries go first, writes
+# drop entries by tag, and results looked up before an invalidation
+# are not stored after it.
+cache = querycache.QueryCache(2)
+value, token = cache.lookup('a')
+assert value is None
+cache.store(token, 'a', ('x',), 1)
+cache.store(token, 'b', ('y',), 2)
+assert cache.lookup('a')[0] == 1
+cache.store(token, 'c', ('x', 'y'), 3)
+assert cache.lookup('b')[0] is None
+assert cache.lookup('a')[0] == 1 and cache.lookup('c')[0] == 3
+cache.invalidate(['y'])
+assert cache.lookup('c')[0] is None and cache.lookup('a')[0] == 1
+value, token = cache.lookup('d')
+cache.invalidate(['z'])
+cache.store(token, 'd', (), 4)
+assert cache.lookup('d')[0] is None
+cache.invalidate()
+assert len(cache) == 0 and cache.tagged == {}
+assert cache.stats()['hits'] == 4
+
+tmpDir = tempfile.TemporaryDirectory()
+dbFile = tmpDir.name + '/packages.db'
+
+conf = config.resolve([('test', {
+    'locations': {'dataDir': tmpDir.name},
+    'packageDb': {'type': 'sqlite3', 'dbFile': dbFile},
+})])
+
+packageDb = db.getDb(conf)
+
+foo = db.SPackage('foo', v.Version('1'))
+bar = db.SPackage('bar', v.Version('2'))
+with packageDb.transaction():
+    for package in [foo, bar]:
+        packageDb.createPackage(package)
+        packageDb.addPackageBinaries(package, [Path('/opt/%s/bin/%s' %
+                                                    (package.name,
+                                                     package.name))])
+        packageDb.addPackageEnvs(package, [('PATH', '/opt/%s/bin' %
+                                            package.name, 'prepend', ':')],
+                                 build=False)
+    packageDb.addPackageDeps(foo, [bar])
+
+def stats():
+    result = packageDb.cacheStats()
+    return result['hits'], result['misses']
+
+# Repeated reads are answered from the cache.
+start = stats()
+for i in range(3):
+    assert packageDb.packageExists(foo)
+    assert [row[0] for row in packageDb.getPackageDeps(foo)] == [bar]
+    assert len(packageDb.getPackageBinaries(foo)) == 1
+    assert len(packageDb.getPackageEnv(foo)) == 1
+    assert (packageDb.getCompositeEnv(foo)['PATH'] ==
+            '/opt/foo/bin:/opt/bar/bin')
+hits, misses = stats()
+assert (hits - start[0], misses - start[1]) == (10, 5)
+
+# A write drops what it changed and leaves the rest.
+packageDb.addPackageBinary(foo, Path('/opt/foo/bin/foo2'))
+hits, misses = stats()
+assert len(packageDb.getPackageBinaries(foo)) == 2
+assert stats() == (hits, misses + 1)
+packageDb.getPackageEnv(foo)
+assert stats() == (hits + 1, misses + 1)
+
+# Changing a dependancy's environment reaches the composite
+# environment of the packages depending on it.
+packageDb.addPackageEnv(bar, 'PATH', '/opt/bar/sbin', 'prepend', ':', False)
+assert packageDb.getCompositeEnv(foo)['PATH'] == \
+    '/opt/foo/bin:/opt/bar/sbin:/opt/bar/bin'
+
+# The result of a returned list can be changed without harm.
+packageDb.getPackageBinaries(foo).clear()
+assert len(packageDb.getPackageBinaries(foo)) == 2
+
+# Reads inside a transaction see its changes, are not cached, and
+# what was cached before survives a rollback.
+baz = db.SPackage('baz', v.Version('3'))
+assert not packageDb.packageExists(baz)
+try:
+    with packageDb.transaction():
+        packageDb.createPackage(baz)
+        assert packageDb.packageExists(baz)
+        raise KeyError('rollback')
+except KeyError:
+    pass
+assert not packageDb.packageExists(baz)
+assert packageDb.getPackageStatus(foo) == 'uninitialized'
+
+# Deleting a package drops it from the dependancy lists of others.
+packageDb.deletePackage(bar)
+assert packageDb.getPackageDeps(foo) == []
+assert packageDb.getCompositeEnv(foo)['PATH'] == '/opt/foo/bin'
+
+# Commits made by other processes are noticed through the data version.
+assert packageDb.getPackageStatus(foo) == 'uninitialized'
+other = sqlite3.connect(dbFile)
+other.execute("update packages set status = 'installed' where name = 'foo';")
+other.commit()
+other.close()
+assert packageDb.getPackageStatus(foo) == 'installed'
+
+# The cache can be turned off.
+packageDb.close()
+conf = config.resolve([('test', config.asDict(conf)),
+                       ('nocache', {'packageDb': {'cacheSize': 0}})])
+packageDb = db.getDb(conf)
+assert packageDb.cacheStats() is None
+assert packageDb.getPackageStatus(foo) == 'installed'
+assert len(packageDb.getPackageBinaries(foo)) == 2
+packageDb.close()
+
+print("All query cache tests passed")
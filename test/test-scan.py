@@ -0,0 +1,183 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+import os
+import tempfile
+
+import config
+import db
+import package
+import scan
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+    },
+    'install': {
+        'permissions': 0o755,
+    },
+    'packageDb': {
+        'type': 'sqlite3',
+        'dbFile': tmpDir.name + '/packages.db',
+    },
+})])
+
+packageDb = db.getDb(conf)
+
+vers = v.Version('2.0')
+pkg = package.Package(conf, packageDb, 'tool', vers)
+packageDb.createPackage(pkg.spackage)
+pkg.initialize()
+
+def touch(path, mode):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+    path.chmod(mode)
+
+root = pkg.instDir
+for i in range(50):
+    touch(root / 'bin' / ('tool%d' % i), 0o755)
+touch(root / 'bin' / 'README', 0o644)
+touch(root / 'usr' / 'sbin' / 'toold', 0o755)
+touch(root / 'lib' / 'libtool.so', 0o755)
+touch(root / 'share' / 'doc' / 'tool' / 'examples' / 'bin' / 'demo', 0o755)
+os.symlink('tool0', str(root / 'bin' / 'tool-alias'))
+os.symlink('missing', str(root / 'bin' / 'dangling'))
+
+counts = pkg.scan(chunkSize=7)
+
+assert counts == {scan.BINDIR: 2, scan.LIBDIR: 1, scan.BINARY: 52,
+                  scan.FILE: 65}, counts
+binaries = {row[0] for row in packageDb.getPackageBinaries(pkg.spackage)}
+assert root / 'bin' / 'tool-alias' in binaries
+assert root / 'usr' / 'sbin' / 'toold' in binaries
+assert root / 'bin' / 'README' not in binaries
+assert len(binaries) == 52
+
+def binaryNames():
+    return {row[0].name for row in packageDb.getPackageBinaries(pkg.spackage)}
+
+def manifest():
+    return {row[0]: tuple(row[1:])
+            for row in packageDb.getManifest(pkg.spackage)}
+
+# The manifest holds everything but lpm's own files.
+(root / '.lpm').mkdir()
+(root / '.lpm' / 'activate.env').write_text('lpm-activate 1\n')
+rows = manifest()
+assert len(rows) == 65
+size, mtime, inode, mode, digest = rows['bin/tool0']
+st = os.lstat(str(root / 'bin' / 'tool0'))
+assert (size, mtime, inode, mode) == (st.st_size, st.st_mtime_ns,
+                                      st.st_ino, st.st_mode)
+assert digest is None
+assert rows['bin/dangling'][3] == os.lstat(str(root / 'bin' /
+                                               'dangling')).st_mode
+
+# Nothing changed.
+assert pkg.rescan() == []
+(root / '.lpm' / 'activate.env').write_text('lpm-activate 1\nmore\n')
+assert pkg.rescan() == []
+
+# Digests are only taken when asked for, which is not a change.
+assert pkg.rescan(hash=True, jobs=3) == []
+rows = manifest()
+assert rows['bin/tool0'][4] == scan.digest(str(root / 'bin' / 'tool0'),
+                                           rows['bin/tool0'][3])
+assert rows['bin/tool-alias'][4] == scan.digest(
+    str(root / 'bin' / 'tool-alias'), rows['bin/tool-alias'][3])
+assert rows['bin'][4] is None
+assert pkg.rescan(hash=True) == []
+
+# Hashing tells a touch from an edit.
+readme = root / 'bin' / 'README'
+os.utime(str(readme), ns=(0, 1000000000))
+assert pkg.rescan(hash=True) == [(scan.TOUCHED, 'bin/README')]
+assert pkg.rescan(hash=True) == []
+readme.write_text('read me\n')
+assert pkg.rescan(hash=True) == [(scan.MODIFIED, 'bin/README')]
+assert manifest()['bin/README'][4] == scan.digest(str(readme), 0o100644)
+
+# Without hashing a changed stat is an edit, and drops the digest.
+os.utime(str(readme), ns=(0, 2000000000))
+assert pkg.rescan() == [(scan.MODIFIED, 'bin/README')]
+assert manifest()['bin/README'][4] is None
+assert pkg.rescan() == []
+assert 'README' not in binaryNames()
+
+# A file that cannot be hashed is reported and looked at again next
+# time.
+def unreadable(path, mode):
+    raise PermissionError(13, 'Permission denied', path)
+digest = scan.digest
+scan.digest = unreadable
+readme.write_text('read me again\n')
+assert pkg.rescan(hash=True) == [(scan.UNREADABLE, 'bin/README')]
+assert pkg.rescan(hash=True) == [(scan.UNREADABLE, 'bin/README')]
+scan.digest = digest
+assert pkg.rescan(hash=True) == [(scan.MODIFIED, 'bin/README')]
+assert manifest()['bin/README'][4] == scan.digest(str(readme), 0o100644)
+
+# Becoming executable makes it a binary.
+readme.chmod(0o755)
+assert pkg.rescan() == [(scan.MODIFIED, 'bin/README')]
+assert 'README' in binaryNames()
+
+# Added and removed files.
+(root / 'bin' / 'tool3').unlink()
+touch(root / 'bin' / 'newtool', 0o755)
+# Directories only show up when they come or go.
+changes = pkg.rescan()
+assert changes == [(scan.ADDED, 'bin/newtool'),
+                   (scan.REMOVED, 'bin/tool3')], changes
+assert manifest()['bin/newtool'][4] is None
+names = binaryNames()
+assert 'newtool' in names and 'tool3' not in names
+assert len(manifest()) == 65
+
+# And a bin dir going with its binaries.
+(root / 'usr' / 'sbin' / 'toold').unlink()
+(root / 'usr' / 'sbin').rmdir()
+(root / 'usr').rmdir()
+changes = pkg.rescan()
+assert changes == [(scan.REMOVED, 'usr'), (scan.REMOVED, 'usr/sbin'),
+                   (scan.REMOVED, 'usr/sbin/toold')], changes
+assert len(packageDb.getPackageBindirs(pkg.spackage)) == 1
+assert 'toold' not in binaryNames()
+assert pkg.rescan() == []
+
+# Recording the manifest again starts over.
+packageDb.setManifestEntries(pkg.spackage, [('gone', 0, 0, 0, 0o100644,
+                                             None)])
+scan.recordManifest(packageDb, pkg.spackage, root)
+assert 'gone' not in manifest()
+assert manifest()['bin/tool0'][4] is None
+assert len(manifest()) == 62
+
+print("All scanner tests passed")
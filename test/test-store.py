@@ -0,0 +1,175 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import errno
+import os
+import tempfile
+
+import config
+import core
+import store
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+storeDir = tmpDir.name + '/store'
+
+def write(path, data, mode=0o644):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+    os.chmod(path, mode)
+
+def inode(path):
+    return os.stat(path).st_ino
+
+def blobs():
+    objects = storeDir + '/objects'
+    return sorted(os.path.join(dirPath, name)
+                  for dirPath, dirNames, names in os.walk(objects)
+                  for name in names)
+
+# Two versions sharing most of their files.
+one = tmpDir.name + '/tool/1'
+two = tmpDir.name + '/tool/2'
+for root, version in [(one, '1'), (two, '2')]:
+    write(root + '/bin/tool', '#!/bin/sh\necho tool\n', 0o755)
+    write(root + '/share/doc', 'docs ' * 1000)
+    write(root + '/share/version', version)
+    # Same content as the binary, but not executable.
+    write(root + '/share/tool.txt', '#!/bin/sh\necho tool\n')
+    write(root + '/empty', '')
+    os.symlink('bin/tool', root + '/link')
+
+stats = store.dedupe(one, storeDir)
+assert stats == {'files': 4, 'linked': 0, 'saved': 0}, stats
+assert len(blobs()) == 4
+stats = store.dedupe(two, storeDir)
+assert stats == {'files': 4, 'linked': 3, 'saved': 5000 + 20 * 2}, stats
+assert len(blobs()) == 5
+
+assert inode(one + '/share/doc') == inode(two + '/share/doc')
+assert inode(one + '/bin/tool') == inode(two + '/bin/tool')
+assert inode(one + '/bin/tool') != inode(one + '/share/tool.txt')
+assert inode(one + '/share/version') != inode(two + '/share/version')
+assert os.stat(two + '/bin/tool').st_mode & 0o777 == 0o555
+assert os.stat(two + '/share/doc').st_mode & 0o777 == 0o444
+assert os.stat(two + '/share/doc').st_nlink == 3
+assert os.path.islink(two + '/link')
+
+# Doing a tree again changes nothing.
+assert store.dedupe(two, storeDir)['files'] == 0
+
+# Blobs stay while any tree uses them.
+assert store.removeTree(one, storeDir) == 1
+assert not os.path.exists(one)
+assert len(blobs()) == 4
+with open(two + '/share/doc') as f:
+    assert f.read() == 'docs ' * 1000
+assert store.removeTree(two, storeDir) == 4
+assert blobs() == []
+
+# collect finds blobs whose trees went away some other way.
+three = tmpDir.name + '/tool/3'
+write(three + '/bin/tool', 'x')
+store.dedupe(three, storeDir)
+assert store.collect(storeDir) == 0
+os.unlink(three + '/bin/tool')
+assert store.collect(storeDir) == 1
+assert blobs() == []
+
+# Installs through the manager are deduplicated with install.dedupe.
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name,
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {'permissions': 0o755, 'jobs': 2, 'dedupe': 1},
+    'packageDb': {'type': 'sqlite3', 'dbFile': tmpDir.name + '/packages.db'},
+})])
+manager = core.Manager(conf)
+assert manager.storeDir() == storeDir
+
+def installer(name, version, instDir):
+    write(instDir + '/bin/' + name, '#!/bin/sh\n', 0o755)
+    write(instDir + '/lib/libshared.so', 'shared library')
+
+packages = [manager.createPackage('pkg', v.Version(vers))
+            for vers in ['1.0', '1.1', '2.0']]
+manager.installPackages([package.spackage for package in packages],
+                        installer)
+assert len(blobs()) == 2
+for package in packages:
+    assert os.stat(package.instDir / 'lib' / 'libshared.so').st_nlink == 4
+    assert os.path.exists(package.instDir / '.lpm' / 'store')
+    assert package.rescan() == []
+
+# The manifest is recorded again for trees deduplicated after the scan.
+package = manager.createPackage('pkg', v.Version('3.0'))
+package.initialize()
+installer('pkg', '3.0', str(package.instDir))
+package.scan()
+manager.finishInstall(package)
+assert package.rescan() == []
+packages.append(package)
+
+manager.removePackage(packages[0])
+assert len(blobs()) == 2
+for package in packages[1:]:
+    manager.removePackage(package)
+assert blobs() == []
+
+# A tree on another file system is left as it is.
+if os.path.isdir('/dev/shm'):
+    shmDir = tempfile.TemporaryDirectory(dir='/dev/shm')
+    if os.stat(shmDir.name).st_dev != os.stat(storeDir).st_dev:
+        write(shmDir.name + '/bin/tool', 'elsewhere', 0o755)
+        assert store.dedupe(shmDir.name, storeDir)['files'] == 0
+        assert os.stat(shmDir.name + '/bin/tool').st_mode & 0o777 == 0o755
+        assert not os.path.exists(store._manifestPath(shmDir.name))
+        assert blobs() == []
+
+# So is what could not be linked, and the rest of the tree after it.
+partial = tmpDir.name + '/tool/partial'
+write(partial + '/a', 'first', 0o644)
+write(partial + '/b', 'second', 0o644)
+link = os.link
+def crossLink(src, dst):
+    if src.endswith('/b'):
+        raise OSError(errno.EXDEV, 'Invalid cross-device link')
+    link(src, dst)
+os.link = crossLink
+try:
+    store.dedupe(partial, storeDir)
+finally:
+    os.link = link
+assert [os.stat(partial + name).st_mode & 0o777 for name in ['/a', '/b']] \
+    in ([0o444, 0o644], [0o644, 0o644])
+assert len(blobs()) == len(open(store._manifestPath(partial)).read().split())
+store.removeTree(partial, storeDir)
+assert blobs() == []
+
+print("All store tests passed")
@@ -0,0 +1,208 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import errno
+import functools
+import os
+import stat
+import tempfile
+
+import config
+import core
+import install
+import treecopy
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+src = tmpDir.name + '/src'
+
+def write(path, data, mode=0o644):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.chmod(path, mode)
+    os.utime(path, ns=(1000000000, 2000000000 + len(data)))
+
+bigData = bytes(range(256)) * 8192
+write(src + '/empty', b'')
+write(src + '/small', b'hello\n')
+write(src + '/big', bigData)
+write(src + '/bin/tool', b'#!/bin/sh\n', 0o755)
+write(src + '/share/doc/readme', b'read me\n', 0o444)
+for i in range(100):
+    write(src + '/lib/many/file%d' % i, b'%d\n' % i)
+os.symlink('../big', src + '/bin/link')
+os.symlink('nowhere', src + '/dangling')
+os.chmod(src + '/share/doc', 0o555)
+os.utime(src + '/lib', ns=(1000000000, 1500000000))
+
+def walk(root):
+    found = {}
+    for dirPath, dirNames, fileNames in os.walk(root):
+        for name in dirNames + fileNames:
+            path = os.path.join(dirPath, name)
+            st = os.lstat(path)
+            rel = os.path.relpath(path, root)
+            if stat.S_ISLNK(st.st_mode):
+                found[rel] = ('link', os.readlink(path), st.st_mtime_ns)
+            elif stat.S_ISDIR(st.st_mode):
+                found[rel] = ('dir', st.st_mode, st.st_mtime_ns)
+            else:
+                with open(path, 'rb') as f:
+                    found[rel] = ('file', st.st_mode, st.st_mtime_ns,
+                                  f.read())
+    return found
+
+def chmodAll(root):
+    for dirPath, dirNames, fileNames in os.walk(root):
+        os.chmod(dirPath, 0o755)
+
+expected = walk(src)
+
+# Copied by threads and by the calling thread alone.
+for jobs in (1, 4):
+    dst = tmpDir.name + '/dst%d' % jobs
+    stats = treecopy.copyTree(src, dst, 0o750, jobs)
+    assert stats == {'files': 105, 'dirs': 5, 'symlinks': 2,
+                     'bytes': len(bigData) + 6 + 10 + 8 + 290}, stats
+    assert walk(dst) == expected
+    assert stat.S_IMODE(os.stat(dst).st_mode) == 0o750
+
+# Into a directory that exists, which keeps its mode.
+dst = tmpDir.name + '/existing'
+os.mkdir(dst, 0o700)
+treecopy.copyTree(src, dst)
+assert walk(dst) == expected
+assert stat.S_IMODE(os.stat(dst).st_mode) == 0o700
+
+# Every method on its own.
+for name, method in treecopy._methods + [('read', None)]:
+    methods = treecopy._methods
+    treecopy._methods = [(name, method)] if method else []
+    dst = tmpDir.name + '/method-' + name
+    try:
+        try:
+            treecopy.copyTree(src, dst)
+        except OSError as e:
+            # A clone is refused by most file systems and is not retried.
+            assert name == 'clone', e
+            continue
+        assert walk(dst) == expected
+    finally:
+        treecopy._methods = methods
+        treecopy._failed.clear()
+
+# A method that fails half way through as not supported is given up
+# on, for those devices, and the copy starts over.
+calls = []
+def halfway(src, dst, size):
+    calls.append(size)
+    os.write(dst, b'partial')
+    raise OSError(errno.EOPNOTSUPP, 'not here')
+
+def broken(src, dst, size):
+    raise OSError(errno.EIO, 'bad disk')
+
+methods = treecopy._methods
+treecopy._methods = [('halfway', halfway)]
+dst = tmpDir.name + '/halfway'
+treecopy.copyTree(src, dst, jobs=1)
+assert walk(dst) == expected
+assert len(calls) == 1
+assert len(treecopy._failed) == 1
+treecopy._failed.clear()
+
+# A method stopping short has the rest read, the kernel copies
+# included.
+def short(src, dst, size):
+    return os.write(dst, os.read(src, 3))
+
+treecopy._methods = [('short', short)]
+dst = tmpDir.name + '/short'
+treecopy.copyTree(src, dst, jobs=1)
+assert walk(dst) == expected
+
+sendfile = os.sendfile
+def shortSendfile(out, inFd, offset, count):
+    if offset > 0:
+        return 0
+    return sendfile(out, inFd, offset, min(count, 3))
+os.sendfile = shortSendfile
+treecopy._methods = [('sendfile', treecopy._sendfile)]
+dst = tmpDir.name + '/short-sendfile'
+try:
+    treecopy.copyTree(src, dst, jobs=1)
+finally:
+    os.sendfile = sendfile
+assert walk(dst) == expected
+assert not treecopy._failed
+
+# Other errors stop the copy.
+treecopy._methods = [('broken', broken)]
+try:
+    treecopy.copyTree(src, tmpDir.name + '/broken')
+    assert False, 'copied with a broken disk'
+except OSError as e:
+    assert e.errno == errno.EIO
+assert not treecopy._failed
+treecopy._methods = methods
+
+# Staged installs, through Package and the install scheduler.
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name + '/data',
+        'packageDir': tmpDir.name + '/packages',
+        'binDir': tmpDir.name + '/bin',
+    },
+    'install': {'permissions': 0o750, 'jobs': 2},
+    'packageDb': {'type': 'sqlite3',
+                  'dbFile': tmpDir.name + '/packages.db'},
+})])
+manager = core.Manager(conf)
+
+package = manager.createPackage('staged', v.Version('1.0'))
+package.initialize()
+package.installFrom(src)
+assert walk(str(package.instDir)) == expected
+
+stageRoot = tmpDir.name + '/stage'
+os.makedirs(stageRoot + '/other')
+treecopy.copyTree(src, stageRoot + '/other/2.0')
+other = manager.createPackage('other', v.Version('2.0'))
+results = manager.installPackages(
+    [other.spackage], functools.partial(install.copyStaged, stageRoot, 0o750),
+    executor=install.concurrent.futures.ThreadPoolExecutor(2))
+assert results == {other.spackage: install.INSTALLED}, results
+# Finishing the install adds the activation scripts.
+installed = walk(str(other.instDir))
+assert {path: entry for path, entry in installed.items()
+        if not path.startswith('.lpm')} == expected
+assert manager.db.getPackageBinaries(other.spackage)
+
+for root in os.listdir(tmpDir.name):
+    chmodAll(tmpDir.name + '/' + root)
+
+print("All treecopy tests passed")
@@ -0,0 +1,183 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+#!/usr/bin/python3
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import config
+import core
+import scan
+import verify
+import version as v
+
+tmpDir = tempfile.TemporaryDirectory()
+
+conf = config.resolve([('test', {
+    'locations': {
+        'dataDir': tmpDir.name + '/lpm',
+        'packageDir': tmpDir.name + '/lpm/packages',
+        'binDir': tmpDir.name + '/lpm/bin',
+    },
+    'install': {'permissions': 0o755},
+    'packageDb': {'type': 'sqlite3',
+                  'dbFile': tmpDir.name + '/lpm/packages.db'},
+    'verify': {'jobs': 3},
+})])
+os.makedirs(tmpDir.name + '/lpm')
+manager = core.Manager(conf)
+assert verify.defaultJobs(conf) == 3
+
+def install(name, files, hash=True):
+    package = manager.createPackage(name, v.Version('1.0'))
+    package.initialize()
+    for path, data in files.items():
+        path = package.instDir / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    package.scan()
+    manager.finishInstall(package)
+    if hash:
+        assert manager.rescanPackages([package], hash=True) == {package: []}
+    return package
+
+# Big enough to be mapped.
+scan.mmapThreshold = 4096
+big = os.urandom(100000)
+tool = install('tool', {'bin/tool': b'#!/bin/sh\n', 'share/big': big,
+                        'share/empty': b''})
+os.symlink('tool', str(tool.instDir / 'bin' / 'alias'))
+assert tool.rescan(hash=True) == [(scan.ADDED, 'bin/alias')]
+other = install('other', {'lib/libother.so': b'other'})
+
+def check(packages=None, jobs=None):
+    return sorted((package.name, path, state) for package, path, state,
+                  detail in manager.verifyPackages(packages, jobs))
+
+# Digests are taken by hashing rescans.
+expected = [('other', 'lib/libother.so'), ('tool', 'bin/alias'),
+            ('tool', 'bin/tool'), ('tool', 'share/big'),
+            ('tool', 'share/empty')]
+for jobs in (None, 1, 4):
+    assert check(jobs=jobs) == [key + (verify.OK,) for key in expected]
+digests = {row[0]: row[5] for row in manager.db.getManifest(tool.spackage)}
+assert digests['share/big'] == scan.digest(str(tool.instDir / 'share/big'),
+                                           0o100644)
+assert digests['bin'] is None
+
+# Changes are found whether or not the stat shows them.
+bigFile = tool.instDir / 'share' / 'big'
+st = os.stat(str(bigFile))
+bigFile.write_bytes(big[:-1] + b'x')
+os.utime(str(bigFile), ns=(st.st_atime_ns, st.st_mtime_ns))
+(tool.instDir / 'share' / 'empty').unlink()
+(tool.instDir / 'share' / 'empty').mkdir()
+(tool.instDir / 'bin' / 'alias').unlink()
+os.symlink('elsewhere', str(tool.instDir / 'bin' / 'alias'))
+(other.instDir / 'lib' / 'libother.so').unlink()
+assert check() == [
+    ('other', 'lib/libother.so', verify.MISSING),
+    ('tool', 'bin/alias', verify.MISMATCH),
+    ('tool', 'bin/tool', verify.OK),
+    ('tool', 'share/big', verify.MISMATCH),
+    ('tool', 'share/empty', verify.MISMATCH),
+]
+assert check([other]) == [('other', 'lib/libother.so', verify.MISSING)]
+
+# Verifying never takes the files as they are now for the reference.
+edited = install('edited', {'bin/tool': b'#!/bin/sh\n'})
+(edited.instDir / 'bin' / 'tool').write_bytes(b'#!/bin/sh\nrm -rf ~\n')
+assert check([edited]) == [('edited', 'bin/tool', verify.MISMATCH)]
+assert check([edited]) == [('edited', 'bin/tool', verify.MISMATCH)]
+
+# Files without a digest, not hashed since they were registered or
+# changed, cannot be vouched for.
+assert edited.rescan() == [(scan.MODIFIED, 'bin/tool')]
+assert check([edited]) == [('edited', 'bin/tool', verify.UNVERIFIED)]
+unhashed = install('unhashed', {'bin/tool': b'#!/bin/sh\n'}, hash=False)
+assert check([unhashed]) == [('unhashed', 'bin/tool', verify.UNVERIFIED)]
+
+# Neither can a package without a manifest, as one installed before
+# there were manifests.
+bare = install('bare', {'bin/bare': b'#!/bin/sh\n'})
+manager.db.clearManifest(bare.spackage)
+results = list(manager.verifyPackages([bare]))
+assert [(path, state, detail) for package, path, state, detail in results] \
+    == [(None, verify.UNVERIFIED, 'no manifest')]
+
+# Many files, more than are queued at once, and stopping early.
+many = install('many', {'data/f%d' % i: b'%d' % i for i in range(500)})
+results = manager.verifyPackages([many], 2)
+for i in range(100):
+    assert next(results)[2] == verify.OK
+results.close()
+assert all(state == verify.OK for name, path, state in check([many], 2))
+
+# The command exits with 1 when anything failed.
+lpm = Path(__file__).resolve().parent.parent / 'src' / 'lpm'
+environ = {'XDG_DATA_HOME': tmpDir.name,
+           'XDG_CONFIG_HOME': tmpDir.name + '/config',
+           'HOME': tmpDir.name,
+           'PYTHONPATH': os.environ.get('PYTHONPATH', ''),
+           'PATH': os.environ['PATH']}
+
+def run(*args):
+    result = subprocess.run([sys.executable, str(lpm)] + list(args),
+                            env=environ, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL,
+                            universal_newlines=True)
+    return result.returncode, result.stdout
+
+assert run('verify', 'many') == (0, '')
+code, out = run('verify', '-v', 'many')
+assert code == 0 and len(out.splitlines()) == 500
+assert run('verify', 'other') == (1, 'other 1.0: missing lib/libother.so\n')
+assert run('verify', 'edited') == (1, 'edited 1.0: unverified bin/tool\n')
+assert run('verify', 'bare') == (1, 'bare 1.0: unverified (no manifest)\n')
+code, out = run('verify')
+assert code == 1 and len(out.splitlines()) == 7
+assert run('rescan', '--hash', 'unhashed') == (0, '')
+assert run('verify', 'unhashed') == (0, '')
+assert run('verify', 'nothing')[0] == 1
+
+# On a fresh system, without even the data dir, the commands using the
+# database create it; one that cannot be opened is reported plainly.
+environ['XDG_DATA_HOME'] = tmpDir.name + '/fresh'
+assert run('verify') == (0, '')
+assert run('rescan') == (0, '')
+assert os.path.isfile(tmpDir.name + '/fresh/lpm/packages.db')
+os.makedirs(tmpDir.name + '/broken/lpm/packages.db')
+environ['XDG_DATA_HOME'] = tmpDir.name + '/broken'
+for command in (['verify'], ['rescan'], ['owns', '/bin/sh']):
+    result = subprocess.run([sys.executable, str(lpm)] + command,
+                            env=environ, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 1, result
+    assert result.stderr.startswith('lpm: Sqlite3 DB'), result.stderr
+
+print("All verify tests passed")
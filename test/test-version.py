@@ -0,0 +1,111 @@
+# The MIT License (MIT)
+# Copyright (c) 2016 Samuel Loewen <samuellwn@samuellwn.org>
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+#!/usr/bin/python3
+import copy
+import pickle
+
+import version as v
+
+for s, safe in [('1.2.3', 'dn_1_2_3'), ('0.10-r2', 'dn_0_10r2'),
+                ('1.2 (dev)', 'dn_1_2dev')]:
+    vers = v.Version(s)
+    assert type(vers) is v.DottedNumberVersion
+    assert str(vers) == s
+    assert vers.safeStr() == safe
+
+for s, cls, safe in [('1.0.0-rc.1+b.5', v.SemanticVersion, 'sv_1_0_0_prc_2e1_bb_2e5'),
+                     ('1.2.3-alpha-1', v.SemanticVersion, 'sv_1_2_3_palpha_2d1'),
+                     ('2016-10-17', v.CalendarVersion, 'cv_2016_10_17'),
+                     ('2016-10-17.2', v.CalendarVersion, 'cv_2016_10_17_2'),
+                     ('2016.10.17', v.DottedNumberVersion, 'dn_2016_10_17')]:
+    vers = v.Version(s)
+    assert type(vers) is cls, s
+    assert str(vers) == s
+    assert vers.safeStr() == safe
+
+for s in ['', 'x', '1..2', '1.2-', '01', '1.0.0-01', '2016-13-01']:
+    try:
+        v.Version(s)
+    except v.VersionParseException:
+        pass
+    else:
+        assert False, s
+
+# Ordering, in Python and as encoded for sqlite.
+ordered = ['0.9', '1.2', '1.2-r1', '1.2-r2', '1.2-r10', '1.2.0', '1.10', '10']
+versions = [v.Version(s) for s in reversed(ordered)]
+assert [str(vers) for vers in sorted(versions)] == ordered
+assert [str(vers) for vers in sorted(versions, key=v.Version.sortBytes)] == ordered
+ordered = ['1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta', '1.0.0-beta',
+           '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1', '1.0.0', '1.0.0+b1',
+           '1.0.0-r1', '1.0.1']
+versions = [v.Version(s) for s in reversed(ordered)]
+assert [str(vers) for vers in sorted(versions)] == ordered
+assert [str(vers) for vers in sorted(versions, key=v.Version.sortBytes)] == ordered
+assert v.Version('2016-10-17') < v.Version('2016-10-17.0') < v.Version('2017-01-01')
+
+assert v.Version('1.2') == v.Version('1.2.')
+assert v.Version('1.2') != v.Version('1.2 (dev)')
+assert v.Version('1.2') <= v.Version('1.2') < v.Version('1.3')
+assert len({v.Version('1.2'), v.Version('1.2.'), v.Version('1.3')}) == 2
+
+try:
+    v.Version('1.2') < v.Version('1.3 (dev)')
+except v.IncomparableException:
+    pass
+else:
+    assert False
+
+# Parsing is cached and equal versions share one instance.
+v.Version.clearCache()
+assert v.Version('4.5.') is v.Version('4.5')
+assert v.Version('4.5') is v.Version('4.5')
+info = v.Version.cacheInfo()
+assert (info.hits, info.misses) == (3, 1), info
+
+try:
+    v.Version('4.5').numbers = ('1',)
+except AttributeError:
+    pass
+else:
+    assert False
+
+# Pickling and copying go through the cache as well.
+version = v.Version('4.5-r2 (dev)')
+assert pickle.loads(pickle.dumps(version)) is version
+assert copy.copy(version) is version
+assert copy.deepcopy(version) is version
+data = pickle.dumps(version)
+v.Version.clearCache()
+assert pickle.loads(data) == version
+assert pickle.loads(data) is v.Version('4.5-r2 (dev)')
+
+# The cache is bounded.
+v.Version.parseCacheSize = 10
+for i in range(100):
+    v.Version('1.%d' % i)
+assert v.Version.cacheInfo().currsize == 10
+
+print("All version tests passed")